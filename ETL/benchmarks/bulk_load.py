@@ -0,0 +1,64 @@
+# python -m ETL.benchmarks.bulk_load (from the repo root, needs the training data)
+# Full load (create tables, staging, valid views, transf_loader) timed with the regular mode and with bulk mode
+# bulk mode: UNLOGGED staging tables, no secondary indexes while mapping, indexes rebuilt in parallel + ANALYZE at the end
+
+import time
+import argparse
+
+from ETL.db import get_engine
+from ETL.run_etl import create_databases
+from ETL.transformation.parallel_staging import load_staging_parallel
+from ETL.transformation.validation_loader import (
+    create_valid_accepted_kaggle,
+    create_valid_rejected_kaggle,
+    create_valid_accepted_hdma,
+    create_valid_rejected_hdma,
+)
+from ETL.load.transf_loader import run_transf_loader
+
+PHASES = ["create", "staging", "valid", "transf_loader"]
+
+def full_load(engine, bulk, seed = 42):
+    timings = {}
+
+    start = time.perf_counter()
+    create_databases(bulk=bulk)
+    timings["create"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    load_staging_parallel(sample=True, seed=seed, engine=engine)
+    timings["staging"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for create_valid in [create_valid_accepted_kaggle, create_valid_rejected_kaggle, create_valid_accepted_hdma, create_valid_rejected_hdma]:
+        create_valid(engine)
+    timings["valid"] = time.perf_counter() - start
+
+    # includes the index rebuild and ANALYZE in bulk mode
+    start = time.perf_counter()
+    run_transf_loader(engine, bulk=bulk)
+    timings["transf_loader"] = time.perf_counter() - start
+
+    timings["total"] = sum(timings.values())
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Regular vs bulk mode timing of a full load")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", default=None, help="database url, CRA_DB_URL / the ETL.db default when not given")
+    args = parser.parse_args()
+
+    engine = get_engine(args.url)
+    results = {}
+    for mode, bulk in [("regular", False), ("bulk", True)]:
+        print(f"=== full load, {mode} mode ===")
+        results[mode] = full_load(engine, bulk, args.seed)
+
+    print("=== bulk load benchmark ===")
+    print(f"{'phase':<14} {'regular s':>10} {'bulk s':>10} {'speedup':>8}")
+    for phase in PHASES + ["total"]:
+        before, after = results["regular"][phase], results["bulk"][phase]
+        print(f"{phase:<14} {before:>10.2f} {after:>10.2f} {before / after if after else 0.0:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# python -m ETL.benchmarks.cleaning_kernel_memory
+# Peak memory of the old z score outlier removal (df.copy() + z column) vs the cleaning kernel masks on a synthetic frame
+# each case runs in its own process so the peak RSS of one case does not hide the other
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+
+from ETL.ingestion.cleaning_kernel import filter_outliers, replace_where
+
+ROWS = 2_000_000
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #linux reports KB, mac reports bytes
+        return peak / 1024 if sys.platform != "darwin" else peak / (1024 * 1024)
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+
+def synthetic_frame(rows = ROWS, seed = 0):
+    """
+    Frame shaped like the cleaned Kaggle accepted loans (17 numeric + 5 text columns)
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"loan_amnt": rng.lognormal(9.5, 0.6, rows)})
+    for i in range(16):
+        df[f"num_{i}"] = rng.normal(0, 1, rows)
+    for i in range(5):
+        df[f"text_{i}"] = pd.Series(rng.choice(["RENT", "MORTGAGE", "OWN", "OTHER"], rows), dtype=object)
+    df.loc[df.index[::50], "num_0"] = -1
+    return df
+
+def legacy_clean(df = pd.DataFrame()):
+    """
+    The cleaning as it was before the kernel (remove_outliers / clean_data z score block)
+    """
+    df.loc[df["num_0"] < 0, "num_0"] = df["num_0"].mean()
+
+    loan_std = df["loan_amnt"].std()
+    loan_mean = df["loan_amnt"].mean()
+    temp_z_data = df.copy()
+    temp_z_data["z_loan"] = ((df["loan_amnt"] - loan_mean) / loan_std)
+    return temp_z_data[(temp_z_data["z_loan"].abs()) <= 3].drop(columns=["z_loan"])
+
+def kernel_clean(df = pd.DataFrame()):
+    """
+    The same cleaning with the cleaning kernel
+    """
+    replace_where(df, "num_0", df["num_0"] < 0, df["num_0"].mean())
+    return filter_outliers(df, "loan_amnt")
+
+def run_case(case = str, rows = ROWS):
+    df = synthetic_frame(rows)
+    before = peak_rss_mb()
+
+    start = time.perf_counter()
+    cleaned = legacy_clean(df) if case == "legacy" else kernel_clean(df)
+    elapsed = time.perf_counter() - start
+
+    after = peak_rss_mb()
+    print(json.dumps({
+        "case": case, "rows": rows, "kept_rows": len(cleaned), "seconds": round(elapsed, 2),
+        "peak_rss_before_mb": round(before), "peak_rss_after_mb": round(after), "extra_peak_mb": round(after - before),
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS of the old vs kernel outlier cleaning")
+    parser.add_argument("--case", choices=["legacy", "kernel"])
+    parser.add_argument("--rows", type=int, default=ROWS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(args.case, args.rows)
+        return
+
+    print(f"=== cleaning kernel memory benchmark ({args.rows} rows) ===")
+    results = []
+    for case in ("legacy", "kernel"):
+        out = subprocess.run(
+            [sys.executable, "-m", "ETL.benchmarks.cleaning_kernel_memory", "--case", case, "--rows", str(args.rows)],
+            capture_output=True, text=True, check=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    for r in results:
+        print(
+            f"{r['case']:>7}: frame peak {r['peak_rss_before_mb']} MB -> peak after cleaning {r['peak_rss_after_mb']} MB "
+            f"(+{r['extra_peak_mb']} MB) in {r['seconds']}s, kept {r['kept_rows']} rows"
+        )
+
+if __name__ == "__main__":
+    main()
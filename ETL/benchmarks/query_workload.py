@@ -0,0 +1,461 @@
+# python -m ETL.benchmarks.query_workload --rows 200000 [--workload queries.json] [--out report.json]
+# Runs the query workload of the warehouse (ML training view, mapping joins, notebook queries) against the core tables filled
+# with synthetic rows, in a scratch schema (bench_workload) that is dropped at the end
+# - every query: latency percentiles + EXPLAIN (ANALYZE, BUFFERS) summary
+# - every index of database/indexing.sql: latency lost and insert time saved when it is dropped
+# - index advisor: partial / covering / composite indexes for the selective sequential scans of the workload, each one measured
+# every index change runs inside a transaction that is rolled back, so the schema is the same for each measurement
+
+import re
+import json
+import time
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from ETL.db import get_engine
+from ETL.load.bulk_mode import DATABASE_DIR, secondary_indexes
+from ETL.load.partitions import YEARLY_PARTITIONS, create_partition
+from ETL.ml.ml_training_acc import create_accepted_loans_training_view
+
+SCHEMA = "bench_workload"
+ROWS = 200_000
+REPEATS = 20
+
+# rows inserted (and rolled back) to measure what an index costs every load, the median of WRITE_RUNS inserts is kept
+WRITE_ROWS = 10_000
+WRITE_RUNS = 3
+
+# a sequential scan that keeps at most this fraction of its rows is worth an index
+SELECTIVITY = 0.2
+# equality filters on columns with fewer distinct values become the predicate of a partial index
+LOW_CARDINALITY = 50
+# output columns added to an index with INCLUDE (index only scans), more than this and no INCLUDE is suggested
+MAX_INCLUDE = 4
+# an index is worth keeping when dropping it slows a query down by this fraction of its p50
+MIN_GAIN = 0.05
+
+# recorded workload, name -> SQL (replace with --workload, a JSON file of the same shape)
+WORKLOAD = {
+    # ml.ipynb / ETL/ml
+    "ml_training_view": "SELECT * FROM accepted_loans_ml_training",
+    "ml_training_counts": "SELECT is_default, COUNT(*) FROM accepted_loans_ml_training GROUP BY is_default",
+    # notebook queries
+    "ltv_not_null": "SELECT COUNT(*) FROM Accepted_Loans WHERE loan_to_value_ratio IS NOT NULL",
+    "status_charged_off": "SELECT COUNT(*), AVG(int_rate) FROM Accepted_Loans WHERE loan_status = 'Charged Off'",
+    "joint_applications": "SELECT loan_id, loan_amnt, int_rate FROM Accepted_Loans WHERE dataset_source = 'kaggle' AND application_type = 'Joint App'",
+    "purpose_summary": "SELECT purpose, COUNT(*), AVG(loan_amnt) FROM Accepted_Loans WHERE dataset_source = 'kaggle' GROUP BY purpose",
+    "rejected_hdma_2023": "SELECT COUNT(*), AVG(dti) FROM Rejected WHERE dataset_source = 'hdma' AND activity_year = 2023",
+    "rejected_high_dti": "SELECT COUNT(*) FROM Rejected WHERE dataset_source = 'kaggle' AND dti > 33",
+    "rejected_denials": "SELECT denial_reason_1, COUNT(*) FROM Rejected WHERE dataset_source = 'hdma' GROUP BY denial_reason_1",
+    "collateral_denials": "SELECT COUNT(*), AVG(loan_amount) FROM Rejected WHERE dataset_source = 'hdma' AND denial_reason_1 = '4'",
+    "high_rate_long_term": "SELECT loan_id, int_rate FROM Accepted_Loans WHERE dataset_source = 'kaggle' AND term_months = 60 AND int_rate > 28",
+    # mapping joins / lookups
+    "top_fico_loans": "SELECT al.loan_id, al.loan_amnt, b.fico_range_low FROM Accepted_Loans al JOIN Borrowers b ON b.borrower_id = al.borrower_id WHERE b.fico_range_low >= 840",
+    "borrower_loans": "SELECT loan_id, loan_amnt FROM Accepted_Loans WHERE borrower_id = 4242",
+    "recent_loads": "SELECT COUNT(*) FROM Accepted_Loans WHERE created_at >= now() - interval '5 minutes'",
+}
+
+#synthetic data -----------
+# filled in this order, :rows is the number of Kaggle accepted loans (see synthetic_sizes)
+SYNTHETIC_SQL = [
+    ("borrowers", """
+        INSERT INTO Borrowers (
+            fingerprint, annual_inc, dti, delinq_2yrs, fico_range_low, fico_range_high, inq_last_6mths, open_acc, total_acc,
+            revol_bal, revol_util, pub_rec_bankruptcies, home_ownership, verification_status,
+            income, debt_to_income_ratio, applicant_credit_score_type, co_applicant_credit_score_type
+        )
+        SELECT
+            md5('borrower' || i)::UUID, round((15000 + random() * 185000)::NUMERIC, 2), round((random() * 35)::NUMERIC, 2),
+            (random() * 3)::INT, fico, fico + 4, (random() * 5)::INT, (random() * 15)::INT, (random() * 20)::INT,
+            round((random() * 50000)::NUMERIC, 2), round((random() * 100)::NUMERIC, 2), (random() * 2)::INT,
+            (ARRAY['RENT', 'MORTGAGE', 'OWN'])[1 + (random() * 2)::INT],
+            (ARRAY['Verified', 'Not Verified', 'Source Verified'])[1 + (random() * 2)::INT],
+            round((15000 + random() * 185000)::NUMERIC, 2), round((random() * 60)::NUMERIC, 2),
+            (1 + (random() * 8)::INT)::TEXT, (1 + (random() * 9)::INT)::TEXT
+        FROM (SELECT i, 600 + (random() * 245)::INT AS fico FROM generate_series(1, :borrowers) i) g
+    """),
+    ("accepted_loans_kaggle", """
+        INSERT INTO accepted_loans_kaggle (
+            loan_id, dataset_source, borrower_id, loan_amnt, funded_amnt, term_months, int_rate, installment, income, dti,
+            loan_status, purpose, application_type
+        )
+        SELECT
+            i, 'kaggle', 1 + i % :borrowers, amount, amount, term, rate, round(amount / term * (1 + rate / 100), 2),
+            round((15000 + random() * 185000)::NUMERIC, 2), round((random() * 35)::NUMERIC, 2),
+            CASE WHEN r < 0.45 THEN 'Fully Paid' WHEN r < 0.80 THEN 'Current' WHEN r < 0.92 THEN 'Charged Off'
+                 WHEN r < 0.95 THEN 'Late (31-120 days)' WHEN r < 0.96 THEN 'Default' ELSE 'In Grace Period' END,
+            (ARRAY['debt_consolidation', 'credit_card', 'home_improvement', 'other', 'major_purchase', 'car'])[1 + (random() * 5)::INT],
+            CASE WHEN random() < 0.05 THEN 'Joint App' ELSE 'Individual' END
+        FROM (
+            SELECT i, round((1000 + random() * 39000)::NUMERIC, 2) AS amount, (ARRAY[36, 60])[1 + (random() * 1)::INT] AS term,
+                   round((5 + random() * 25)::NUMERIC, 2) AS rate, random() AS r
+            FROM generate_series(1, :rows) i
+        ) g
+    """),
+    ("accepted_loans_hdma", """
+        INSERT INTO accepted_loans_hdma (
+            loan_id, dataset_source, borrower_id, loan_amnt, term_months, income, dti, activity_year, action_taken, preapproval,
+            loan_to_value_ratio, derived_loan_product_type, loan_purpose
+        )
+        SELECT
+            nextval('hdma_loan_id_seq'), 'hdma', 1 + i % :borrowers, round((20000 + random() * 480000)::NUMERIC, 2),
+            (ARRAY[180, 360])[1 + (random() * 1)::INT], round((20000 + random() * 280000)::NUMERIC, 2),
+            round((random() * 60)::NUMERIC, 2), 2022 + i % 2, 1, 1 + (random() * 1)::INT, round((50 + random() * 50)::NUMERIC, 2),
+            (ARRAY['Conventional:First Lien', 'FHA:First Lien', 'VA:First Lien'])[1 + (random() * 2)::INT],
+            (1 + (random() * 4)::INT)::TEXT
+        FROM generate_series(1, :hdma) i
+    """),
+    ("rejected_kaggle", """
+        INSERT INTO rejected_kaggle (dataset_source, amount_requested, application_date, loan_title, dti)
+        SELECT
+            'kaggle', round((1000 + random() * 39000)::NUMERIC, 2), DATE '2007-01-01' + i % 4383,
+            (ARRAY['debt_consolidation', 'credit_card', 'home_improvement', 'other'])[1 + (random() * 3)::INT],
+            round((random() * 35)::NUMERIC, 2)
+        FROM generate_series(1, :rejected) i
+    """),
+    ("rejected_hdma", """
+        INSERT INTO rejected_hdma (
+            dataset_source, dti, activity_year, action_taken, preapproval, loan_purpose, loan_amount, loan_term, loan_to_value_ratio,
+            income, derived_loan_product_type, applicant_credit_score_type, co_applicant_credit_score_type, denial_reason_1
+        )
+        SELECT
+            'hdma', round((random() * 60)::NUMERIC, 2), 2022 + i % 2, 3, 1 + (random() * 1)::INT, (1 + (random() * 4)::INT)::TEXT,
+            round((20000 + random() * 480000)::NUMERIC, 2), (ARRAY[180, 360])[1 + (random() * 1)::INT],
+            round((50 + random() * 50)::NUMERIC, 2), round((20000 + random() * 280000)::NUMERIC, 2),
+            (ARRAY['Conventional:First Lien', 'FHA:First Lien', 'VA:First Lien'])[1 + (random() * 2)::INT],
+            (1 + (random() * 8)::INT)::TEXT, (1 + (random() * 9)::INT)::TEXT, (1 + (random() * 9)::INT)::TEXT
+        FROM generate_series(1, :hdma) i
+    """),
+]
+
+# yearly partitions the synthetic rows fall in
+SYNTHETIC_YEARS = {
+    "accepted_loans_hdma": [2022, 2023],
+    "rejected_kaggle": list(range(2007, 2019)),
+    "rejected_hdma": [2022, 2023],
+}
+
+def synthetic_sizes(rows: int) -> Dict[str, int]:
+    return {"rows": rows, "borrowers": max(1, rows // 2), "hdma": max(1, rows // 2), "rejected": rows * 2}
+
+def create_workload_schema(engine, rows: int = ROWS, seed: float = 0.42) -> None:
+    """
+    Creates the warehouse schema (database.sql + indexing.sql) in SCHEMA and fills it with synthetic rows
+    """
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}"))
+        with open(DATABASE_DIR / "database.sql", "r") as f:
+            conn.execute(text(f.read()))
+        for parent, years in SYNTHETIC_YEARS.items():
+            for year in years:
+                create_partition(conn, parent, year)
+
+        conn.execute(text("SELECT setseed(:seed)"), {"seed": seed})
+        sizes = synthetic_sizes(rows)
+        for table, sql in SYNTHETIC_SQL:
+            start = time.perf_counter()
+            conn.execute(text(sql), sizes)
+            print(f"[query_workload] filled {table} in {time.perf_counter() - start:.2f}s")
+
+        with open(DATABASE_DIR / "indexing.sql", "r") as f:
+            conn.execute(text(f.read()))
+        conn.execute(text("ANALYZE"))
+
+    create_accepted_loans_training_view(engine)
+
+#measurements -----------
+# a relation and its partitions (pg_partition_tree returns nothing for a relation that is not partitioned)
+TREE_SQL = "(SELECT CAST(:name AS regclass) AS relid UNION SELECT relid FROM pg_partition_tree(CAST(:name AS regclass)))"
+
+def time_query(conn, sql: str, repeats: int = REPEATS) -> List[float]:
+    # latencies in ms, after one warm up run (rows are fetched, as the notebooks do)
+    conn.execute(text(sql)).fetchall()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        conn.execute(text(sql)).fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+def explain(conn, sql: str) -> Dict:
+    # EXPLAIN (ANALYZE, BUFFERS) as JSON, VERBOSE adds the output columns of every node (used for INCLUDE columns)
+    plan = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, VERBOSE, FORMAT JSON) {sql}")).scalar()
+    return plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+
+def plan_nodes(node: Dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+def plan_summary(explained: Dict) -> Dict:
+    top = explained["Plan"]
+    scans = []
+    for node in plan_nodes(top):
+        if "Relation Name" in node:
+            using = f" using {node['Index Name']}" if "Index Name" in node else ""
+            scans.append(f"{node['Node Type']}{using} on {node['Relation Name']}")
+    return {
+        "execution_ms": explained.get("Execution Time"),
+        "shared_hit": top.get("Shared Hit Blocks", 0),
+        "shared_read": top.get("Shared Read Blocks", 0),
+        "scans": scans,
+    }
+
+def run_workload(conn, workload: Dict[str, str], repeats: int = REPEATS) -> Dict[str, Dict]:
+    results = {}
+    for name, sql in workload.items():
+        explained = explain(conn, sql)
+        results[name] = {"latency": percentiles(time_query(conn, sql, repeats)), "plan": plan_summary(explained), "explain": explained}
+    return results
+
+def insert_cost(conn, table: str, rows: int = WRITE_ROWS) -> float:
+    """
+    ms to insert rows copies of existing rows into table (a core table or one of its partitions), rolled back right after (median of WRITE_RUNS)
+
+    Unique columns of the table (or of its partitions) get new values: UUIDs are regenerated, integers are shifted past the current maximum
+    """
+    unique = conn.execute(text(
+        f"""
+        SELECT DISTINCT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM {TREE_SQL} pt
+        JOIN pg_index i ON i.indrelid = pt.relid AND i.indisunique
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        """
+    ), {"name": table}).fetchall()
+    columns = [row[0] for row in conn.execute(text(
+        "SELECT attname FROM pg_attribute WHERE attrelid = CAST(:table AS regclass) AND attnum > 0 AND NOT attisdropped ORDER BY attnum"
+    ), {"table": table})]
+
+    expressions = {column: column for column in columns}
+    for column, column_type in unique:
+        if column_type == "uuid":
+            expressions[column] = "gen_random_uuid()"
+        else:
+            offset = conn.execute(text(f"SELECT COALESCE(MAX({column}), 0) FROM {table}")).scalar()
+            expressions[column] = f"{column} + {int(offset)}"
+
+    sql = text(f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(expressions[c] for c in columns)} FROM {table} LIMIT {rows}")
+    timings = []
+    for _ in range(WRITE_RUNS):
+        savepoint = conn.begin_nested()
+        start = time.perf_counter()
+        conn.execute(sql)
+        timings.append((time.perf_counter() - start) * 1000)
+        savepoint.rollback()
+    return float(np.median(timings))
+
+def relation_size(conn, name: str) -> int:
+    # bytes of an index, with the indexes of every partition for an index on a partitioned table
+    return conn.execute(
+        text(f"SELECT COALESCE(SUM(pg_relation_size(relid)), 0) FROM {TREE_SQL} tree"),
+        {"name": name},
+    ).scalar()
+
+def index_tree(conn, name: str) -> List[str]:
+    # an index and the indexes it created on each partition (the names plans show)
+    return [row[0] for row in conn.execute(text(f"SELECT relid::regclass::TEXT FROM {TREE_SQL} tree"), {"name": name})]
+
+def queries_using(results: Dict[str, Dict], names: List[str]) -> List[str]:
+    return [query for query, result in results.items() if any(f"using {name} on" in scan for scan in result["plan"]["scans"] for name in names)]
+
+#existing indexes -----------
+def evaluate_existing(engine, workload: Dict[str, str], results: Dict[str, Dict], repeats: int, write_rows: int) -> List[Dict]:
+    """
+    Measures every index of indexing.sql: it is dropped inside a transaction, the queries that used it are timed again and the
+    insert time of its table is compared, then the transaction is rolled back
+    """
+    report = []
+    for index in secondary_indexes():
+        with engine.connect() as conn:
+            transaction = conn.begin()
+            try:
+                names = index_tree(conn, index["name"])
+                used_by = queries_using(results, [name.split(".")[-1] for name in names])
+                size = relation_size(conn, index["name"])
+                write_with = insert_cost(conn, index["table"], write_rows)
+
+                conn.execute(text(f"DROP INDEX {index['name']}"))
+                write_without = insert_cost(conn, index["table"], write_rows)
+                slowdown = {
+                    query: percentiles(time_query(conn, workload[query], repeats))["p50"] - results[query]["latency"]["p50"]
+                    for query in used_by
+                }
+            finally:
+                transaction.rollback()
+
+        helps = any(slowdown[query] > MIN_GAIN * results[query]["latency"]["p50"] for query in slowdown)
+        verdict = "keep" if helps else ("no gain" if used_by else "unused")
+        report.append({
+            "index": index["name"],
+            "table": index["table"],
+            "size_kb": size / 1024,
+            "used_by": used_by,
+            "gain_ms": slowdown,
+            "write_ms": write_with - write_without,
+            "verdict": verdict,
+        })
+    return report
+
+#advisor -----------
+# "column op constant" inside a plan filter, ex: ((accepted_loans_kaggle.loan_status)::text = 'Charged Off'::text)
+CONDITION_RE = re.compile(r"\(*(?:\w+\.)?(\w+)\)*(?:::[\w ]+?)?\s*(=|<>|>=|<=|>|<)\s*('(?:[^']|'')*'|-?[\d.]+)")
+
+def column_distinct(conn, table: str, column: str) -> Optional[float]:
+    # pg_stats n_distinct: > 0 distinct values, < 0 fraction of the rows (a unique-ish column)
+    return conn.execute(
+        text("SELECT n_distinct FROM pg_stats WHERE tablename = :table AND attname = :column AND schemaname = current_schema()"),
+        {"table": table, "column": column},
+    ).scalar()
+
+def suggest_index(conn, node: Dict) -> Optional[Dict]:
+    """
+    Index for a sequential scan that filters out most of its rows
+
+    equality on a low cardinality column -> partial index predicate, other equalities then one range column -> index keys (composite),
+    the other columns the scan outputs -> INCLUDE (covering, for index only scans)
+    """
+    rows = node.get("Actual Rows", 0)
+    total = rows + node.get("Rows Removed by Filter", 0)
+    if node["Node Type"] != "Seq Scan" or "Filter" not in node or not total or rows / total > SELECTIVITY:
+        return None
+
+    scanned = node["Relation Name"]
+    keys, ranges, predicates = [], [], []
+    for column, op, value in CONDITION_RE.findall(node["Filter"]):
+        distinct = column_distinct(conn, scanned, column)
+        if distinct == 1:
+            # partition keys are constant inside the partition
+            continue
+        if op == "=" and distinct is not None and 0 < distinct <= LOW_CARDINALITY:
+            predicates.append(f"{column} = {value}")
+        elif op == "=":
+            keys.append(column)
+        elif op != "<>":
+            ranges.append(column)
+    keys = list(dict.fromkeys(keys + ranges[:1]))
+    if not keys and predicates:
+        keys = [predicates[0].split(" = ")[0]]
+    if not keys:
+        return None
+
+    outputs = [column.split(".")[-1] for column in node.get("Output", []) if re.fullmatch(r"(\w+\.)?\w+", column)]
+    include = [column for column in dict.fromkeys(outputs) if column not in keys]
+    include = include if len(include) <= MAX_INCLUDE else []
+
+    # a yearly partition gets the index through its source partition, so every year (and the ones added later) has it
+    parent = conn.execute(text("SELECT inhparent::regclass::TEXT FROM pg_inherits WHERE inhrelid = CAST(:name AS regclass)"), {"name": scanned}).scalar()
+    table = parent if parent in YEARLY_PARTITIONS else scanned
+
+    kinds = [kind for kind, used in [("partial", predicates), ("covering", include), ("composite", len(keys) > 1)] if used]
+    name = f"adv_{table}_{'_'.join(keys)}"[:60]
+    sql = f"CREATE INDEX {name} ON {table} ({', '.join(keys)})"
+    if include:
+        sql += f" INCLUDE ({', '.join(include)})"
+    if predicates:
+        sql += f" WHERE {' AND '.join(predicates)}"
+    return {"name": name, "table": table, "sql": sql, "kind": "+".join(kinds) or "btree"}
+
+def suggest_indexes(engine, results: Dict[str, Dict]) -> List[Dict]:
+    # candidates of every query, the same index suggested by several queries is measured once for all of them
+    candidates = {}
+    with engine.connect() as conn:
+        for query, result in results.items():
+            for node in plan_nodes(result["explain"]["Plan"]):
+                candidate = suggest_index(conn, node)
+                if candidate is not None:
+                    candidates.setdefault(candidate["sql"], {**candidate, "queries": []})["queries"].append(query)
+    return list(candidates.values())
+
+def evaluate_candidate(engine, workload: Dict[str, str], results: Dict[str, Dict], candidate: Dict, repeats: int, write_rows: int) -> Dict:
+    # the index is built inside a transaction that is rolled back, the queries that suggested it are timed again with it
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            write_without = insert_cost(conn, candidate["table"], write_rows)
+            start = time.perf_counter()
+            conn.execute(text(candidate["sql"]))
+            build_s = time.perf_counter() - start
+            conn.execute(text(f"ANALYZE {candidate['table']}"))
+
+            gain, used = {}, False
+            for query in candidate["queries"]:
+                p50 = percentiles(time_query(conn, workload[query], repeats))["p50"]
+                gain[query] = results[query]["latency"]["p50"] - p50
+                used = used or candidate["name"] in json.dumps(explain(conn, workload[query]))
+            size = relation_size(conn, candidate["name"])
+            write_with = insert_cost(conn, candidate["table"], write_rows)
+        finally:
+            transaction.rollback()
+
+    return {**candidate, "used": used, "gain_ms": gain, "build_s": build_s, "size_kb": size / 1024, "write_ms": write_with - write_without}
+
+#report -----------
+def print_report(results: Dict[str, Dict], existing: List[Dict], suggested: List[Dict], write_rows: int) -> None:
+    print("=== query workload ===")
+    print(f"{'query':<22} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'hit':>8} {'read':>7}  scans")
+    for query, result in results.items():
+        latency, plan = result["latency"], result["plan"]
+        print(f"{query:<22} {latency['p50']:>9.2f} {latency['p95']:>9.2f} {latency['p99']:>9.2f} {plan['shared_hit']:>8} {plan['shared_read']:>7}  {'; '.join(plan['scans'][:3])}")
+
+    print(f"=== indexes of indexing.sql (write = extra ms per {write_rows} inserted rows) ===")
+    print(f"{'index':<40} {'size kB':>9} {'write ms':>9}  {'verdict':<8} gain ms per query")
+    for index in existing:
+        gains = ", ".join(f"{query} {gain:+.2f}" for query, gain in index["gain_ms"].items()) or "not used by the workload"
+        print(f"{index['index']:<40} {index['size_kb']:>9.0f} {index['write_ms']:>9.2f}  {index['verdict']:<8} {gains}")
+
+    print("=== suggested indexes ===")
+    if not suggested:
+        print("no selective sequential scans in the workload")
+    for candidate in suggested:
+        gains = ", ".join(f"{query} {gain:+.2f}" for query, gain in candidate["gain_ms"].items())
+        print(f"[{candidate['kind']}] {candidate['sql']}")
+        print(f"    used={candidate['used']} gain ms: {gains} | size {candidate['size_kb']:.0f} kB, build {candidate['build_s']:.2f}s, write +{candidate['write_ms']:.2f} ms per {write_rows} rows")
+
+def main():
+    parser = argparse.ArgumentParser(description="Query workload benchmark and index advisor for the warehouse schema")
+    parser.add_argument("--rows", type=int, default=ROWS, help="synthetic Kaggle accepted loans (the other tables are sized from it)")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="timed runs per query")
+    parser.add_argument("--write-rows", type=int, default=WRITE_ROWS, help="rows inserted to measure the write cost of an index")
+    parser.add_argument("--workload", default=None, help="JSON file of query name -> SQL, the built in WORKLOAD when not given")
+    parser.add_argument("--out", default=None, help="write the full report (with the EXPLAIN plans) to this JSON file")
+    parser.add_argument("--keep", action="store_true", help=f"keep the {SCHEMA} schema")
+    parser.add_argument("--url", default=None, help="database url, CRA_DB_URL / the ETL.db default when not given")
+    args = parser.parse_args()
+
+    workload = WORKLOAD
+    if args.workload:
+        with open(args.workload, "r") as f:
+            workload = json.load(f)
+
+    engine = get_engine(args.url, search_path=SCHEMA)
+    try:
+        print(f"=== creating {SCHEMA} with {args.rows} synthetic loans ===")
+        create_workload_schema(engine, args.rows)
+
+        with engine.connect() as conn:
+            results = run_workload(conn, workload, args.repeats)
+        existing = evaluate_existing(engine, workload, results, args.repeats, args.write_rows)
+        suggested = [
+            evaluate_candidate(engine, workload, results, candidate, args.repeats, args.write_rows)
+            for candidate in suggest_indexes(engine, results)
+        ]
+        print_report(results, existing, suggested, args.write_rows)
+
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump({"rows": args.rows, "workload": results, "existing": existing, "suggested": suggested}, f, indent=2, default=str)
+            print(f"[query_workload] report written to {args.out}")
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# python -m ETL.benchmarks.staging_write --rows 200000,2000000
+# Time to write a synthetic staging_accepted_kaggle frame with to_sql multi row INSERTs vs COPY FROM STDIN
+# rows go to a scratch copy of the staging table (bench_staging_write) that is dropped at the end
+
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from ETL.db import get_engine
+from ETL.ingestion.dtype_plan import apply_dtype_plan
+from ETL.transformation.staging_loader import STAGING_COLUMNS, write_df_to_table
+
+SOURCE_TABLE = "staging_accepted_kaggle"
+BENCH_TABLE = "bench_staging_write"
+ROWS = [200_000, 2_000_000]
+
+def synthetic_frame(rows = 200_000, seed = 0):
+    """
+    Frame with the columns and compact dtypes of the cleaned Kaggle accepted loans
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "id": np.arange(rows),
+        "loan_amnt": rng.integers(1_000, 40_000, rows).astype("float64"),
+        "funded_amnt": rng.integers(1_000, 40_000, rows).astype("float64"),
+        "term_months": rng.choice([36, 60], rows),
+        "int_rate": rng.uniform(5, 30, rows).round(2),
+        "installment": rng.uniform(30, 1_500, rows).round(2),
+        "annual_inc": rng.lognormal(11, 0.5, rows).round(2),
+        "dti": rng.uniform(0, 40, rows).round(2),
+        "revol_bal": rng.lognormal(9, 1, rows).round(2),
+        "revol_util": rng.uniform(0, 100, rows).round(2),
+    })
+    for column, high in [("delinq_2yrs", 5), ("inq_last_6mths", 6), ("open_acc", 40), ("total_acc", 80), ("pub_rec_bankruptcies", 3)]:
+        df[column] = rng.integers(0, high, rows)
+    df["fico_range_low"] = rng.integers(600, 850, rows)
+    df["fico_range_high"] = df["fico_range_low"] + 4
+    for column, values in [
+        ("home_ownership", ["RENT", "MORTGAGE", "OWN"]),
+        ("loan_status", ["Fully Paid", "Current", "Charged Off"]),
+        ("purpose", ["debt_consolidation", "credit_card", "other"]),
+        ("application_type", ["Individual", "Joint App"]),
+        ("verification_status", ["Verified", "Not Verified", "Source Verified"]),
+    ]:
+        df[column] = rng.choice(values, rows)
+    return apply_dtype_plan(df[STAGING_COLUMNS[SOURCE_TABLE]], SOURCE_TABLE, verbose=False)
+
+def time_write(engine, df, method):
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}; CREATE TABLE {BENCH_TABLE} (LIKE {SOURCE_TABLE})"))
+
+    start = time.perf_counter()
+    inserted = write_df_to_table(engine, df, BENCH_TABLE, "append", 5000, method=method)
+    return inserted, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="to_sql multi INSERT vs COPY FROM STDIN for the staging tables")
+    parser.add_argument("--rows", default=",".join(str(r) for r in ROWS), help="comma separated row counts")
+    parser.add_argument("--methods", default="insert,copy", help="comma separated write methods")
+    parser.add_argument("--url", default=None, help="database url, CRA_DB_URL / the ETL.db default when not given")
+    args = parser.parse_args()
+
+    engine = get_engine(args.url)
+    print(f"=== staging write benchmark ({SOURCE_TABLE} columns) ===")
+    try:
+        for rows in [int(r) for r in args.rows.split(",")]:
+            df = synthetic_frame(rows)
+            timings = {}
+            for method in args.methods.split(","):
+                inserted, seconds = time_write(engine, df, method)
+                timings[method] = seconds
+                print(f"{rows:>9} rows {method:>6}: {seconds:8.2f}s ({inserted / seconds:,.0f} rows/s)")
+            if "insert" in timings and "copy" in timings:
+                print(f"{rows:>9} rows  copy is x{timings['insert'] / timings['copy']:.1f} faster")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#shared engine factory: every ETL / ML entry point gets its connections from get_engine
+#settings come from a JSON file (CRA_DB_CONFIG) and CRA_DB_* environment variables, the environment wins
+#statements are timed per stage (db_stage) so each step of run_etl reports how long it spent in the database
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+DB_URL = "postgresql+psycopg2:///credit_risk"
+
+# setting -> (environment variable, default)
+DB_SETTINGS = {
+    "url": ("CRA_DB_URL", DB_URL),
+    "pool_size": ("CRA_DB_POOL_SIZE", 5),
+    "max_overflow": ("CRA_DB_MAX_OVERFLOW", 10),
+    # psycopg2 executemany: "values_only" batches INSERTs in multi row VALUES, "values_plus_batch" also batches UPDATE / DELETE
+    "executemany_mode": ("CRA_DB_EXECUTEMANY_MODE", "values_plus_batch"),
+    "batch_size": ("CRA_DB_BATCH_SIZE", 1000),
+    # per session settings, 0 / "" keeps the server default
+    "statement_timeout_ms": ("CRA_DB_STATEMENT_TIMEOUT_MS", 0),
+    "work_mem": ("CRA_DB_WORK_MEM", ""),
+    # schemas searched for unqualified table names, ex: the scratch schema of ETL/benchmarks/query_workload.py
+    "search_path": ("CRA_DB_SEARCH_PATH", ""),
+    # statements slower than this are printed one by one (0 turns it off)
+    "slow_ms": ("CRA_DB_SLOW_MS", 1000),
+}
+
+# stage -> {"statements", "seconds"}, filled by the cursor hooks of every engine made here
+STATS = {"stage": "default", "stages": {}}
+STATS_LOCK = threading.Lock()
+
+ENGINES: Dict[tuple, Engine] = {}
+
+#helpers -----------
+def load_settings(config_path: Optional[str] = None) -> Dict:
+    """
+    Params:
+        config_path (None as default) : JSON file with any of the DB_SETTINGS keys, CRA_DB_CONFIG when None
+
+    Returns:
+        dict of setting -> value (defaults < config file < environment)
+    """
+    settings = {name: default for name, (_, default) in DB_SETTINGS.items()}
+
+    config_path = config_path or os.environ.get("CRA_DB_CONFIG")
+    if config_path:
+        try:
+            with open(config_path, "r") as f:
+                settings.update({k: v for k, v in json.load(f).items() if k in DB_SETTINGS})
+        except (OSError, ValueError) as e:
+            print(f"[db] could not read {config_path}: {e}")
+
+    for name, (env, default) in DB_SETTINGS.items():
+        if env in os.environ:
+            settings[name] = os.environ[env]
+        if isinstance(default, int):
+            settings[name] = int(settings[name])
+    return settings
+
+def session_options(settings: Dict) -> str:
+    # libpq "options" so statement_timeout / work_mem are set on every new connection of the pool
+    options = []
+    if settings["statement_timeout_ms"]:
+        options.append(f"-c statement_timeout={settings['statement_timeout_ms']}")
+    if settings["work_mem"]:
+        options.append(f"-c work_mem={settings['work_mem']}")
+    if settings["search_path"]:
+        options.append(f"-c search_path={settings['search_path'].replace(' ', '')}")
+    return " ".join(options)
+
+def record_time(seconds: float, statement: str = "", slow_ms: int = 0) -> None:
+    # adds a statement to the current stage, also used for the raw COPY cursors that bypass the engine events
+    with STATS_LOCK:
+        stage = STATS["stages"].setdefault(STATS["stage"], {"statements": 0, "seconds": 0.0})
+        stage["statements"] += 1
+        stage["seconds"] += seconds
+    if slow_ms and seconds * 1000 >= slow_ms:
+        print(f"[db] slow statement ({seconds:.2f}s): {' '.join(statement.split())[:100]}")
+
+def attach_timing(engine: Engine, slow_ms: int) -> None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record_time(time.perf_counter() - conn.info["query_start"].pop(), statement, slow_ms)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # failed statements never reach after_cursor_execute
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            record_time(time.perf_counter() - starts.pop(), context.statement or "", 0)
+
+# engine -----------
+def get_engine(url: Optional[str] = None, config_path: Optional[str] = None, **overrides) -> Engine:
+    """
+    Engine built from the shared settings, one per url, settings and process (pools are not shared across fork)
+
+    Params:
+        url (None as default) : database url, the "url" setting (CRA_DB_URL) when None
+        config_path (None as default) : JSON settings file, CRA_DB_CONFIG when None
+        overrides : any of the DB_SETTINGS keys, win over the config file and the environment (ex: search_path="bench")
+    """
+    settings = load_settings(config_path)
+    settings.update({k: v for k, v in overrides.items() if k in DB_SETTINGS})
+    url = url or settings["url"]
+    key = (url, os.getpid(), tuple(sorted(settings.items())))
+    if key in ENGINES:
+        return ENGINES[key]
+
+    kwargs = {
+        "pool_size": settings["pool_size"],
+        "max_overflow": settings["max_overflow"],
+        "pool_pre_ping": True,
+    }
+    if url.startswith("postgresql+psycopg2"):
+        kwargs["executemany_mode"] = settings["executemany_mode"]
+        kwargs["insertmanyvalues_page_size"] = settings["batch_size"]
+        kwargs["executemany_batch_page_size"] = settings["batch_size"]
+        options = session_options(settings)
+        if options:
+            kwargs["connect_args"] = {"options": options}
+
+    engine = create_engine(url, **kwargs)
+    attach_timing(engine, settings["slow_ms"])
+    ENGINES[key] = engine
+    return engine
+
+# stage timing -----------
+@contextmanager
+def db_stage(name: str):
+    """
+    Statements run inside the block are counted under name, the time spent in the database is printed at the end
+    """
+    with STATS_LOCK:
+        previous = STATS["stage"]
+        STATS["stage"] = name
+        before = dict(STATS["stages"].get(name, {"statements": 0, "seconds": 0.0}))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with STATS_LOCK:
+            STATS["stage"] = previous
+            after = STATS["stages"].get(name, {"statements": 0, "seconds": 0.0})
+        statements = after["statements"] - before["statements"]
+        seconds = after["seconds"] - before["seconds"]
+        print(f"[db] {name}: {statements} statements, {seconds:.2f}s in the database ({time.perf_counter() - start:.2f}s wall)")
+
+def db_report() -> Dict[str, Dict]:
+    # stage -> {"statements", "seconds"} since the process started
+    with STATS_LOCK:
+        return {stage: dict(values) for stage, values in STATS["stages"].items()}
@@ -0,0 +1,150 @@
+import os
+import time
+from pathlib import Path
+from ETL.ingestion.parquet_cache import MANIFEST_NAME, LOCK_NAME, load_manifest, save_manifest, manifest_lock, update_manifest
+
+#Disk budget of the 'training data' folder in MB, can be changed with the CRA_CACHE_BUDGET_MB environment variable
+CACHE_BUDGET_MB = 20_000
+BUDGET_ENV = "CRA_CACHE_BUDGET_MB"
+
+#Files with these suffixes are downloaded sources, everything else in the folder is derived from them
+RAW_SUFFIXES = (".csv", ".gz", ".gzip", ".zip")
+
+def cache_budget_mb(budget_mb = None):
+    """
+    Returns the disk budget in MB, budget_mb if given else the CRA_CACHE_BUDGET_MB environment variable else CACHE_BUDGET_MB
+    """
+    if budget_mb is not None:
+        return float(budget_mb)
+    return float(os.environ.get(BUDGET_ENV, CACHE_BUDGET_MB))
+
+def artifact_kind(path = Path):
+    """
+    'raw' for downloaded files, 'derived' for files built from them (parquet cache, imputation statistics ...)
+    """
+    return "raw" if Path(path).suffix.lower() in RAW_SUFFIXES else "derived"
+
+def dir_size(path = Path):
+    """
+    Returns the size in bytes of a file or of every file under a directory
+    """
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, f))
+            except OSError:
+                continue
+    return total
+
+def record_artifact(DATA = Path, manifest = dict, path = Path, kind = None, used_at = None):
+    """
+    Updates the size and last use time of one file in a loaded manifest (the manifest is not saved)
+    """
+    path = Path(path)
+    key = str(path.relative_to(DATA))
+    manifest["artifacts"][key] = {
+        "size": path.stat().st_size,
+        "last_used": time.time() if used_at is None else used_at,
+        "kind": kind or artifact_kind(path),
+    }
+
+def touch_artifacts(DATA = Path, paths = list, kind = None):
+    """
+    Marks files of the 'training data' folder as used now so they are the last ones evicted
+
+    Params:
+        DATA : Path object that points to the 'training data' folder
+        paths : files that were read or written by this run (None values and missing files are skipped)
+        kind : 'raw' or 'derived', guessed from the file suffix when None
+    """
+    def record(manifest):
+        for path in paths:
+            if path is not None and Path(path).is_file():
+                record_artifact(DATA, manifest, path, kind)
+    update_manifest(DATA, record)
+
+def scan_artifacts(DATA = Path, manifest = dict):
+    """
+    Syncs the manifest with the files on disk: new files are added with their modification time as last use, deleted files are dropped
+    """
+    on_disk = set()
+    for path in DATA.rglob("*"):
+        if not path.is_file() or path.name in (MANIFEST_NAME, LOCK_NAME) or path.suffix == ".tmp":
+            continue
+        key = str(path.relative_to(DATA))
+        on_disk.add(key)
+        entry = manifest["artifacts"].get(key)
+        if entry is None:
+            record_artifact(DATA, manifest, path, used_at=path.stat().st_mtime)
+        else:
+            entry["size"] = path.stat().st_size
+
+    for key in set(manifest["artifacts"]) - on_disk:
+        del manifest["artifacts"][key]
+    return manifest
+
+def remove_artifact(DATA = Path, key = str):
+    """
+    Deletes one file and the folders it leaves empty (never the 'training data' folder itself)
+    """
+    path = DATA / key
+    path.unlink(missing_ok=True)
+    parent = path.parent
+    while parent != DATA and parent.is_dir() and not any(parent.iterdir()):
+        parent.rmdir()
+        parent = parent.parent
+
+def enforce_cache_budget(DATA = Path, budget_mb = None, protect = ()):
+    """
+    Evicts the least recently used files of the 'training data' folder until it fits in the disk budget
+
+    Nothing is deleted while the folder is under budget, so cached sources and parquet files are reused by the next run
+
+    Params:
+        DATA : Path object that points to the 'training data' folder
+        budget_mb (None as default) : disk budget in MB, see cache_budget_mb
+        protect : files that are never evicted (ex: the ones the current run still needs)
+
+    Returns:
+        list of the evicted files (relative to DATA)
+    """
+    with manifest_lock(DATA):
+        return evict_over_budget(DATA, cache_budget_mb(budget_mb) * 1e6, protect)
+
+def evict_over_budget(DATA = Path, budget = float, protect = ()):
+    """
+    Helper for enforce_cache_budget, budget is in bytes and the manifest lock must be held
+    """
+    manifest = scan_artifacts(DATA, load_manifest(DATA))
+    protected = {str(Path(path).relative_to(DATA)) for path in protect if path is not None}
+
+    total = sum(entry["size"] for entry in manifest["artifacts"].values())
+    print(f"[cache_manager] {DATA.name} uses {total / 1e6:.1f} MB of a {budget / 1e6:.0f} MB budget")
+
+    evicted = []
+    by_last_use = sorted(manifest["artifacts"].items(), key=lambda item: item[1]["last_used"])
+    for key, entry in by_last_use:
+        if total <= budget:
+            break
+        if key in protected:
+            continue
+        try:
+            remove_artifact(DATA, key)
+        except OSError as e:
+            print(f"[cache_manager] could not evict {key}: {e}")
+            continue
+        print(f"[cache_manager] evicted {entry['kind']} file {key} ({entry['size'] / 1e6:.1f} MB)")
+        total -= entry["size"]
+        del manifest["artifacts"][key]
+        evicted.append(key)
+
+    if total > budget:
+        print(f"[cache_manager] still {total / 1e6:.1f} MB after eviction, only protected files are left")
+
+    save_manifest(DATA, manifest)
+    return evicted
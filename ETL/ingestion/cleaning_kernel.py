@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+#Rows more than Z_THRESHOLD standard deviations away from the mean are outliers
+Z_THRESHOLD = 3
+
+def new_moments():
+    """
+    Returns an empty state used to compute the mean and standard deviation of a column chunk by chunk
+    """
+    return {"n": 0, "mean": 0.0, "m2": 0.0}
+
+def merge_moments(state = dict, n = int, mean = float, m2 = 0.0):
+    """
+    Adds n values with the given mean and sum of squared deviations m2 to a moments state (parallel merge of Chan et al.)
+
+    n values all equal to v are merge_moments(state, n, v) (ex: missing values that will be filled with a median)
+    """
+    if n == 0:
+        return state
+
+    total = state["n"] + n
+    delta = mean - state["mean"]
+
+    state["m2"] += m2 + delta ** 2 * state["n"] * n / total
+    state["mean"] += delta * n / total
+    state["n"] = total
+    return state
+
+def update_moments(state = dict, values = pd.Series(dtype="float64")):
+    """
+    Adds the non missing values of one chunk to a moments state
+    """
+    values = values.dropna()
+    if len(values) == 0:
+        return state
+
+    mean = float(values.mean())
+    return merge_moments(state, len(values), mean, float(((values - mean) ** 2).sum()))
+
+def finalize_moments(state = dict):
+    """
+    Returns (mean, std) of a moments state, std uses ddof = 1 like pandas
+    """
+    if state["n"] < 2:
+        return state["mean"] if state["n"] else np.nan, np.nan
+    return state["mean"], (state["m2"] / (state["n"] - 1)) ** 0.5
+
+def column_moments(values = pd.Series(dtype="float64")):
+    """
+    Returns (mean, std) of an in memory column
+    """
+    return values.mean(), values.std()
+
+def zscore_keep_mask(values = pd.Series(dtype="float64"), mean = None, std = None, threshold = Z_THRESHOLD):
+    """
+    Boolean mask of the rows whose z score is within threshold (missing values are not kept)
+
+    Compares |x - mean| to threshold * std so no z score column or frame copy is needed
+
+    Params:
+        values : column to check
+        mean, std : statistics to use, computed from values when not given (pass them when working chunk by chunk)
+        threshold : max absolute z score that is kept
+    """
+    if mean is None or std is None:
+        mean, std = column_moments(values)
+
+    distance = values.to_numpy(dtype="float64", na_value=np.nan) - mean
+    np.abs(distance, out=distance)
+    #NaN distances compare as False so missing values (and a NaN std) drop the row, same as the old z score filter
+    return distance <= threshold * std
+
+def filter_outliers(df = pd.DataFrame(), column = str, threshold = Z_THRESHOLD, mean = None, std = None):
+    """
+    Returns the rows of df whose column value is within threshold standard deviations of the mean
+
+    Only the kept rows are copied, the input frame is never duplicated
+    """
+    return df[zscore_keep_mask(df[column], mean, std, threshold)]
+
+def filter_outliers_chunks(chunks, column = str, mean = float, std = float, threshold = Z_THRESHOLD):
+    """
+    Generator version of filter_outliers for chunked data, mean and std must come from the whole column (see update_moments)
+    """
+    for chunk in chunks:
+        yield filter_outliers(chunk, column, threshold, mean, std)
+
+def replace_where(df = pd.DataFrame(), column = str, mask = None, value = None):
+    """
+    Replaces the values of a column where mask is True, in place
+    """
+    if mask.any():
+        df.loc[mask, column] = value
+    return df
+
+def coerce_columns(df = pd.DataFrame(), columns = list, dtype = str):
+    """
+    Converts columns of df to dtype in place, columns that can not be converted are left as they are (a message is printed)
+    """
+    for column in columns:
+        if df[column].dtype == dtype:
+            continue
+        try:
+            df[column] = df[column].astype(dtype)
+        except Exception as e:
+            kind = "int" if "int" in str(dtype) else "float"
+            print(f"skipping {kind} conversion: {column} due to error: {e}")
+    return df
@@ -1,10 +1,43 @@
 import os
 from pathlib import Path
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
 import shutil
 import csv
 import kaggle
 import random
+from ETL.ingestion.imputation import fit_or_load_imputer, apply_imputer, save_moments, load_reusable_moments, stats_path as imputer_stats_path
+from ETL.ingestion.sampling import SAMPLE_SIZE, pushdown_rows, read_parquet_sample, finalize_sample
+from ETL.ingestion.cleaning_kernel import filter_outliers, column_moments, coerce_columns
+from ETL.ingestion.dtype_plan import apply_dtype_plan
+from ETL.ingestion.cache_manager import touch_artifacts
+from ETL.ingestion.parquet_cache import read_parquet_range
+from ETL.ingestion.hmda_decoder import decode_hmda_columns
+
+#Rows per record batch when scanning the HDMA files
+BATCH_SIZE = 128_000
+
+#Rows kept by the valid_accepted_hdma / valid_rejected_hdma views, pushed down into the parquet scan (see read_hdma)
+HDMA_ACTIVITY_YEAR = 2023
+HDMA_PRODUCT_TYPES = [
+    'Conventional:First Lien', 'Conventional:Subordinate Lien', 'FHA:First Lien', 'FHA:Subordinate Lien',
+    'VA:First Lien', 'VA:Subordinate Lien', 'FSA/RHS:First Lien', 'FSA/RHS:Subordinate Lien'
+]
+HDMA_ACCEPTED_FILTERS = {
+    'activity_year': [HDMA_ACTIVITY_YEAR], 'action_taken': [1], 'derived_loan_product_type': HDMA_PRODUCT_TYPES
+}
+HDMA_REJECTED_FILTERS = {
+    'activity_year': [HDMA_ACTIVITY_YEAR], 'action_taken': [3], 'derived_loan_product_type': HDMA_PRODUCT_TYPES
+}
+
+#Raw HDMA files in the 'training data' folder and the columns read from them
+HDMA_FILES = {"accepted": 'hdma_accepted_raw.parquet.gzip', "rejected": 'hdma_rejected_raw.parquet.gzip'}
+HDMA_COLUMNS = [
+    'activity_year', 'action_taken', 'preapproval', 'loan_purpose', 'loan_amount', 'loan_term', 'applicant_credit_score_type',
+    'co-applicant_credit_score_type' , 'denial_reason-1', 'loan_to_value_ratio', 'income', 'debt_to_income_ratio',
+    'derived_loan_product_type'
+]
 
 #gather data from a specific csv file and return as a pandas df
 def initialize_data_path():
@@ -19,9 +52,13 @@ def initialize_data_path():
     DATA.mkdir(parents= True, exist_ok= True)
     return DATA
 
-def clean_data(df = pd.DataFrame(), sample = bool, seed = int): 
+def clean_data(df = pd.DataFrame(), sample = bool, seed = int, stats_path = None, reuse_stats = False, table = None): 
     """
     Helper function made to clean the HDMA dataframes
+    Params:
+        table (None as default) : staging table the frame is written to, its DDL gives the compact dtypes of the columns (see dtype_plan.py)
+        stats_path (None as default) : json file where the fitted imputation statistics are saved (see imputation.py)
+        reuse_stats (False as default) : True fills missing values and filters outliers with the statistics already saved at stats_path instead of fitting new ones
     """
 
     int_values = [
@@ -36,62 +73,42 @@ def clean_data(df = pd.DataFrame(), sample = bool, seed = int):
     string_values = [
         'derived_loan_product_type'
     ]
-    #Convert any ranges in the debt_income cat into the middle of that range, or leave it at that range if its too broad
-    df['debt_to_income_ratio'] = df['debt_to_income_ratio'].replace(">60%", 60)
-    df['debt_to_income_ratio'] = df['debt_to_income_ratio'].replace("50%-60%", 55)
-    df['debt_to_income_ratio'] = df['debt_to_income_ratio'].replace("20%-<30%", (29+20)/2)
-    df['debt_to_income_ratio'] = df['debt_to_income_ratio'].replace("30%-<36%", (35+30)/2)
-    df['debt_to_income_ratio'] = df['debt_to_income_ratio'].replace("<20%", 20)
+    #Decode the range codes (DTI ranges go to the middle of the range, or its bound if its too broad), exact values and 'Exempt' of
+    #DTI, LTV, income and loan_term to numbers in one lookup pass per column, 'Exempt' becomes a missing value (see hmda_decoder.py)
+    decode_hmda_columns(df)
     
     #Fix the 1111's in denial reason
     if "denial_reason_1" in df.columns:
         df["denial_reason_1"] = df["denial_reason_1"].replace(1111, 1)
 
-    #Fix any exempts
-    exempt_cols = ['debt_to_income_ratio', 'income', 'loan_term', 'loan_to_value_ratio']
-
-    for col in exempt_cols:
-        df[col] = df[col].replace('Exempt', df[col].value_counts().reset_index().iat[0, 0])
+    #Fix any exempts and missing values with the most repeated value of each column (all modes gathered in one pass)
+    strategies = {column: "mode" for column in int_values + float_values + string_values}
+    stats = fit_or_load_imputer(df, strategies, stats_path, reuse_stats)
+    apply_imputer(df, stats)
 
     #Convert all columns to numerical types
-    for column in int_values:
-        df[column] = df[column].fillna(df[column].value_counts().reset_index().iat[0, 0])
-        try:
-            df[column] = df[column].astype('int32')
-        except Exception as e:
-            print(f"skipping int conversion: {column} due to error: {e}") 
-            continue  
-        
+    coerce_columns(df, int_values, 'int32')
+    coerce_columns(df, float_values, 'float64')
+    if table is not None:
+        apply_dtype_plan(df, table)
 
-    for column in float_values:
-        df[column] = df[column].fillna(df[column].value_counts().reset_index().iat[0, 0])   
-        try:
-            df[column] = df[column].astype('float64')
-        except Exception as e:
-            print(f"skipping float conversion: {column} due to error: {e}") 
-            continue
-
-    for column in string_values:
-        df[column] = df[column].fillna(df[column].value_counts().reset_index().iat[0, 0])
-
-    #Remove outliers based on z score
-    loan_std = df['loan_amount'].std()
-    loan_mean = df['loan_amount'].mean()
-    temp_z_data = df.copy()
-    temp_z_data['z_loan'] = ((df['loan_amount'] - loan_mean) / loan_std)
-    threshold = 3
-
-    #remove based on threshold
-    df_no_outliers = temp_z_data[(temp_z_data['z_loan'].abs()) <= threshold].drop(columns=['z_loan'])
+    #Remove outliers based on z score (boolean mask, the frame is not copied), with the saved statistics of the full load when reused
+    saved = load_reusable_moments(['loan_amount'], stats_path) if reuse_stats else None
+    if saved is None:
+        mean, std = column_moments(df['loan_amount'])
+        save_moments({'loan_amount': (mean, std)}, stats_path)
+    else:
+        mean, std = saved['loan_amount']
+    df_no_outliers = filter_outliers(df, 'loan_amount', mean=mean, std=std)
 
     try:
         if sample is True and seed != 0:
                 #Create a random seed for sampling the large dataset if no seed is provided
-                return df_no_outliers.sample(200000, random_state = seed)
+                return finalize_sample(df_no_outliers, SAMPLE_SIZE, seed)
         elif sample is True:
                 seed = random.randint(0,999)
                 print(f"Random seed to replicate accepted loans df: {seed}")
-                return df_no_outliers.sample(200000, random_state = seed)
+                return finalize_sample(df_no_outliers, SAMPLE_SIZE, seed)
         else:
             print(f"Sample input was set --> {sample}, thus the entire dataset will be returned")
             return df_no_outliers
@@ -99,37 +116,71 @@ def clean_data(df = pd.DataFrame(), sample = bool, seed = int):
         print(f"Error when attempting to get the dataframe cleaned up : {e}")
         return
 
-def read_hdma(file = Path):
+def hdma_filter(schema = pa.schema([]), filters = None):
+    """
+    Builds the pyarrow expression of a dict of column -> allowed values
+
+    Missing values are kept since clean_data fills them, columns that are not in the file are skipped
+
+    Returns:
+        pyarrow expression or None if there is nothing to filter on
+    """
+    expression = None
+    for column, values in (filters or {}).items():
+        if column not in schema.names:
+            continue
+        try:
+            value_set = pa.array(values).cast(schema.field(column).type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            print(f"[read_hdma] not filtering on {column}: {e}")
+            continue
+        condition = ds.field(column).isin(value_set) | ds.field(column).is_null()
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def read_hdma(file = Path, sample_rows = None, seed = 0, filters = None, batch_size = BATCH_SIZE, start_row = 0):
     """
     Helper function that retrieves specific data from the gzip files
+
+    Only the needed columns are read and rows are filtered while scanning (row groups whose statistics can not match are skipped),
+    the file is read one record batch at a time so it never has to fit in memory
     Params:
         DATA : Path object that points to the 'training data' folder
+        sample_rows (None as default) : if given, only a seeded sample of about this many rows is read (only the sampled row groups are touched)
+        seed (0 as default) : random seed of the sample
+        filters (None as default) : dict of column -> allowed values (ex: HDMA_ACCEPTED_FILTERS), rows with other values are not read
+        batch_size (BATCH_SIZE as default) : rows per record batch
+        start_row (0 as default) : only the rows from this row number on are read, row groups before it are skipped (incremental loads)
     """
-    filtered_columns = [
-        'activity_year', 'action_taken', 'preapproval', 'loan_purpose', 'loan_amount', 'loan_term', 'applicant_credit_score_type',
-        'co-applicant_credit_score_type' , 'denial_reason-1', 'loan_to_value_ratio', 'income', 'debt_to_income_ratio',
-        'derived_loan_product_'
-        'type' 
-    ]
+    filtered_columns = HDMA_COLUMNS
 
     if not file.exists():
         raise FileNotFoundError(f"HDMA file not found: {file}")
-    
-    df = pd.read_parquet(file)
+
+    dataset = ds.dataset(file, format="parquet")
 
     #checks whats missing
-    missing = [c for c in filtered_columns if c not in df.columns]
+    missing = [c for c in filtered_columns if c not in dataset.schema.names]
     if missing:
         print(f"[read_hdma] missing columns in {file.name}: {missing}")
-    present_cols = [c for c in filtered_columns if c in df.columns]
+    present_cols = [c for c in filtered_columns if c in dataset.schema.names]
 
     if not present_cols:
         raise ValueError(
             f"[read_hdma] no HDMA columns found in {file.name}. "
-            f"Available columns: {list(df.columns)[:20]} ..."
+            f"Available columns: {dataset.schema.names[:20]} ..."
         )
-    
-    df_recovered = df[present_cols].copy()
+
+    expression = hdma_filter(dataset.schema, filters)
+    if start_row:
+        batches = list(read_parquet_range(file, present_cols, start_row, chunksize=batch_size, filter=expression))
+        df_recovered = pd.concat(batches, ignore_index=True) if batches else dataset.schema.empty_table().select(present_cols).to_pandas()
+    elif sample_rows is None:
+        scanner = dataset.scanner(columns=present_cols, filter=expression, batch_size=batch_size)
+        batches = [batch.to_pandas() for batch in scanner.to_batches() if batch.num_rows]
+        df_recovered = pd.concat(batches, ignore_index=True) if batches else scanner.projected_schema.empty_table().to_pandas()
+    else:
+        df_recovered = pd.concat(list(read_parquet_sample(file, present_cols, sample_rows, seed, filter=expression)))
 
     for col in missing:
         df_recovered[col] = pd.NA
@@ -148,7 +199,7 @@ def read_hdma(file = Path):
 
     return df_recovered
 
-def clean_hdma_rejected(DATA = Path, sample = True, seed = 0):
+def clean_hdma_rejected(DATA = Path, sample = True, seed = 0, reuse_stats = False, pushdown = True, start_row = 0):
     """
     Function that reads the parquet.gzip file to return a cleaned dataframe with only rejected loans in the US during 2023
     https://ffiec.cfpb.gov/documentation/publications/loan-level-datasets/lar-data-fields#loan_amount
@@ -156,17 +207,30 @@ def clean_hdma_rejected(DATA = Path, sample = True, seed = 0):
     Params:
         DATA : Path object that points to the 'training data' folder
         seed (random seed is default) : integer between 0 and 999, used to replicate pd.random_sample output for debugging. If no seed is passed a random one will be generated
+        reuse_stats (False as default) : True reuses the imputation statistics saved by an earlier run instead of fitting new ones
+        pushdown (True as default) : with sample = True, samples rows while reading the file instead of after cleaning the whole dataset
+        start_row (0 as default) : only the raw rows from this row number on are cleaned (incremental loads, see incremental_loader.py)
     """
     try:
-        hdma_rejected_parquet = DATA / 'hdma_rejected_raw.parquet.gzip'
+        hdma_rejected_parquet = DATA / HDMA_FILES["rejected"]
         
-        rejected_df = read_hdma(hdma_rejected_parquet)
-        rejected_cleaned = clean_data(rejected_df, sample, seed)
+        #Sample while reading so only the sampled rows are cleaned, full run statistics are reused for the sample when saved
+        sample_rows = None
+        if sample is True and pushdown is True:
+            if seed == 0:
+                seed = random.randint(1,999)
+                print(f"Random seed to replicate rejected HDMA df: {seed}")
+            sample_rows = pushdown_rows()
+            reuse_stats = True
+
+        rejected_df = read_hdma(hdma_rejected_parquet, sample_rows, seed, HDMA_REJECTED_FILTERS, start_row=start_row)
+        touch_artifacts(DATA, [hdma_rejected_parquet])
+        rejected_cleaned = clean_data(rejected_df, sample, seed, imputer_stats_path(DATA, "hdma_rejected"), reuse_stats, "staging_rejected_hdma")
         return rejected_cleaned
     except Exception as e:
         print(f"Error when retrieving rejected HDMA as a df: {e}")
 
-def clean_hdma_accepted(DATA = Path, sample = True, seed = 0):
+def clean_hdma_accepted(DATA = Path, sample = True, seed = 0, reuse_stats = False, pushdown = True, start_row = 0):
     """
     Function that reads the parquet.gzip file to return a cleaned dataframe with only rejected loans in the US during 2023
     https://ffiec.cfpb.gov/documentation/publications/loan-level-datasets/lar-data-fields#loan_amount
@@ -174,11 +238,24 @@ def clean_hdma_accepted(DATA = Path, sample = True, seed = 0):
     Params:
         DATA : Path object that points to the 'training data' folder
         seed (random seed is default) : integer between 0 and 999, used to replicate pd.random_sample output for debugging. If no seed is passed a random one will be generated
+        reuse_stats (False as default) : True reuses the imputation statistics saved by an earlier run instead of fitting new ones
+        pushdown (True as default) : with sample = True, samples rows while reading the file instead of after cleaning the whole dataset
+        start_row (0 as default) : only the raw rows from this row number on are cleaned (incremental loads, see incremental_loader.py)
     """
     try:
-        hdma_accepted_parquet = DATA / 'hdma_accepted_raw.parquet.gzip'
-        accepted_df = read_hdma(hdma_accepted_parquet)
-        accepted_cleaned = clean_data(accepted_df, sample, seed)
+        hdma_accepted_parquet = DATA / HDMA_FILES["accepted"]
+        #Sample while reading so only the sampled rows are cleaned, full run statistics are reused for the sample when saved
+        sample_rows = None
+        if sample is True and pushdown is True:
+            if seed == 0:
+                seed = random.randint(1,999)
+                print(f"Random seed to replicate accepted HDMA df: {seed}")
+            sample_rows = pushdown_rows()
+            reuse_stats = True
+
+        accepted_df = read_hdma(hdma_accepted_parquet, sample_rows, seed, HDMA_ACCEPTED_FILTERS, start_row=start_row)
+        touch_artifacts(DATA, [hdma_accepted_parquet])
+        accepted_cleaned = clean_data(accepted_df, sample, seed, imputer_stats_path(DATA, "hdma_accepted"), reuse_stats, "staging_accepted_hdma")
         return accepted_cleaned.drop(columns=['denial_reason_1'])
     except Exception as e:
         print(f"Error when retrieving accepted HDMA as a df: {e}")
\ No newline at end of file
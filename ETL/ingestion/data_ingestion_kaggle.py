@@ -6,6 +6,58 @@ import csv
 import kaggle
 from kaggle.api.kaggle_api_extended import KaggleApi
 import random
+import pickle
+import tempfile
+from ETL.ingestion.parquet_cache import ROW_GROUP_SIZE, cached_parquet, has_cached_parquet, read_parquet_chunks, read_parquet_range
+from ETL.ingestion.title_classifier import load_title_categories, normalize_titles, classify_titles
+from ETL.ingestion.imputation import (
+    apply_imputer,
+    load_reusable_imputer,
+    new_imputer_state,
+    update_imputer_state,
+    save_imputer_state,
+    replace_sampled_values,
+    save_moments,
+    load_reusable_moments,
+)
+from ETL.ingestion.sampling import SAMPLE_SIZE, sample_chunks, read_parquet_sample
+from ETL.ingestion.cleaning_kernel import (
+    filter_outliers,
+    filter_outliers_chunks,
+    new_moments,
+    update_moments,
+    merge_moments,
+    finalize_moments,
+    replace_where,
+)
+from ETL.ingestion.dtype_plan import apply_dtype_plan, concat_frames
+from ETL.ingestion.cache_manager import touch_artifacts, enforce_cache_budget, dir_size
+
+#Rows per chunk when streaming the Kaggle csvs, keeps peak memory bounded regardless of file size
+CHUNK_SIZE = 250_000
+
+#Only the columns used by the cleaning functions are read from the Kaggle csvs, with explicit dtypes
+#id is read as text since the accepted csv contains summary rows with text in the id column
+ACCEPTED_DTYPES = {
+    "id": "str", "loan_amnt": "float64", "funded_amnt": "float64", "term": "str", "int_rate": "float64",
+    "installment": "float64", "annual_inc": "float64", "dti": "float64", "delinq_2yrs": "float64",
+    "fico_range_low": "float64", "fico_range_high": "float64", "inq_last_6mths": "float64", "open_acc": "float64",
+    "revol_bal": "float64", "revol_util": "float64", "total_acc": "float64", "pub_rec_bankruptcies": "float64",
+    "home_ownership": "str", "loan_status": "str", "purpose": "str", "application_type": "str",
+    "verification_status": "str",
+}
+
+REJECTED_DTYPES = {
+    "Amount Requested": "float64", "Application Date": "str", "Loan Title": "str", "Debt-To-Income Ratio": "str",
+}
+
+KAGGLE_SOURCES = {"accepted": ACCEPTED_DTYPES, "rejected": REJECTED_DTYPES}
+
+#Column used as the sampling key of each source, None samples by row number (rejected has no id)
+KAGGLE_SAMPLE_KEYS = {"accepted": "id", "rejected": None}
+
+#Column whose z score removes the outlier rows of each source
+OUTLIER_COLUMNS = {"accepted": "loan_amnt", "rejected": "Amount Requested"}
 
 def move_kaggle_json():
     """
@@ -68,25 +120,42 @@ def get_kaggle_data(DATA = Path):
     except Exception as e:
         print(f"Error when running get_kaggle_data: {e}")
 
-#TO USE THIS API you must have a .kaggle folder in your 'C:\NAME' directory -> then paste the kaggle.json authenticator
-def retrieve_training_csv(DATA = Path): 
-    """ 
-    Function that returns all the csv files in the training data folder as a dataframe object 
-    
+def read_csv_chunks(file = Path, dtypes = dict, chunksize = CHUNK_SIZE):
+    """
+    Generator that streams a csv file in fixed size chunks, reading only the columns in dtypes
+
     Params:
-        DATA : Path object that points to the 'training data' folder
-    
-    Returns:
-        List : dataframe objects list of the kaggle csvs
-        Index 0 : Accepted Loans Df
-        Index 1 : Rejected Loans Df
-    """ 
-    #Get kaggle data into your directory
-    get_kaggle_data(DATA)
-    
+        file : Path object that points to the csv file
+        dtypes : dict of column name -> dtype, only these columns are read
+        chunksize : number of rows per chunk
+    """
+    with pd.read_csv(file, usecols=list(dtypes), dtype=dtypes, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk
+
+def iter_frames(data):
+    """
+    Helper that yields dataframe chunks from either a single dataframe or an iterable of dataframe chunks
+    """
+    if isinstance(data, pd.DataFrame):
+        yield data
+    else:
+        yield from data
+
+def read_kaggle_csv(file = Path, dtypes = dict, chunksize = CHUNK_SIZE):
+    """
+    Helper that reads a Kaggle csv either as a generator of chunks or as a single dataframe (chunksize = None)
+    """
+    if chunksize is None:
+        return pd.read_csv(file, usecols=list(dtypes), dtype=dtypes)
+    return read_csv_chunks(file, dtypes, chunksize)
+
+def find_kaggle_csvs(DATA = Path):
+    """
+    Returns a dict with the Path of the accepted and rejected Kaggle csvs in the training data folder (None if not found)
+    """
     csv_list = list(DATA.glob("**/*.csv")) 
-    accepted_df = None
-    rejected_df = None
+    sources = {"accepted": None, "rejected": None}
 
     # pick accepted vs rejected based on file name
     for item in csv_list:
@@ -94,15 +163,109 @@ def retrieve_training_csv(DATA = Path):
             name_lower = item.name.lower()
             if "accepted" in name_lower:
                 print(f"{item} is the accepted file")
-                accepted_df = pd.read_csv(item, low_memory=False)
+                sources["accepted"] = item
             elif "rejected" in name_lower:
                 print(f"{item} is the rejected file")
-                rejected_df = pd.read_csv(item, low_memory=False)
+                sources["rejected"] = item
             else:
                 print(f"{item} will be ignored")
         else:
             print(f"{item} is folder")
 
+    return sources
+
+def read_kaggle_source(DATA = Path, name = str, file = None, chunksize = CHUNK_SIZE, use_cache = True, sample_rows = None, seed = 0, start_row = 0):
+    """
+    Helper that reads one Kaggle source ('accepted' or 'rejected'), from the parquet cache if use_cache is True, else from the csv
+
+    When sample_rows is given only a seeded sample of about that many raw rows is returned (see sampling.py)
+    When start_row is given only the rows from that row number on are read (parquet cache only, used by incremental loads)
+
+    Returns None if the source is neither on disk nor cached
+    """
+    dtypes = KAGGLE_SOURCES[name]
+    key = KAGGLE_SAMPLE_KEYS[name]
+
+    if use_cache:
+        parquet_path = cached_parquet(DATA, f"kaggle_{name}", file, dtypes)
+        if parquet_path is None:
+            return None
+        touch_artifacts(DATA, [parquet_path, file])
+        if sample_rows is not None:
+            chunks = read_parquet_sample(parquet_path, list(dtypes), sample_rows, seed, key)
+        elif start_row:
+            chunks = read_parquet_range(parquet_path, list(dtypes), start_row, chunksize=chunksize or ROW_GROUP_SIZE)
+        elif chunksize is None:
+            return pd.read_parquet(parquet_path, columns=list(dtypes))
+        else:
+            return read_parquet_chunks(parquet_path, list(dtypes), chunksize)
+    else:
+        if file is None or start_row:
+            return None
+        touch_artifacts(DATA, [file])
+        if sample_rows is not None:
+            #csv has no row groups, stream the whole file but only keep the sampled rows
+            chunks = sample_chunks(read_csv_chunks(file, dtypes, chunksize or CHUNK_SIZE), sample_rows, seed, key)
+        else:
+            return read_kaggle_csv(file, dtypes, chunksize)
+
+    return pd.concat(list(chunks)) if chunksize is None else chunks
+
+def ensure_kaggle_sources(DATA = Path, use_cache = True, force_download = False):
+    """
+    Downloads the Kaggle dataset when a csv is missing and there is no parquet cache for it (or when force_download is True)
+
+    Returns:
+        dict with the Path of the accepted and rejected csvs (None if not found, see find_kaggle_csvs)
+    """
+    sources = find_kaggle_csvs(DATA)
+
+    #Only download when a csv is missing and there is no parquet cache for it
+    missing = [
+        name for name, dtypes in KAGGLE_SOURCES.items()
+        if sources[name] is None and not (use_cache and has_cached_parquet(DATA, f"kaggle_{name}", dtypes))
+    ]
+    if force_download or missing:
+        #Get kaggle data into your directory
+        get_kaggle_data(DATA)
+        sources = find_kaggle_csvs(DATA)
+    return sources
+
+def open_kaggle_source(DATA = Path, name = str, chunksize = CHUNK_SIZE, use_cache = True, sample_rows = None, seed = 0):
+    """
+    Opens a single Kaggle source ('accepted' or 'rejected') without touching the other one, used when each source is cleaned in its own process
+
+    The dataset must already be downloaded (see ensure_kaggle_sources)
+
+    Returns:
+        List in the same layout as retrieve_training_csv with None for the source that was not opened
+    """
+    frame = read_kaggle_source(DATA, name, find_kaggle_csvs(DATA)[name], chunksize, use_cache, sample_rows, seed)
+    return [frame, None] if name == "accepted" else [None, frame]
+
+#TO USE THIS API you must have a .kaggle folder in your 'C:\NAME' directory -> then paste the kaggle.json authenticator
+def retrieve_training_csv(DATA = Path, chunksize = CHUNK_SIZE, use_cache = True, force_download = False, sample_rows = None, seed = 0): 
+    """ 
+    Function that returns the Kaggle csv files in the training data folder, projected to the columns used for cleaning
+    
+    Params:
+        DATA : Path object that points to the 'training data' folder
+        chunksize (CHUNK_SIZE as default) : rows per chunk, each csv is returned as a lazy generator of dataframe chunks. If None is passed each csv is read into a single dataframe
+        use_cache (True as default) : converts each csv once into a parquet file keyed by its content hash and reads from that parquet file on later runs
+        force_download (False as default) : True downloads the dataset from Kaggle even if the csvs (or their cache) are already on disk
+        sample_rows (None as default) : if given, only a seeded sample of about this many raw rows is read from each file (sampling is pushed down into the reader)
+        seed (0 as default) : random seed of the pushed down sample, the same seed always reads the same rows
+    
+    Returns:
+        List : dataframe objects (or chunk generators) of the kaggle csvs
+        Index 0 : Accepted Loans Df
+        Index 1 : Rejected Loans Df
+    """ 
+    sources = ensure_kaggle_sources(DATA, use_cache, force_download)
+
+    accepted_df = read_kaggle_source(DATA, "accepted", sources["accepted"], chunksize, use_cache, sample_rows, seed)
+    rejected_df = read_kaggle_source(DATA, "rejected", sources["rejected"], chunksize, use_cache, sample_rows, seed)
+
     if accepted_df is None or rejected_df is None:
         print(f"no valid files found in {DATA}")
         return []
@@ -130,43 +293,29 @@ def retrieve_training_csv(DATA = Path):
     #     print(f"Error when using retrieve_training_csv: {e}")
 
 def get_dir_size(path): 
-    """ Get directory size in MBs """ 
-    total = 0 
-    for dirpath, _, files in os.walk(path):
-        for f in files:
-            file_path = os.path.join(dirpath, f)
-            
-            try:
-                total += os.path.getsize(file_path) 
-                #print(f"{total/1000000} MB")
-            except: 
-                continue 
-        return total/1000000
+    """ Get directory size in MBs (every file under path is counted once) """ 
+    return dir_size(path)/1000000
     
-def delete_large_files(DATA = Path): 
+def delete_large_files(DATA = Path, budget_mb = None): 
     """ 
-    Function that deletes the large files downloaded from kaggle to save space. Deletes files to prevent any storage errors when pushing code to github.
+    Function that frees space in the training data folder once a run is done.
+
+    Files are only deleted when the folder is over its disk budget, least recently used first (see cache_manager.py),
+    so the csvs, HDMA files and parquet cache are reused by the next run instead of being downloaded again.
+    training_data/ is git ignored so nothing in it is pushed to github.
     
     Params:
         DATA : Path object that points to the 'training data' folder
-    """
-
-    for paths in DATA.glob("**/*"): 
-        if os.path.isdir(paths): 
-            try:
-                size = get_dir_size(paths) 
-                print(f"size of {paths} is {size}")
+        budget_mb (None as default) : disk budget in MB, CRA_CACHE_BUDGET_MB environment variable (or CACHE_BUDGET_MB) when None
 
-                if size > 100: 
-                    print(f"deleting {paths}") 
-                    shutil.rmtree(paths) 
-
-            except Exception as e:
-                print(f"Error when trying to get size or delete file: {e}")
-        else:
-            if paths.suffix == ".gz":
-                os.remove(paths)
-                #print(paths)
+    Returns:
+        list of the deleted files
+    """
+    try:
+        return enforce_cache_budget(DATA, budget_mb)
+    except Exception as e:
+        print(f"Error when trying to get size or delete file: {e}")
+        return []
         
 def remove_outliers(df = pd.DataFrame(), rejected = False):
     """
@@ -174,87 +323,162 @@ def remove_outliers(df = pd.DataFrame(), rejected = False):
     """
 
     try:
-        if rejected is True:
-            #Remove outliers based on z score
-            column = 'Amount Requested'
-        else:
-            column = 'loan_amnt'
-
-        #Remove outliers based on z score
-        loan_std = df[column].std()
-        loan_mean = df[column].mean()
+        column = OUTLIER_COLUMNS["rejected" if rejected is True else "accepted"]
 
-        temp_z_data = df.copy()
-        temp_z_data['z_loan'] = ((df[column] - loan_mean) / loan_std)
-        threshold = 3
-
-        #remove based on threshold
-        df_no_outliers = temp_z_data[(temp_z_data['z_loan'].abs()) <= threshold].drop(columns=['z_loan'])
+        #Remove outliers based on z score (boolean mask, the frame is not copied)
+        df_no_outliers = filter_outliers(df, column)
 
         return df_no_outliers
     except Exception as e:
         print(f"Error when attempting to remove outliers: {e}")
 
-def kaggle_accepted_loans_df(dataframe_list = list, sample_csv = True, seed = 0):
+def outlier_moments(state = dict, missing = int, stats = dict, column = str):
+    """
+    Helper that returns the (mean, std) used by the z score filter from the moments of column gathered chunk by chunk,
+    the missing values are counted with the value the imputer fills them with (the filter runs after the imputation)
+    """
+    fill = stats.get(column, {}).get("value")
+    if missing and fill is not None:
+        merge_moments(state, missing, float(fill))
+    return finalize_moments(state)
+
+def clean_accepted_chunk(chunk = pd.DataFrame()):
+    """
+    Helper that applies the row level cleaning of Kaggle -> Accepted_Loans to a single chunk of the raw csv
+    """
+    #int/float64 columns that will go first in cleaned dataframe
+    num_cols = [
+        "id", "loan_amnt", "funded_amnt", "term", "int_rate", "installment", "annual_inc",
+        "dti", "delinq_2yrs", "fico_range_low", "fico_range_high", "inq_last_6mths",
+        "open_acc", "revol_bal", "revol_util", "total_acc", "pub_rec_bankruptcies"
+    ]
+
+    #String object columns that will be the last columns of the dataframe
+    text_cols = [
+        "home_ownership", "loan_status", "purpose", "application_type", "verification_status"
+    ]
+
+    #only find columns with valid ids (not string or empty)
+    cleaned_chunk = chunk[num_cols + text_cols]
+    cleaned_chunk = cleaned_chunk[pd.to_numeric(cleaned_chunk['id'], errors='coerce').notna()].copy()
+
+    #convert id column to int instead of obj
+    cleaned_chunk['id'] = cleaned_chunk['id'].astype('int64')
+
+    #fix the the term column to make all the values int (specify in column label that numbers mean months)
+    cleaned_chunk.rename(columns = {'term': 'term_months'}, inplace = True)
+    cleaned_chunk['term_months'] = cleaned_chunk['term_months'].str.replace(" months", "")
+    cleaned_chunk['term_months'] = cleaned_chunk['term_months'].astype('int64')
+
+    #compact dtypes from the staging table (see dtype_plan.py) so the spilled chunks stay small
+    return apply_dtype_plan(cleaned_chunk, "staging_accepted_kaggle", verbose=False)
+
+def spill_chunk(f, chunk = pd.DataFrame()):
+    """
+    Helper that appends a cleaned chunk to an open spill file, read back in order by spilled_chunks
+    """
+    pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def spilled_chunks(path = Path):
+    """
+    Generator that reads back the chunks written to path by spill_chunk, one at a time
+    """
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def impute_chunks(chunks, stats = dict, table = str):
+    """
+    Generator that fills the missing values of each chunk and downcasts it (columns that had missing values can only be downcast once they are filled)
+    """
+    for chunk in chunks:
+        apply_imputer(chunk, stats)
+        yield apply_dtype_plan(chunk, table, verbose=False)
+
+def finish_kaggle_chunks(chunks, name = str, sample_csv = True, seed = 0):
+    """
+    Helper that yields the filtered chunks of a Kaggle source, or only a seeded sample of SAMPLE_SIZE rows of them when sample_csv is True
+    """
+    if sample_csv is True:
+        #bottom-k sample over the stream, only about SAMPLE_SIZE rows are held (see sampling.py)
+        yield from sample_chunks(chunks, SAMPLE_SIZE, seed, KAGGLE_SAMPLE_KEYS[name])
+    else:
+        print(f"Sample input was set --> {sample_csv}, thus the entire dataset will be returned")
+        yield from chunks
+
+def kaggle_accepted_loans_chunks(dataframe_list = list, sample_csv = True, seed = 0, stats_path = None, reuse_stats = False):
+    """
+    Generator of the cleaned up chunks of Kaggle -> Accepted_Loans, memory used does not grow with the size of the file
+
+    The cleaned chunks are spilled to a temporary file while the imputer and outlier statistics are gathered (first pass),
+    then read back, filled, filtered and yielded one at a time (second pass)
+
+    Params: same as kaggle_accepted_loans_df
+    """
+    #Create a random seed for sampling the large dataset if no seed is provided
+    if seed == 0:
+        seed = random.randint(0,999)
+        if sample_csv is True:
+            print(f"Random seed to replicate accepted loans df: {seed}")
+
+    #int/float64 columns that will go first in cleaned dataframe
+    num_cols = [
+        "id", "loan_amnt", "funded_amnt", "term_months", "int_rate", "installment", "annual_inc",
+        "dti", "delinq_2yrs", "fico_range_low", "fico_range_high", "inq_last_6mths",
+        "open_acc", "revol_bal", "revol_util", "total_acc", "pub_rec_bankruptcies"
+    ]
+
+    #medians used to fill the na rows, gathered chunk by chunk while the chunks are cleaned (unless saved ones are reused)
+    strategies = {col: "median" for col in num_cols}
+    stats = load_reusable_imputer(strategies, stats_path) if reuse_stats else None
+    state = new_imputer_state(strategies) if stats is None else None
+
+    #mean and std of the outlier column, gathered with the imputer statistics (unless saved ones are reused, same as the imputer)
+    column = OUTLIER_COLUMNS["accepted"]
+    saved = load_reusable_moments([column], stats_path) if reuse_stats else None
+    moments, missing = new_moments(), 0
+
+    with tempfile.TemporaryDirectory() as spill_dir:
+        #clean the raw data chunk by chunk so only one chunk of the file is ever held in memory
+        spill_path = Path(spill_dir) / "accepted.pkl"
+        with open(spill_path, "wb") as f:
+            for chunk in iter_frames(dataframe_list[0]):
+                chunk = clean_accepted_chunk(chunk)
+                if state is not None:
+                    update_imputer_state(state, chunk)
+                update_moments(moments, chunk[column])
+                missing += int(chunk[column].isna().sum())
+                spill_chunk(f, chunk)
+
+        if state is not None:
+            stats = save_imputer_state(state, stats_path)
+        if saved is None:
+            mean, std = outlier_moments(moments, missing, stats, column)
+            save_moments({column: (mean, std)}, stats_path)
+        else:
+            mean, std = saved[column]
+
+        #find any na rows and fill them with the median of each column, then remove outliers based on the z score of the whole column
+        chunks = impute_chunks(spilled_chunks(spill_path), stats, "staging_accepted_kaggle")
+        yield from finish_kaggle_chunks(filter_outliers_chunks(chunks, column, mean, std), "accepted", sample_csv, seed)
+
+def kaggle_accepted_loans_df(dataframe_list = list, sample_csv = True, seed = 0, stats_path = None, reuse_stats = False):
     """
     Returns a cleaned up dataframe of Kaggle -> Accepted_Loans with relevant columns for model training
     Params:
         dataframe_list : list containing dataframe objects of all the csv files in the "training_data" folder
         sample_csv (True as default) : True returns a small sample size with a random seed to replicate results. If False is passed the entire cleaned df is returned (2 million entries)
         seed (random seed is default) : integer between 0 and 999, used to replicate random_sample output for debugging. If no seed is passed a random one will be generated
+        stats_path (None as default) : json file where the fitted imputation statistics are saved (see imputation.py)
+        reuse_stats (False as default) : True fills missing values and filters outliers with the statistics already saved at stats_path instead of fitting new ones
+
+    The whole result is held in memory, the loaders use kaggle_accepted_loans_chunks
     """
-    #Create a random seed for sampling the large dataset if no seed is provided
-    if seed == 0:
-        seed = random.randint(0,999)
-        #print(f"Random seed to replicate accepted loans df: {seed}")
     try:
-        raw_accepted_loans = dataframe_list[0].copy()
-
-        #int/float64 columns that will go first in cleaned dataframe
-        num_cols = [
-            "id", "loan_amnt", "funded_amnt", "term", "int_rate", "installment", "annual_inc",
-            "dti", "delinq_2yrs", "fico_range_low", "fico_range_high", "inq_last_6mths",
-            "open_acc", "revol_bal", "revol_util", "total_acc", "pub_rec_bankruptcies"
-        ]
-
-        #String object columns that will be the last columns of the dataframe
-        text_cols = [
-            "home_ownership", "loan_status", "purpose", "application_type", "verification_status"
-        ]
-
-        #only find columns with valid ids (not string or empty)
-        cleaned_accepted_loans = raw_accepted_loans[num_cols + text_cols]
-        cleaned_accepted_loans = cleaned_accepted_loans[pd.to_numeric(cleaned_accepted_loans['id'], errors='coerce').notna()]
-
-        #convert id column to int instead of obj
-        cleaned_accepted_loans['id'] = cleaned_accepted_loans['id'].astype('int64')
-
-        #fix the the term column to make all the values int (specify in column label that numbers mean months)
-        cleaned_accepted_loans.rename(columns = {'term': 'term_months'}, inplace = True)
-        num_cols[3] = 'term_months'
-        cleaned_accepted_loans['term_months'] = cleaned_accepted_loans['term_months'].str.replace(" months", "")
-        cleaned_accepted_loans['term_months'] = cleaned_accepted_loans['term_months'].astype('int64')
-
-        #find any na rows and fill them as needed
-        for rows in num_cols:
-            cleaned_accepted_loans.loc[:, rows] = cleaned_accepted_loans[rows].fillna(cleaned_accepted_loans[rows].median())
-
-        finalized_accepted_df = remove_outliers(cleaned_accepted_loans)
-    
-    
-        try:
-            if sample_csv is True and seed != 0:
-                    #Create a random seed for sampling the large dataset if no seed is provided
-                    return finalized_accepted_df.sample(200000, random_state = seed)
-            elif sample_csv is True:
-                    print(f"Random seed to replicate accepted loans df: {seed}")
-                    return finalized_accepted_df.sample(200000, random_state = seed)
-            else:
-                print(f"Sample input was set --> {sample_csv}, thus the entire dataset will be returned")
-                return finalized_accepted_df
-        except Exception as e:
-            print(f"Error when attempting to get the dataframe cleaned up : {e}")
-            return
+        return concat_frames(kaggle_accepted_loans_chunks(dataframe_list, sample_csv, seed, stats_path, reuse_stats))
     except Exception as e:
         print(f"Error in kaggle_accepted_loans_df: {e}")
         return
@@ -262,6 +486,8 @@ def kaggle_accepted_loans_df(dataframe_list = list, sample_csv = True, seed = 0)
 def word_map(text):
     """
     Function to normalize the loan reason column in rejected dataframe
+
+    Row by row reference version, ingestion uses the vectorized classify_titles from title_classifier.py
     """
     if pd.isna(text): text = '' 
 
@@ -278,71 +504,109 @@ def word_map(text):
     
     return 'other'
 
-def kaggle_rejected_loans_df(dataframe_list = list, sample_csv = True, seed = 0):
+def clean_rejected_chunk(chunk = pd.DataFrame(), title_table = None, title_memo = None):
     """
-    Returns a cleaned up dataframe of Kaggle -> Rejected_Loans with relevant columns for model training
+    Helper that applies the row level cleaning of Kaggle -> Rejected_Loans to a single chunk of the raw csv
     Params:
-        dataframe_list : list containing dataframe objects of all the csv files in the "training_data" folder
-        sample_csv (True as default) : True returns a small sample size with a random seed to replicate results. If False is passed the entire cleaned df is returned (2 million entries)
-        seed (random seed is default) : integer between 0 and 999, used to replicate random_sample output for debugging. If no seed is passed a random one will be generated
+        chunk : dataframe chunk of the rejected csv
+        title_table : keyword -> category table used to classify 'Loan Title' (see title_classifier.py)
+        title_memo : dict of already classified titles, shared between chunks
+    """
+    #Only keep the needed columns (drops Risk_Score, Zip Code, State, Policy Code, Employment Length)
+    cleaned_chunk = chunk[list(REJECTED_DTYPES)].copy()
+
+    #Convert DTI to a float
+    cleaned_chunk['Debt-To-Income Ratio'] = cleaned_chunk['Debt-To-Income Ratio'].str.replace('%', '')
+    cleaned_chunk['Debt-To-Income Ratio'] = cleaned_chunk['Debt-To-Income Ratio'].astype('float64')
+
+    #Standardize the Loan Title data and classify each distinct title once (categorical output)
+    cleaned_chunk['Loan Title'] = classify_titles(normalize_titles(cleaned_chunk['Loan Title']), title_table, title_memo)
+
+    return apply_dtype_plan(cleaned_chunk, "staging_rejected_kaggle", verbose=False)
+
+def fix_negative_dti(chunks, dti_mean = float):
+    """
+    Generator that replaces the negative DTI of each chunk with the mean of the whole column
     """
+    for chunk in chunks:
+        dti = chunk['Debt-To-Income Ratio']
+        yield replace_where(chunk, 'Debt-To-Income Ratio', dti < 0, dti_mean)
+
+def kaggle_rejected_loans_chunks(dataframe_list = list, sample_csv = True, seed = 0, stats_path = None, reuse_stats = False):
+    """
+    Generator of the cleaned up chunks of Kaggle -> Rejected_Loans, memory used does not grow with the size of the file
+
+    Same two passes over a temporary spill file as kaggle_accepted_loans_chunks
 
+    Params: same as kaggle_rejected_loans_df
+    """
     #Create a random seed for sampling the large dataset if no seed is provided
     if seed == 0:
         seed = random.randint(0,999)
-        #print(f"Random seed to replicate accepted loans df: {seed}")
-    
-    try:
-        #Create a copy of the rejected loans df
-        raw_rejected_loans = dataframe_list[1].copy()
-
-        #Fix any negative DTI
-        raw_rejected_loans['Debt-To-Income Ratio'] = raw_rejected_loans['Debt-To-Income Ratio'].str.replace('%', '')
-        raw_rejected_loans['Debt-To-Income Ratio'] = raw_rejected_loans['Debt-To-Income Ratio'].astype('float64')
+        if sample_csv is True:
+            print(f"Random seed to replicate rejected loans df: {seed}")
+
+    title_table = load_title_categories()
+    title_memo = {}
+    stats, state = None, None
+    #mean and std of the outlier column and mean of the DTI, gathered with the imputer statistics
+    column = OUTLIER_COLUMNS["rejected"]
+    saved = load_reusable_moments([column, 'Debt-To-Income Ratio'], stats_path) if reuse_stats else None
+    moments, missing, dti_moments = new_moments(), 0, new_moments()
+
+    with tempfile.TemporaryDirectory() as spill_dir:
+        #clean the raw data chunk by chunk so only one chunk of the file is ever held in memory
+        spill_path = Path(spill_dir) / "rejected.pkl"
+        spilled = 0
+        with open(spill_path, "wb") as f:
+            for chunk in iter_frames(dataframe_list[1]):
+                chunk = clean_rejected_chunk(chunk, title_table, title_memo)
+                if not spilled:
+                    #Fix any missing values in the rejection loans, float columns get the median and the rest the most repeated value
+                    strategies = {col: "median" if chunk[col].dtypes == 'float64' else "mode" for col in chunk.columns}
+                    stats = load_reusable_imputer(strategies, stats_path) if reuse_stats else None
+                    state = new_imputer_state(strategies) if stats is None else None
+                if state is not None:
+                    update_imputer_state(state, chunk)
+                update_moments(moments, chunk[column])
+                missing += int(chunk[column].isna().sum())
+                update_moments(dti_moments, chunk['Debt-To-Income Ratio'])
+                spill_chunk(f, chunk)
+                spilled += 1
+        if not spilled:
+            return
 
-        raw_rejected_loans.loc[raw_rejected_loans['Debt-To-Income Ratio'] < 0, 'Debt-To-Income Ratio'] = raw_rejected_loans['Debt-To-Income Ratio'].mean()
+        #Fix any negative DTI (uses the mean of the whole column so it is done after all chunks are read)
+        dti_mean = finalize_moments(dti_moments)[0] if saved is None else saved['Debt-To-Income Ratio'][0]
 
-        #Standardize the Loan Title data
-        raw_rejected_loans['Loan Title'] = (
-            raw_rejected_loans['Loan Title'].astype('string').str.lower().str.strip()
-            .str.replace(r'[^a-z\s]', ' ', regex = True)
-            .str.replace(r'\s+', ' ', regex = True)
-        )
+        #the DTI median is taken after the negative values were replaced, same as when it was fitted on the fixed column
+        if state is not None:
+            replace_sampled_values(state, 'Debt-To-Income Ratio', lambda values: values < 0, dti_mean)
+            stats = save_imputer_state(state, stats_path)
+        if saved is None:
+            mean, std = outlier_moments(moments, missing, stats, column)
+            save_moments({column: (mean, std), 'Debt-To-Income Ratio': finalize_moments(dti_moments)}, stats_path)
+        else:
+            mean, std = saved[column]
 
-        raw_rejected_loans['Loan Title'] = raw_rejected_loans['Loan Title'].apply(word_map)
-        
-        #Drop unneeded columns 
-        cleaned_rejected_loans = raw_rejected_loans.drop(columns=['Risk_Score', 'Zip Code', 'State', 'Policy Code', 'Employment Length'])
-        rl_cols = list(cleaned_rejected_loans.columns)
-        
-        #Fix any missing values in the rejection loans
-        for rows in rl_cols:
-            #fix the rows that are of float type
-            if cleaned_rejected_loans[rows].dtypes == 'float64':
-                #print(f"replacing {rows} with median float")
-                cleaned_rejected_loans.loc[:, rows] = cleaned_rejected_loans[rows].fillna(cleaned_rejected_loans[rows].median())
-            else:
-                #get the highest repeated string and replace N/A's with that string
-                #print(f"replacing {rows} na's with most repeated string")
-                replacement_string = cleaned_rejected_loans[rows].value_counts().reset_index().at[0,rows]
-                cleaned_rejected_loans.loc[:, rows] = cleaned_rejected_loans[rows].fillna(replacement_string)
+        #Remove outliers based on the z score of the whole column
+        chunks = impute_chunks(fix_negative_dti(spilled_chunks(spill_path), dti_mean), stats, "staging_rejected_kaggle")
+        yield from finish_kaggle_chunks(filter_outliers_chunks(chunks, column, mean, std), "rejected", sample_csv, seed)
 
-        #Get a sample of the cleaned up df
-        finalized_rejected_df = remove_outliers(cleaned_rejected_loans, rejected=True)
+def kaggle_rejected_loans_df(dataframe_list = list, sample_csv = True, seed = 0, stats_path = None, reuse_stats = False):
+    """
+    Returns a cleaned up dataframe of Kaggle -> Rejected_Loans with relevant columns for model training
+    Params:
+        dataframe_list : list containing dataframe objects of all the csv files in the "training_data" folder
+        sample_csv (True as default) : True returns a small sample size with a random seed to replicate results. If False is passed the entire cleaned df is returned (2 million entries)
+        seed (random seed is default) : integer between 0 and 999, used to replicate random_sample output for debugging. If no seed is passed a random one will be generated
+        stats_path (None as default) : json file where the fitted imputation statistics are saved (see imputation.py)
+        reuse_stats (False as default) : True fills missing values and filters outliers with the statistics already saved at stats_path instead of fitting new ones
 
-        try:
-            if sample_csv is True and seed != 0:
-                    #Create a random seed for sampling the large dataset if no seed is provided
-                    return finalized_rejected_df.sample(200000, random_state = seed)
-            elif sample_csv is True:
-                    print(f"Random seed to replicate accepted loans df: {seed}")
-                    return finalized_rejected_df.sample(200000, random_state = seed)
-            else:
-                print(f"Sample input was set --> {sample_csv}, thus the entire dataset will be returned")
-                return finalized_rejected_df
-        except Exception as e:
-            print(f"Error when attempting to get the dataframe cleaned up : {e}")
-            return
+    The whole result is held in memory, the loaders use kaggle_rejected_loans_chunks
+    """
+    try:
+        return concat_frames(kaggle_rejected_loans_chunks(dataframe_list, sample_csv, seed, stats_path, reuse_stats))
     except Exception as e:
         print(f"Error in kaggle_rejected_loans_df: {e}")
-        return
\ No newline at end of file
+        return
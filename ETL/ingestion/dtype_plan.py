@@ -0,0 +1,198 @@
+import re
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+#DDL files the dtype plan is derived from (database/ folder at the root of the repo)
+DATABASE_DIR = Path(__file__).resolve().parents[2] / "database"
+DDL_FILES = ["database.sql", "staging.sql"]
+
+#Text columns with at most this share of distinct values are stored as categoricals, others as arrow strings
+CATEGORY_MAX_RATIO = 0.5
+
+#NUMERIC columns up to this precision fit in a float32 without changing the value once rounded to their scale
+FLOAT32_MAX_PRECISION = 7
+
+TABLE_RE = re.compile(
+    r'CREATE\s+(?:UNLOGGED\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?"?(\w+)"?\s*\((.*?)\)\s*(?:PARTITION\s+BY[^;]*)?;',
+    re.IGNORECASE | re.DOTALL,
+)
+COLUMN_RE = re.compile(
+    r'^\s*(?:"([^"]+)"|(\w+))\s+([A-Za-z]+(?:\s+(?:PRECISION|VARYING))?)\s*(?:\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\))?',
+    re.IGNORECASE,
+)
+CONSTRAINT_WORDS = ("PRIMARY", "UNIQUE", "CONSTRAINT", "FOREIGN", "CHECK", "EXCLUDE")
+
+INT_RANGES = [
+    ("int8", np.iinfo(np.int8)),
+    ("int16", np.iinfo(np.int16)),
+    ("int32", np.iinfo(np.int32)),
+    ("int64", np.iinfo(np.int64)),
+]
+
+#Widest integer dtype allowed for each SQL integer type
+SQL_INT_WIDTHS = {"SMALLINT": "int16", "INTEGER": "int32", "INT": "int32", "BIGINT": "int64", "SERIAL": "int32", "BIGSERIAL": "int64"}
+SQL_TEXT_TYPES = ("TEXT", "VARCHAR", "CHARACTER VARYING", "CHAR")
+
+def split_columns(body = str):
+    """
+    Splits the body of a CREATE TABLE on the commas that are not inside parentheses
+    """
+    parts, depth, current = [], 0, []
+    for char in body:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+def parse_ddl(sql = str):
+    """
+    Parses the CREATE TABLE statements of a sql script
+
+    Returns:
+        dict of table -> {column -> {"type": ..., "precision": ..., "scale": ...}}, unquoted names are lower cased like postgres does
+    """
+    sql = re.sub(r"--[^\n]*", "", sql)
+    tables = {}
+    for match in TABLE_RE.finditer(sql):
+        columns = {}
+        for definition in split_columns(match.group(2)):
+            if definition.split()[0].upper() in CONSTRAINT_WORDS:
+                continue
+            column = COLUMN_RE.match(definition)
+            if column is None:
+                continue
+            quoted, plain, sql_type, precision, scale = column.groups()
+            name = quoted if quoted is not None else plain.lower()
+            columns[name] = {
+                "type": " ".join(sql_type.upper().split()),
+                "precision": int(precision) if precision else None,
+                "scale": int(scale) if scale else None,
+            }
+        tables[match.group(1).lower()] = columns
+    return tables
+
+@lru_cache(maxsize=None)
+def load_schema():
+    """
+    Column types of every table declared in the DDL files (see DDL_FILES)
+    """
+    schema = {}
+    for name in DDL_FILES:
+        with open(DATABASE_DIR / name, "r") as f:
+            schema.update(parse_ddl(f.read()))
+    return schema
+
+def table_schema(table = str):
+    """
+    Column types of one table, raises KeyError if the table is not declared in the DDL files
+    """
+    return load_schema()[table.lower()]
+
+def smallest_int(values = pd.Series(dtype="int64"), widest = "int64"):
+    """
+    Smallest integer dtype that holds every value of a column, None if the column has missing or non integer values or does not fit in widest
+    """
+    if values.hasnans:
+        return None
+    array = values.to_numpy()
+    if array.dtype.kind == "f" and not np.array_equal(array, np.floor(array)):
+        return None
+    low, high = (array.min(), array.max()) if len(array) else (0, 0)
+
+    widths = [name for name, _ in INT_RANGES]
+    for name, info in INT_RANGES[:widths.index(widest) + 1]:
+        if info.min <= low and high <= info.max:
+            return name
+    return None
+
+def text_dtype(values = pd.Series(dtype=object)):
+    """
+    Categorical for low cardinality text, arrow backed strings for the rest
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return None
+    if len(values) == 0 or values.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(values):
+        return "category"
+    return "string[pyarrow]"
+
+def column_dtype(values = pd.Series(dtype=object), column_type = None):
+    """
+    Compact dtype for one column given its SQL type (None if the column is not in the table), None keeps the current dtype
+    """
+    kind = values.dtype.kind
+    sql_type = column_type["type"] if column_type else None
+
+    if kind in "iuf":
+        #only the columns declared as integers are downcast, an integral float written to a TEXT or NUMERIC column keeps its
+        #dtype so it is written the same way (ex: '15.0' for a rejected DTI, not '15')
+        if sql_type in SQL_INT_WIDTHS:
+            int_dtype = smallest_int(values, SQL_INT_WIDTHS[sql_type])
+            if int_dtype is not None:
+                return int_dtype
+        if kind == "f" and sql_type == "NUMERIC" and (column_type["precision"] or 99) <= FLOAT32_MAX_PRECISION:
+            return "float32"
+        return None
+
+    if kind in "OUT" or isinstance(values.dtype, (pd.StringDtype, pd.CategoricalDtype)):
+        #text held in a numeric column (ex: 'Exempt' left after cleaning) is left untouched
+        if sql_type is not None and sql_type not in SQL_TEXT_TYPES and sql_type != "DATE":
+            return None
+        return text_dtype(values)
+
+    return None
+
+def concat_frames(frames = list):
+    """
+    pd.concat for chunks that went through apply_dtype_plan, categorical columns are concatenated on the union of
+    their categories so they stay categorical (plain pd.concat falls back to object when the categories differ)
+    """
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame()
+
+    for column in frames[0].columns:
+        if not all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            continue
+        categories = pd.Index([])
+        for frame in frames:
+            categories = categories.union(frame[column].cat.categories, sort=False)
+        for frame in frames:
+            frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames)
+
+def dtype_plan(df = pd.DataFrame(), table = str):
+    """
+    Returns a dict of column -> compact dtype for a cleaned dataframe that will be written to table
+
+    Integers (and integral floats) of the columns declared as SQL integers are downcast to the smallest width that holds their values,
+    NUMERIC(p<=7) columns become float32, text becomes categorical or arrow strings
+    """
+    schema = table_schema(table)
+    plan = {}
+    for column in df.columns:
+        dtype = column_dtype(df[column], schema.get(column))
+        if dtype is not None and str(df[column].dtype) != dtype:
+            plan[column] = dtype
+    return plan
+
+def apply_dtype_plan(df = pd.DataFrame(), table = str, verbose = True):
+    """
+    Converts the columns of df in place to the dtype plan of table and returns df
+    """
+    before = df.memory_usage(deep=True).sum() if verbose else 0
+    for column, dtype in dtype_plan(df, table).items():
+        df[column] = df[column].astype(dtype)
+
+    if verbose:
+        after = df.memory_usage(deep=True).sum()
+        print(f"[dtype_plan] {table}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+    return df
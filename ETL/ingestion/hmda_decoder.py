@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+#HMDA publishes some fields as range codes, each code is decoded to one number
+#(the middle of the range, or its bound when the range is open or too broad)
+#https://ffiec.cfpb.gov/documentation/publications/loan-level-datasets/lar-data-fields
+DTI_CODES = {
+    "<20%": 20,
+    "20%-<30%": (29 + 20) / 2,
+    "30%-<36%": (35 + 30) / 2,
+    "50%-60%": 55,
+    ">60%": 60,
+}
+
+#Placeholders that mean the value was not reported, decoded as missing values so they are imputed like any other gap
+SENTINELS = ("Exempt", "NA", "")
+
+#Code table of each decoded column, values that are not in the table are parsed as numbers (ex: exact DTI values 36 ... 49)
+HMDA_CODE_TABLES = {
+    "debt_to_income_ratio": DTI_CODES,
+    "loan_to_value_ratio": {},
+    "income": {},
+    "loan_term": {},
+}
+
+def decode_values(values = pd.Index([]), codes = dict, sentinels = SENTINELS):
+    """
+    Decodes distinct values: code table first, then sentinels (NaN), then anything that parses as a number
+
+    Returns:
+        float64 numpy array, NaN for sentinels and values that can not be parsed
+    """
+    decoded = np.full(len(values), np.nan)
+    as_text = values.astype(str).str.strip()
+
+    in_table = as_text.isin(list(codes))
+    decoded[in_table] = as_text[in_table].map(codes).to_numpy(dtype="float64")
+
+    parse = ~in_table & ~as_text.isin(list(sentinels))
+    decoded[parse] = pd.to_numeric(as_text[parse], errors="coerce")
+    return decoded
+
+def decode_column(series = pd.Series(dtype=object), codes = dict, sentinels = SENTINELS):
+    """
+    Decodes a range coded HMDA column to float64 in one lookup pass
+
+    The column is factorized so each distinct value is decoded once, rows only take the decoded value of their code
+    """
+    if series.dtype.kind in "iuf":
+        return series.astype("float64")
+
+    row_codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    decoded = decode_values(pd.Index(uniques), codes, sentinels)
+    #code -1 (missing value) picks the NaN appended at the end
+    lookup = np.append(decoded, np.nan)
+    return pd.Series(lookup[row_codes], index=series.index, name=series.name)
+
+def decode_hmda_columns(df = pd.DataFrame(), tables = HMDA_CODE_TABLES):
+    """
+    Decodes every range coded column of an HDMA dataframe in place (DTI, LTV, income, loan_term), columns that are not in df are skipped
+    """
+    for column, codes in tables.items():
+        if column in df.columns:
+            df[column] = decode_column(df[column], codes)
+    return df
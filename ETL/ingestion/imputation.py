@@ -0,0 +1,252 @@
+import os
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+#Folder inside 'training data' where fitted imputation statistics are saved
+STATS_DIR = "imputation"
+
+#Number of values kept per column by the median sketch when fitting chunk by chunk
+RESERVOIR_SIZE = 200_000
+
+STRATEGIES = ("median", "mode", "mean")
+
+def stats_path(DATA = Path, name = str):
+    """
+    Returns the path where the fitted statistics of a dataset (ex: 'kaggle_accepted') are saved
+    """
+    return DATA / STATS_DIR / f"{name}.json"
+
+def to_python(value):
+    """
+    Helper that turns numpy scalars into python values so the statistics can be saved as json
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+def column_mode(series = pd.Series(dtype=object)):
+    """
+    Most repeated value of a column (first one in value_counts order on ties), None if the column is empty
+    """
+    counts = series.value_counts()
+    if counts.empty:
+        return None
+    return counts.index[0]
+
+def fit_imputer(df = pd.DataFrame(), strategies = dict):
+    """
+    Computes the replacement value of every column in a single pass over an in memory dataframe (exact statistics)
+
+    Params:
+        df : dataframe to fit on
+        strategies : dict of column -> 'median', 'mode' or 'mean'
+
+    Returns:
+        dict of column -> {"strategy": ..., "value": ...}
+    """
+    by_strategy = {strategy: [col for col, s in strategies.items() if s == strategy] for strategy in STRATEGIES}
+    unknown = set(strategies.values()) - set(STRATEGIES)
+    if unknown:
+        raise ValueError(f"[imputation] unknown strategies: {unknown}")
+
+    values = {}
+    #medians and means of all numeric columns are computed together, column by column is only needed for modes
+    if by_strategy["median"]:
+        values.update(df[by_strategy["median"]].median().to_dict())
+    if by_strategy["mean"]:
+        values.update(df[by_strategy["mean"]].mean().to_dict())
+    for col in by_strategy["mode"]:
+        values[col] = column_mode(df[col])
+
+    return {col: {"strategy": strategies[col], "value": to_python(values[col])} for col in strategies}
+
+def new_imputer_state(strategies = dict, reservoir_size = RESERVOIR_SIZE, seed = 0):
+    """
+    Returns an empty state used to fit the imputer chunk by chunk (see update_imputer_state)
+
+    medians use a fixed size uniform sample (reservoir) of each column, modes and means are exact
+    """
+    return {
+        "strategies": dict(strategies),
+        "reservoir_size": reservoir_size,
+        "rng": np.random.default_rng(seed),
+        "reservoirs": {},
+        "counts": {},
+        "sums": {},
+    }
+
+def update_imputer_state(state = dict, chunk = pd.DataFrame()):
+    """
+    Adds one chunk to a state made by new_imputer_state, memory used by the state does not grow with the number of chunks
+    """
+    for col, strategy in state["strategies"].items():
+        series = chunk[col]
+
+        if strategy == "mode":
+            counts = series.value_counts()
+            previous = state["counts"].get(col)
+            state["counts"][col] = counts if previous is None else previous.add(counts, fill_value=0)
+
+        elif strategy == "mean":
+            total, n = state["sums"].get(col, (0.0, 0))
+            state["sums"][col] = (total + float(series.sum()), n + int(series.count()))
+
+        else:
+            #keep the values with the smallest random keys, which is a uniform sample of every value seen so far
+            values = series.dropna().to_numpy(dtype="float64")
+            keys = state["rng"].random(len(values))
+            if col in state["reservoirs"]:
+                old_keys, old_values = state["reservoirs"][col]
+                keys = np.concatenate([old_keys, keys])
+                values = np.concatenate([old_values, values])
+            if len(keys) > state["reservoir_size"]:
+                keep = np.argpartition(keys, state["reservoir_size"])[:state["reservoir_size"]]
+                keys, values = keys[keep], values[keep]
+            state["reservoirs"][col] = (keys, values)
+
+def finalize_imputer_state(state = dict):
+    """
+    Turns a chunked state into the same statistics dict returned by fit_imputer
+    """
+    stats = {}
+    for col, strategy in state["strategies"].items():
+        if strategy == "mode":
+            counts = state["counts"].get(col)
+            value = None if counts is None or counts.empty else counts.sort_values(ascending=False, kind="stable").index[0]
+        elif strategy == "mean":
+            total, n = state["sums"].get(col, (0.0, 0))
+            value = total / n if n else None
+        else:
+            _, values = state["reservoirs"].get(col, (None, np.array([])))
+            value = float(np.median(values)) if len(values) else None
+        stats[col] = {"strategy": strategy, "value": to_python(value)}
+    return stats
+
+def save_imputer_state(state = dict, path = None):
+    """
+    Finalizes a chunked state (see finalize_imputer_state) and saves the statistics when a path is given
+    """
+    stats = finalize_imputer_state(state)
+    if path is not None:
+        save_imputer(stats, path)
+    return stats
+
+def replace_sampled_values(state = dict, col = str, condition = None, value = None):
+    """
+    Replaces the values kept by the median sample of col where condition(values) is True, for a column that is fixed
+    after its chunks were added to the state (ex: negative values set to the column mean once the mean is known)
+    """
+    if col in state["reservoirs"]:
+        keys, values = state["reservoirs"][col]
+        state["reservoirs"][col] = (keys, np.where(condition(values), value, values))
+
+def apply_imputer(df = pd.DataFrame(), stats = dict, sentinels = None):
+    """
+    Fills the missing values of df in place with the fitted statistics
+
+    Params:
+        df : dataframe to fill
+        stats : statistics from fit_imputer / finalize_imputer_state / load_imputer
+        sentinels : optional dict of column -> list of placeholder values (ex: 'Exempt') that are replaced the same way as missing values
+    """
+    if sentinels:
+        replacements = {
+            col: {placeholder: stats[col]["value"] for placeholder in placeholders}
+            for col, placeholders in sentinels.items()
+            if col in df.columns and stats.get(col, {}).get("value") is not None
+        }
+        if replacements:
+            df.replace(replacements, inplace=True)
+
+    fill_values = {
+        col: entry["value"] for col, entry in stats.items()
+        if col in df.columns and entry["value"] is not None and df[col].hasnans
+    }
+    for col, value in fill_values.items():
+        #a categorical column can only be filled with one of its categories
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and value not in df[col].cat.categories:
+            df[col] = df[col].cat.add_categories([value])
+    if fill_values:
+        df.fillna(fill_values, inplace=True)
+    return df
+
+def save_imputer(stats = dict, path = Path):
+    """
+    Saves fitted statistics as json so later (or sampled) runs can reuse them
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(stats, f, indent=2)
+    os.replace(tmp_path, path)
+
+def load_imputer(path = Path):
+    """
+    Loads statistics saved by save_imputer, returns None if the file does not exist
+    """
+    if path is None or not Path(path).exists():
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+def load_reusable_imputer(strategies = dict, path = None):
+    """
+    Returns the statistics saved at path when they cover every column of strategies, None otherwise
+    """
+    stats = load_imputer(path)
+    if stats is not None and set(strategies) <= set(stats):
+        print(f"[imputation] reusing saved statistics from {path}")
+        return stats
+    return None
+
+def moments_path(path = Path):
+    """
+    Returns the json file next to the imputation statistics at path where the outlier statistics are saved (ex: kaggle_accepted_moments.json)
+    """
+    path = Path(path)
+    return path.with_name(f"{path.stem}_moments.json")
+
+def save_moments(moments = dict, path = None):
+    """
+    Saves the (mean, std) of each column used by the z score filter next to the imputation statistics at path (nothing when path is None)
+    """
+    if path is None:
+        return
+    save_imputer({col: {"mean": to_python(mean), "std": to_python(std)} for col, (mean, std) in moments.items()}, moments_path(path))
+
+def load_reusable_moments(columns = list, path = None):
+    """
+    Returns the column -> (mean, std) saved next to the imputation statistics at path when they cover every column, None otherwise
+
+    Incremental loads filter their rows with the statistics of the full load, the moments of a small delta are meaningless
+    (the std of a single row is NaN and would drop it)
+    """
+    if path is None:
+        return None
+    saved = load_imputer(moments_path(path))
+    if saved is None or not set(columns) <= set(saved):
+        return None
+    moments = {col: (saved[col]["mean"], saved[col]["std"]) for col in columns}
+    if any(value is None for pair in moments.values() for value in pair):
+        return None
+    print(f"[imputation] reusing saved outlier statistics from {moments_path(path)}")
+    return moments
+
+def fit_or_load_imputer(df = pd.DataFrame(), strategies = dict, path = None, reuse = False):
+    """
+    Returns the statistics saved at path when reuse is True and they cover every column, otherwise fits them on df (and saves them when a path is given)
+    """
+    if reuse:
+        stats = load_reusable_imputer(strategies, path)
+        if stats is not None:
+            return stats
+
+    stats = fit_imputer(df, strategies)
+    if path is not None:
+        save_imputer(stats, path)
+    return stats
@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from ETL.ingestion.sampling import ROW_NUMBER
+
+#Manifest that records the content hash of every source file and the parquet file derived from it (shared with cache_manager.py)
+MANIFEST_NAME = "cache_manifest.json"
+LOCK_NAME = "cache_manifest.lock"
+
+#A lock file older than this (seconds) was left by a crashed process and is removed
+LOCK_STALE = 600
+CACHE_DIR = "parquet_cache"
+
+#Rows per parquet row group / per chunk when converting or reading the cache
+#kept small so sampled reads (see sampling.py) can pick from many row groups
+ROW_GROUP_SIZE = 64_000
+
+#row digests (see rows_digest) are sums of 64 bit row hashes
+DIGEST_MOD = 2 ** 64
+
+#pandas dtype -> arrow type used for the cached parquet schema
+ARROW_TYPES = {
+    "str": pa.string(),
+    "float64": pa.float64(),
+    "int64": pa.int64(),
+}
+
+def load_manifest(DATA = Path):
+    """
+    Returns the cache manifest stored in the 'training data' folder (empty manifest if none exists yet)
+    """
+    manifest_path = DATA / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {"sources": {}, "parquet": {}, "artifacts": {}}
+
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+
+    manifest.setdefault("sources", {})
+    manifest.setdefault("parquet", {})
+    #size and last use of every file in the folder, see cache_manager.py
+    manifest.setdefault("artifacts", {})
+    return manifest
+
+def save_manifest(DATA = Path, manifest = dict):
+    """
+    Writes the cache manifest to the 'training data' folder, replaces the old file in one step so a crash never leaves half a manifest
+    """
+    manifest_path = DATA / MANIFEST_NAME
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+@contextmanager
+def manifest_lock(DATA = Path, poll = 0.05):
+    """
+    Context manager that holds an exclusive lock on the manifest, so processes running in parallel (see parallel_staging.py) do not overwrite each other's entries
+    """
+    lock_path = DATA / LOCK_NAME
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock_path).st_mtime > LOCK_STALE:
+                    os.remove(lock_path)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(poll)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
+
+def update_manifest(DATA = Path, update = None):
+    """
+    Loads the latest manifest, applies update(manifest) and saves it while holding the manifest lock
+    """
+    with manifest_lock(DATA):
+        manifest = load_manifest(DATA)
+        update(manifest)
+        save_manifest(DATA, manifest)
+    return manifest
+
+def file_sha256(file = Path, block_size = 8 * 1024 * 1024):
+    """
+    Returns the sha256 hex digest of a file, read in blocks so large csvs are never loaded into memory
+    """
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_hash(DATA = Path, file = Path, manifest = dict):
+    """
+    Returns the content hash of a source file
+
+    The hash is stored in the manifest together with the file size and modification time, so an unchanged file is only hashed once
+    """
+    key = str(Path(file).relative_to(DATA))
+    stat = os.stat(file)
+    entry = manifest["sources"].get(key)
+
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["sha256"]
+
+    print(f"[parquet_cache] hashing {file.name}")
+    sha = file_sha256(file)
+    manifest["sources"][key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha}
+    return sha
+
+def projection_key(dtypes = dict):
+    """
+    Short hash of the projected columns and their dtypes, changing the projection creates a new cache file
+    """
+    spec = json.dumps(sorted(dtypes.items()))
+    return hashlib.sha256(spec.encode()).hexdigest()[:8]
+
+def arrow_schema(dtypes = dict):
+    """
+    Builds the arrow schema of a cached parquet file from a dict of column name -> pandas dtype
+    """
+    return pa.schema([(col, ARROW_TYPES[dtype]) for col, dtype in dtypes.items()])
+
+def csv_to_parquet(file = Path, dtypes = dict, out_path = Path, chunksize = ROW_GROUP_SIZE):
+    """
+    Converts the projected columns of a csv into a parquet file, one chunk (row group) at a time
+
+    Returns:
+        int : number of rows written
+    """
+    schema = arrow_schema(dtypes)
+    tmp_path = out_path.with_suffix(".tmp")
+    rows = 0
+
+    with pd.read_csv(file, usecols=list(dtypes), dtype=dtypes, chunksize=chunksize) as reader:
+        with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+            for chunk in reader:
+                table = pa.Table.from_pandas(chunk[list(dtypes)], schema=schema, preserve_index=False)
+                writer.write_table(table, row_group_size=chunksize)
+                rows += len(chunk)
+
+    os.replace(tmp_path, out_path)
+    return rows
+
+def cached_parquet(DATA = Path, name = str, file = None, dtypes = dict):
+    """
+    Returns the path of the parquet cache for a source csv, converting the csv only if no cache exists for its content
+
+    Params:
+        DATA : Path object that points to the 'training data' folder
+        name : name of the cached dataset (ex: 'kaggle_accepted')
+        file : Path of the source csv, if None the last cached parquet for this name is reused (source was already deleted)
+        dtypes : dict of column name -> dtype that will be stored in the parquet file
+
+    Returns:
+        Path to the parquet file or None if no cache exists and no source csv was given
+    """
+    manifest = load_manifest(DATA)
+    proj = projection_key(dtypes)
+
+    if file is None:
+        entry = manifest["parquet"].get(name)
+        if entry and entry["projection"] == proj and (DATA / entry["path"]).exists():
+            print(f"[parquet_cache] source csv for {name} not found, using cached {entry['path']}")
+            return DATA / entry["path"]
+        return None
+
+    sha = source_hash(DATA, file, manifest)
+    out_path = DATA / CACHE_DIR / f"{name}-{sha[:16]}-{proj}.parquet"
+
+    if out_path.exists():
+        print(f"[parquet_cache] cache hit for {name} -> {out_path.name}")
+    else:
+        print(f"[parquet_cache] converting {file.name} to {out_path.name}")
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        rows = csv_to_parquet(file, dtypes, out_path)
+        print(f"[parquet_cache] wrote {rows} rows to {out_path.name}")
+
+    source_key = str(Path(file).relative_to(DATA))
+    def record(latest):
+        #merged into the latest manifest, another process may have saved its own entries since it was loaded
+        latest["sources"][source_key] = manifest["sources"][source_key]
+        latest["parquet"][name] = {
+            "source": source_key,
+            "sha256": sha,
+            "projection": proj,
+            "path": str(out_path.relative_to(DATA)),
+        }
+    update_manifest(DATA, record)
+    return out_path
+
+def has_cached_parquet(DATA = Path, name = str, dtypes = dict):
+    """
+    Returns True if the manifest points to an existing parquet cache for this name and projection
+    """
+    entry = load_manifest(DATA)["parquet"].get(name)
+    return bool(entry) and entry["projection"] == projection_key(dtypes) and (DATA / entry["path"]).exists()
+
+def read_parquet_chunks(file = Path, columns = list, chunksize = ROW_GROUP_SIZE):
+    """
+    Generator that streams the given columns of a parquet file in chunks
+
+    The index of each chunk continues from the previous one, the same as pd.read_csv(chunksize=...)
+    """
+    parquet_file = pq.ParquetFile(file)
+    offset = 0
+    for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+def parquet_rows(file = Path):
+    """
+    Returns the number of rows of a parquet file, read from its footer
+    """
+    return pq.ParquetFile(file).metadata.num_rows
+
+def read_parquet_range(file = Path, columns = None, start_row = 0, stop_row = None, chunksize = ROW_GROUP_SIZE, filter = None):
+    """
+    Generator that streams rows [start_row, stop_row) of a parquet file, row groups outside the range are never read
+
+    The index of each chunk is the row number in the file, so rows keep the same index as in read_parquet_chunks
+
+    Params:
+        file : Path of the parquet file
+        columns : columns to read (None reads all)
+        start_row (0 as default) : first row to read
+        stop_row (None as default) : row to stop before, None reads to the end of the file
+        chunksize (ROW_GROUP_SIZE as default) : rows per chunk
+        filter (None as default) : pyarrow expression, only the rows that match it are returned (its columns must be in columns)
+    """
+    parquet_file = pq.ParquetFile(file)
+    metadata = parquet_file.metadata
+    stop_row = metadata.num_rows if stop_row is None else min(stop_row, metadata.num_rows)
+
+    group_start = 0
+    for group in range(metadata.num_row_groups):
+        group_end = group_start + metadata.row_group(group).num_rows
+        if group_end <= start_row:
+            group_start = group_end
+            continue
+        if group_start >= stop_row:
+            break
+
+        first = max(start_row, group_start)
+        last = min(stop_row, group_end)
+        table = parquet_file.read_row_group(group, columns=columns).slice(first - group_start, last - first)
+        row_numbers = np.arange(first, last)
+        if filter is not None:
+            table = table.append_column(ROW_NUMBER, pa.array(row_numbers)).filter(filter)
+            row_numbers = table.column(ROW_NUMBER).to_numpy()
+            table = table.drop_columns([ROW_NUMBER])
+
+        for offset in range(0, table.num_rows, chunksize):
+            chunk = table.slice(offset, chunksize).to_pandas()
+            chunk.index = pd.Index(row_numbers[offset:offset + len(chunk)])
+            yield chunk
+        group_start = group_end
+
+def row_groups(file = Path, columns = None):
+    """
+    Returns the row groups of a parquet file with a sha256 of the raw bytes of their column chunks, the rows are not decoded
+
+    A group whose bytes did not change holds the same rows, so incremental loads only decode and hash (see rows_digest)
+    the groups whose bytes changed instead of every row below the watermark
+
+    Params:
+        file : Path of the parquet file
+        columns : columns hashed (None hashes all)
+
+    Returns:
+        list of dicts with the first row ("start"), the number of rows ("rows") and the "sha256" of each row group
+    """
+    metadata = pq.ParquetFile(file).metadata
+    groups, start = [], 0
+    with open(file, "rb") as f:
+        for group in range(metadata.num_row_groups):
+            row_group = metadata.row_group(group)
+            digest = hashlib.sha256()
+            for i in range(row_group.num_columns):
+                chunk = row_group.column(i)
+                if columns is not None and chunk.path_in_schema not in columns:
+                    continue
+                #a column chunk starts with its dictionary page when it has one
+                f.seek(chunk.dictionary_page_offset if chunk.has_dictionary_page else chunk.data_page_offset)
+                digest.update(f.read(chunk.total_compressed_size))
+            groups.append({"start": start, "rows": row_group.num_rows, "sha256": digest.hexdigest()})
+            start += row_group.num_rows
+    return groups
+
+def rows_digest(file = Path, columns = None, start_row = 0, stop_row = None):
+    """
+    Returns a digest of rows [start_row, stop_row) of a parquet file, used as the row watermark check of incremental loads
+
+    Each row is hashed together with its row number and the hashes are summed (mod 2**64), so the digest of rows [0, n)
+    is the digest of [0, w) plus the digest of [w, n) and a watermark can be moved forward without re-reading the rows before it
+
+    Returns:
+        int : digest in [0, 2**64)
+    """
+    total = 0
+    for chunk in read_parquet_range(file, columns, start_row, stop_row):
+        total = (total + int(pd.util.hash_pandas_object(chunk, index=True).to_numpy().sum(dtype=np.uint64))) % DIGEST_MOD
+    return total
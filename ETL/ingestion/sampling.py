@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+#Number of rows returned by the ingestion functions when sample = True
+SAMPLE_SIZE = 200_000
+
+#Rows read ahead of cleaning for a sample, cleaning and outlier removal drop part of them
+OVERSAMPLE = 1.25
+
+#Temporary column that keeps the row number of each row through a filter
+ROW_NUMBER = "__row_number"
+
+#Row group sampling reads SPREAD times the rows it needs and keeps 1/SPREAD of each group, so the sample is not clustered in a few groups
+SPREAD = 2
+
+def pushdown_rows(n_rows = SAMPLE_SIZE, oversample = OVERSAMPLE):
+    """
+    Number of raw rows to read so that n_rows are left after cleaning
+    """
+    return int(n_rows * oversample)
+
+def splitmix64(values = np.array([], dtype=np.uint64)):
+    """
+    Mixes uint64 values so that close keys (ex: row numbers) get unrelated hashes
+    """
+    with np.errstate(over="ignore"):
+        z = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+def hash_keys(keys = pd.Series(dtype=object), seed = 0):
+    """
+    Deterministic 64 bit hash of each key, a different seed gives an unrelated ordering of the same keys
+    """
+    hashes = pd.util.hash_pandas_object(pd.Series(keys), index=False).to_numpy()
+    seed_mix = splitmix64(np.array([seed], dtype=np.uint64))[0]
+    return splitmix64(hashes ^ seed_mix)
+
+def hash_fraction_mask(keys = pd.Series(dtype=object), seed = 0, fraction = 1.0):
+    """
+    Boolean mask keeping about fraction of the keys, the same keys and seed always give the same mask
+    """
+    if fraction >= 1:
+        return np.ones(len(keys), dtype=bool)
+    #compare the top 53 bits so the threshold can be computed exactly from a float
+    return (hash_keys(keys, seed) >> np.uint64(11)) < np.uint64(int(fraction * 2**53))
+
+def chunk_keys(chunk = pd.DataFrame(), key = None):
+    """
+    Sampling key of each row of a chunk, the key column if given else the row number in the file (chunk index)
+    """
+    if key is None:
+        return pd.Series(chunk.index.to_numpy())
+    return chunk[key].reset_index(drop=True)
+
+def sample_chunks(chunks, n_rows = SAMPLE_SIZE, seed = 0, key = None):
+    """
+    Generator that keeps the n_rows rows with the smallest key hash across a stream of chunks (bottom-k sampling)
+
+    Only about n_rows rows are held in memory at any time and the result does not depend on the chunk size
+
+    Params:
+        chunks : iterable of dataframe chunks
+        n_rows : number of rows to keep
+        seed : random seed, the same seed always keeps the same rows
+        key : column used as sampling key, None uses the row number in the file
+    """
+    kept_frames, kept_hashes = [], []
+    threshold = np.iinfo(np.uint64).max
+
+    for chunk in chunks:
+        hashes = hash_keys(chunk_keys(chunk, key), seed)
+        mask = hashes <= threshold
+        kept_frames.append(chunk[mask])
+        kept_hashes.append(hashes[mask])
+
+        if sum(len(h) for h in kept_hashes) > 2 * n_rows:
+            frame, hashes = compact_sample(kept_frames, kept_hashes, n_rows)
+            threshold = hashes.max()
+            kept_frames, kept_hashes = [frame], [hashes]
+
+    if kept_frames:
+        frame, _ = compact_sample(kept_frames, kept_hashes, n_rows)
+        yield frame
+
+def compact_sample(frames = list, hashes = list, n_rows = SAMPLE_SIZE):
+    """
+    Helper for sample_chunks that keeps the n_rows smallest hashes, rows stay in file order
+    """
+    frame = pd.concat(frames)
+    hashes = np.concatenate(hashes)
+    if len(hashes) > n_rows:
+        keep = np.sort(np.argpartition(hashes, n_rows - 1)[:n_rows])
+        frame, hashes = frame.iloc[keep], hashes[keep]
+    return frame, hashes
+
+def sample_row_groups(row_group_rows = list, n_rows = SAMPLE_SIZE, seed = 0, spread = SPREAD):
+    """
+    Picks random row groups (seeded) until they hold spread * n_rows rows
+
+    Returns:
+        sorted list of row group numbers
+    """
+    order = np.random.default_rng(seed).permutation(len(row_group_rows))
+    picked, total = [], 0
+    for group in order:
+        if total >= n_rows * spread:
+            break
+        picked.append(int(group))
+        total += row_group_rows[group]
+    return sorted(picked)
+
+def read_row_group(parquet_file = None, group = int, start = int, columns = None, filter = None):
+    """
+    Helper that reads one row group as a dataframe indexed by row number in the file, only the rows matching filter when given
+    """
+    table = parquet_file.read_row_group(group, columns=columns)
+    row_numbers = np.arange(start, start + table.num_rows)
+    if filter is not None:
+        #row numbers go through the filter so the sampling keys stay the same as without it
+        table = table.append_column(ROW_NUMBER, pa.array(row_numbers)).filter(filter)
+        row_numbers = table.column(ROW_NUMBER).to_numpy()
+        table = table.drop_columns([ROW_NUMBER])
+    chunk = table.to_pandas()
+    chunk.index = pd.Index(row_numbers)
+    return chunk
+
+def filtered_row_groups(parquet_file = None, starts = None, columns = None, filter = None, n_rows = SAMPLE_SIZE, seed = 0):
+    """
+    Generator that reads row groups in a seeded random order, keeping the rows that match filter, until n_rows rows matched
+    """
+    order = np.random.default_rng(seed).permutation(parquet_file.num_row_groups)
+    matched = 0
+    for group in order:
+        if matched >= n_rows:
+            break
+        chunk = read_row_group(parquet_file, int(group), starts[group], columns, filter)
+        matched += len(chunk)
+        yield chunk
+
+def read_parquet_sample(file = None, columns = None, n_rows = SAMPLE_SIZE, seed = 0, key = None, spread = SPREAD, filter = None):
+    """
+    Generator that reads a sample of about n_rows rows from a parquet file, touching only the sampled row groups
+
+    Rows inside the picked row groups are kept by hash of key (or row number) so the sample is spread over several groups
+
+    Params:
+        file : Path of the parquet file
+        columns : columns to read (None reads all)
+        n_rows : number of rows wanted
+        seed : random seed, the same seed always returns the same rows
+        key : column used as sampling key, None uses the row number in the file
+        filter (None as default) : pyarrow expression, only the sampled rows that match it are returned (its columns must be in columns)
+    """
+    parquet_file = pq.ParquetFile(file)
+    row_group_rows = [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)]
+    starts = np.cumsum([0] + row_group_rows)
+
+    if filter is not None:
+        #how many rows of a group match the filter is only known once it is read, so groups are read until spread * n_rows rows
+        #matched and the n_rows with the smallest key hash are kept (bottom-k), a selective filter still returns n_rows rows
+        chunks = filtered_row_groups(parquet_file, starts, columns, filter, n_rows * spread, seed)
+        for chunk in sample_chunks(chunks, n_rows, seed, key):
+            print(f"[sampling] sampled {len(chunk)} rows matching the filter from {file.name}")
+            yield chunk.sort_index()
+        return
+
+    groups = sample_row_groups(row_group_rows, n_rows, seed, spread)
+    picked_rows = sum(row_group_rows[group] for group in groups)
+    fraction = n_rows / picked_rows if picked_rows else 1.0
+    print(f"[sampling] reading {len(groups)} of {len(row_group_rows)} row groups from {file.name}")
+
+    for group in groups:
+        chunk = read_row_group(parquet_file, group, starts[group], columns)
+        yield chunk[hash_fraction_mask(chunk_keys(chunk, key), seed, fraction)]
+
+def finalize_sample(df = pd.DataFrame(), n_rows = SAMPLE_SIZE, seed = 0):
+    """
+    Returns a random sample of n_rows rows of a cleaned dataframe (the whole dataframe if it has fewer rows)
+    """
+    if len(df) < n_rows:
+        print(f"[sampling] only {len(df)} rows left after cleaning, returning all of them instead of {n_rows}")
+        return df
+    return df.sample(n_rows, random_state = seed)
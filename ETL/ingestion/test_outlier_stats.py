@@ -0,0 +1,60 @@
+#python -m pytest ETL/ingestion/test_outlier_stats.py
+#incremental loads filter their delta with the outlier statistics saved by the full load (see imputation.py)
+
+import pandas as pd
+import pytest
+
+from ETL.ingestion.imputation import stats_path, save_moments, load_reusable_moments
+from ETL.ingestion.cleaning_kernel import filter_outliers, column_moments
+
+def hdma_rows(loan_amounts = list):
+    """
+    Raw HDMA accepted rows (as read_hdma returns them) with the given loan amounts
+    """
+    return pd.DataFrame({
+        "activity_year": 2023,
+        "action_taken": 1,
+        "preapproval": 2,
+        "loan_purpose": 1,
+        "loan_amount": [float(amount) for amount in loan_amounts],
+        "loan_term": "360",
+        "applicant_credit_score_type": 1,
+        "co_applicant_credit_score_type": 10,
+        "denial_reason_1": 10,
+        "loan_to_value_ratio": "80",
+        "income": "90",
+        "debt_to_income_ratio": "36",
+        "derived_loan_product_type": "Conventional:First Lien",
+    })
+
+def test_saved_moments_round_trip(tmp_path):
+    path = stats_path(tmp_path, "kaggle_accepted")
+    save_moments({"loan_amnt": (15000.0, 8000.0)}, path)
+
+    assert load_reusable_moments(["loan_amnt"], path) == {"loan_amnt": (15000.0, 8000.0)}
+    assert load_reusable_moments(["loan_amnt", "dti"], path) is None
+    assert load_reusable_moments(["loan_amnt"], stats_path(tmp_path, "kaggle_rejected")) is None
+
+def test_one_row_delta_survives_with_saved_moments(tmp_path):
+    full = pd.DataFrame({"loan_amnt": [5000.0, 10000.0, 15000.0, 20000.0, 25000.0]})
+    path = stats_path(tmp_path, "kaggle_accepted")
+    save_moments({"loan_amnt": column_moments(full["loan_amnt"])}, path)
+
+    delta = pd.DataFrame({"loan_amnt": [12000.0]})
+    #the moments of the delta alone have a NaN std, which drops the row
+    assert len(filter_outliers(delta, "loan_amnt")) == 0
+
+    mean, std = load_reusable_moments(["loan_amnt"], path)["loan_amnt"]
+    assert len(filter_outliers(delta, "loan_amnt", mean=mean, std=std)) == 1
+
+def test_one_row_hdma_delta_survives_clean_data(tmp_path):
+    pytest.importorskip("kaggle")
+    from ETL.ingestion.data_ingestion_hdma import clean_data
+
+    path = stats_path(tmp_path, "hdma_accepted")
+    #the full load saves its imputation and outlier statistics
+    full = clean_data(hdma_rows([100000, 150000, 200000, 250000, 300000]), False, 1, path, False, "staging_accepted_hdma")
+    assert len(full) == 5
+
+    delta = clean_data(hdma_rows([180000]), False, 1, path, True, "staging_accepted_hdma")
+    assert len(delta) == 1
@@ -0,0 +1,101 @@
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+#Ordered keyword -> category table for the Kaggle 'Loan Title' column, the first category with a matching keyword wins
+#Same rules and order as word_map in data_ingestion_kaggle.py
+DEFAULT_TITLE_CATEGORIES = {
+    "debt_consolidation": ["debt", "consol"],
+    "credit_card": ["cc", "credit card"],
+    "home_improvement": ["construction", "remodeling", "drywall"],
+    "major_purchase": ["major purchase", "big buy"],
+    "medical": ["medical", "hospital", "health", "medical bill"],
+}
+
+#Category given to titles that match no keyword (and to missing titles)
+DEFAULT_CATEGORY = "other"
+
+#Json file with the same layout as DEFAULT_TITLE_CATEGORIES, edit it to add keywords/categories without touching code
+TITLE_CATEGORIES_PATH = Path(__file__).with_name("loan_title_categories.json")
+
+def load_title_categories(path = TITLE_CATEGORIES_PATH):
+    """
+    Returns the keyword -> category table from a json file, falls back to DEFAULT_TITLE_CATEGORIES if the file does not exist
+
+    Params:
+        path : Path to a json file of {"category": ["keyword", ...], ...}, order of the categories is the match priority
+    """
+    if path is None or not Path(path).exists():
+        return DEFAULT_TITLE_CATEGORIES
+
+    with open(path, "r") as f:
+        table = json.load(f)
+
+    for category, keywords in table.items():
+        if not isinstance(keywords, list) or not all(isinstance(word, str) for word in keywords):
+            raise ValueError(f"[title_classifier] keywords for {category} in {path} must be a list of strings")
+    return table
+
+def classify_title(text, table = DEFAULT_TITLE_CATEGORIES):
+    """
+    Classifies a single normalized title with the keyword table (same result as word_map for the default table)
+    """
+    if pd.isna(text): text = ''
+
+    for category, keywords in table.items():
+        if any(word in text for word in keywords):
+            return category
+    return DEFAULT_CATEGORY
+
+def normalize_titles(titles = pd.Series(dtype="string")):
+    """
+    Lower cases titles, replaces anything that is not a letter with a space and collapses repeated whitespace
+    """
+    return (
+        titles.astype('string').str.lower().str.strip()
+        .str.replace(r'[^a-z\s]', ' ', regex = True)
+        .str.replace(r'\s+', ' ', regex = True)
+    )
+
+def title_categories(table = DEFAULT_TITLE_CATEGORIES):
+    """
+    Returns the list of categories a classified title column can take, in table order with DEFAULT_CATEGORY last
+    """
+    return [category for category in table if category != DEFAULT_CATEGORY] + [DEFAULT_CATEGORY]
+
+def classify_titles(titles = pd.Series(dtype="string"), table = None, memo = None):
+    """
+    Vectorized version of titles.apply(word_map)
+
+    Every distinct normalized title is classified only once and the result is broadcast back as a categorical column
+
+    Params:
+        titles : Series of normalized titles (see normalize_titles)
+        table : keyword -> category table, load_title_categories() is used if None
+        memo : optional dict of title -> category, reused across calls (ex: for each chunk of a file) so titles are never classified twice
+
+    Returns:
+        Categorical Series with the same index as titles
+    """
+    if table is None:
+        table = load_title_categories()
+    if memo is None:
+        memo = {}
+
+    categories = title_categories(table)
+    category_codes = {category: code for code, category in enumerate(categories)}
+
+    #codes[i] points into uniques, missing titles get -1
+    codes, uniques = pd.factorize(titles, use_na_sentinel=True)
+
+    unique_codes = np.empty(len(uniques) + 1, dtype=np.int16)
+    for i, title in enumerate(uniques):
+        if title not in memo:
+            memo[title] = classify_title(title, table)
+        unique_codes[i] = category_codes[memo[title]]
+    #last slot is used for the -1 (missing) sentinel
+    unique_codes[-1] = category_codes[classify_title('', table)]
+
+    classified = pd.Categorical.from_codes(unique_codes[codes], categories=categories)
+    return pd.Series(classified, index=titles.index, name=titles.name)
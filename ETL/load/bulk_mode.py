@@ -0,0 +1,135 @@
+#bulk load mode: UNLOGGED staging tables, secondary indexes dropped while the core tables are filled and rebuilt in parallel afterwards
+#python -m ETL.load.bulk_mode --rebuild (rebuilds the indexes of database/indexing.sql and runs ANALYZE)
+
+import os
+import re
+import time
+import argparse
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from ETL.db import get_engine
+
+DATABASE_DIR = Path(__file__).resolve().parents[2] / "database"
+INDEXING_SQL = DATABASE_DIR / "indexing.sql"
+STAGING_SQL = DATABASE_DIR / "staging.sql"
+
+CORE_TABLES = ["borrowers", "accepted_loans", "rejected"]
+
+# connections building indexes at the same time (CRA_INDEX_WORKERS environment variable)
+INDEX_WORKERS = int(os.environ.get("CRA_INDEX_WORKERS", 4))
+
+# memory each index build may use for sorting (CRA_MAINTENANCE_WORK_MEM environment variable)
+MAINTENANCE_WORK_MEM = os.environ.get("CRA_MAINTENANCE_WORK_MEM", "256MB")
+
+INDEX_RE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s+ON\s+(\w+)[^;]*;", re.IGNORECASE)
+TABLE_RE = re.compile(r"CREATE\s+(?:UNLOGGED\s+)?TABLE\s+(\w+)", re.IGNORECASE)
+
+#helpers -----------
+def strip_comments(sql: str) -> str:
+    return re.sub(r"--[^\n]*", "", sql)
+
+def secondary_indexes(path: Path = INDEXING_SQL) -> List[Dict[str, str]]:
+    # name, table and CREATE statement of every index declared in indexing.sql
+    with open(path, "r") as f:
+        sql = strip_comments(f.read())
+    return [
+        {"name": match.group(1), "table": match.group(2).lower(), "sql": match.group(0)}
+        for match in INDEX_RE.finditer(sql)
+    ]
+
+def staging_tables(path: Path = STAGING_SQL) -> List[str]:
+    with open(path, "r") as f:
+        return [name.lower() for name in TABLE_RE.findall(strip_comments(f.read()))]
+
+def set_staging_unlogged(engine: Engine, unlogged: bool = True) -> None:
+    # staging rows are thrown away after each run, so they do not need to be written to the WAL
+    mode = "UNLOGGED" if unlogged else "LOGGED"
+    with engine.begin() as conn:
+        for table in staging_tables():
+            conn.execute(text(f"ALTER TABLE IF EXISTS {table} SET {mode}"))
+    print(f"[bulk_mode] staging tables set {mode}")
+
+def drop_secondary_indexes(engine: Engine) -> List[str]:
+    names = [index["name"] for index in secondary_indexes()]
+    with engine.begin() as conn:
+        for name in names:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    print(f"[bulk_mode] dropped {len(names)} secondary indexes")
+    return names
+
+def build_index(engine: Engine, index: Dict[str, str]) -> float:
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text(f"SET LOCAL maintenance_work_mem = '{MAINTENANCE_WORK_MEM}'"))
+        conn.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+        conn.execute(text(index["sql"]))
+    return time.perf_counter() - start
+
+def rebuild_indexes(engine: Engine, workers: int = INDEX_WORKERS, tables: Optional[List[str]] = None) -> Dict[str, float]:
+    """
+    Builds the indexes of indexing.sql, workers indexes at a time (each one on its own connection), then runs ANALYZE
+
+    Params:
+        tables (None as default) : only the indexes of these tables (lower case), every core table when None
+
+    Returns:
+        dict of index name -> seconds
+    """
+    tables = tables or CORE_TABLES
+    indexes = [index for index in secondary_indexes() if index["table"] in tables]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        seconds = dict(zip([index["name"] for index in indexes], pool.map(lambda index: build_index(engine, index), indexes)))
+    print(f"[bulk_mode] built {len(indexes)} indexes of {', '.join(tables)} with {workers} connections in {time.perf_counter() - start:.2f}s")
+
+    analyze_tables(engine, tables)
+    return seconds
+
+def analyze_tables(engine: Engine, tables: Optional[List[str]] = None) -> None:
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for table in tables or CORE_TABLES:
+            conn.execute(text(f"ANALYZE {table}"))
+    print(f"[bulk_mode] ANALYZE done in {time.perf_counter() - start:.2f}s")
+
+def table_loaded(state: Dict, table: str) -> None:
+    # builds the indexes of a table that later mappings read from (Borrowers is joined by the loan mappings), the rest wait for the end of bulk_load
+    if table in state["pending"]:
+        rebuild_indexes(state["engine"], state["workers"], [table])
+        state["pending"].discard(table)
+
+@contextmanager
+def bulk_load(engine: Engine, workers: int = INDEX_WORKERS):
+    """
+    Context manager for filling the core tables: secondary indexes are dropped on enter and rebuilt in parallel (plus ANALYZE) on exit,
+    the indexes are rebuilt even if the load fails so the database is never left without them
+
+    Yields:
+        state dict to pass to table_loaded once a table is filled
+    """
+    drop_secondary_indexes(engine)
+    state = {"engine": engine, "workers": workers, "pending": set(CORE_TABLES)}
+    try:
+        yield state
+    finally:
+        if state["pending"]:
+            rebuild_indexes(engine, workers, [table for table in CORE_TABLES if table in state["pending"]])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the secondary indexes of database/indexing.sql in parallel")
+    parser.add_argument("--rebuild", action="store_true", help="drop and rebuild the indexes, then ANALYZE")
+    parser.add_argument("--workers", type=int, default=INDEX_WORKERS)
+    args = parser.parse_args()
+
+    engine = get_engine()
+    if args.rebuild:
+        rebuild_indexes(engine, args.workers)
+    else:
+        for index in secondary_indexes():
+            print(f"{index['table']:<16} {index['name']}")
@@ -1,13 +1,37 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from sqlalchemy import text
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection, Engine
+
+from ETL.load.mapping.fingerprint import KAGGLE_BORROWER_COLUMNS, HDMA_BORROWER_COLUMNS, fingerprint_sql
+
+# parallel insert batches of the HDMA accepted loans (CRA_HDMA_BATCHES environment variable)
+HDMA_BATCHES = int(os.environ.get("CRA_HDMA_BATCHES", 4))
+
+# UNLOGGED table the batches fill before the rows are moved into accepted_loans_hdma in one statement
+HDMA_SCRATCH = "accepted_loans_hdma_scratch"
+
+# columns updated when a Kaggle row changed, every column but the keys (loan_id, dataset_source) and created_at
+KAGGLE_UPDATE_COLUMNS = [
+    "borrower_id", "loan_amnt", "funded_amnt", "term_months", "int_rate", "installment", "income", "dti",
+    "loan_status", "purpose", "application_type", "activity_year", "action_taken", "preapproval",
+    "loan_to_value_ratio", "total_loan_costs", "derived_loan_product_type", "loan_purpose",
+]
 
-def map_accepted_loans_from_kaggle(engine: Engine) -> None:
-    # skips any rows whose loan_id is already present in Accepted_Loans 
-    #ON CONFLICT (loan_id) DO NOTHING makes it safe to rerun --> existing rows are skipped, duplicates ignored
+def map_accepted_loans_from_kaggle(conn: Connection) -> None:
+    # rows whose loan_id is already present in Accepted_Loans are updated with the staged values, the ones that did not change are skipped
+    #ON CONFLICT (loan_id) DO UPDATE makes it safe to rerun and lets incremental loads restage rows that changed in the source
+    #(see ETL/transformation/incremental_loader.py), created_at keeps the time the loan was first loaded
+    #rows go straight into the kaggle partition, its primary key is what ON CONFLICT checks
+    #an id staged twice keeps its last row, ON CONFLICT DO UPDATE cannot change the same row twice in one statement
+    current = ", ".join(f"accepted_loans_kaggle.{column}" for column in KAGGLE_UPDATE_COLUMNS)
+    staged = ", ".join(f"EXCLUDED.{column}" for column in KAGGLE_UPDATE_COLUMNS)
     sql = text(
-        """
-        INSERT INTO Accepted_Loans (
+        f"""
+        INSERT INTO accepted_loans_kaggle (
             loan_id,
+            dataset_source,
             borrower_id,
             loan_amnt,
             funded_amnt,
@@ -27,8 +51,9 @@ def map_accepted_loans_from_kaggle(engine: Engine) -> None:
             derived_loan_product_type,
             loan_purpose
         )
-        SELECT
+        SELECT DISTINCT ON (sa.id)
             sa.id AS loan_id,
+            'kaggle'                                     AS dataset_source,
             b.borrower_id,
             sa.loan_amnt,
             sa.funded_amnt,
@@ -52,66 +77,57 @@ def map_accepted_loans_from_kaggle(engine: Engine) -> None:
             NULL::TEXT                                   AS loan_purpose
         FROM valid_accepted_kaggle sa
         JOIN Borrowers b
-          ON b.annual_inc            = sa.annual_inc
-         AND b.dti                   = sa.dti
-         AND b.delinq_2yrs           = sa.delinq_2yrs
-         AND b.fico_range_low        = sa.fico_range_low
-         AND b.fico_range_high       = sa.fico_range_high
-         AND b.inq_last_6mths        = sa.inq_last_6mths
-         AND b.open_acc              = sa.open_acc
-         AND b.total_acc             = sa.total_acc
-         AND b.revol_bal             = sa.revol_bal
-         AND b.revol_util            = sa.revol_util
-         AND b.pub_rec_bankruptcies  = sa.pub_rec_bankruptcies
-         AND b.home_ownership        = sa.home_ownership
-         AND b.verification_status   = sa.verification_status
-        ON CONFLICT (loan_id) DO NOTHING;
+          ON b.fingerprint = {fingerprint_sql("sa", KAGGLE_BORROWER_COLUMNS, "kaggle")}
+        ORDER BY sa.id, sa.staging_row_id DESC
+        ON CONFLICT (loan_id) DO UPDATE SET
+            ({", ".join(KAGGLE_UPDATE_COLUMNS)}) = ({staged})
+        WHERE ({current}) IS DISTINCT FROM ({staged});
         """
     )
 
-    with engine.begin() as conn:
-        conn.execute(sql)
+    conn.execute(sql)
 
-def map_accepted_loans_from_hdma(engine: Engine) -> None:
+def map_accepted_loans_from_hdma(conn: Connection, batches: int = HDMA_BATCHES) -> None:
     """
         loan_amount      -> loan_amnt
         loan_term        -> term_months
         interest_rate    -> int_rate
+
+    loan_id comes from hdma_loan_id_seq, so the rows are split in batches (staging_row_id % batches) computed in parallel, one connection each,
+    into an UNLOGGED scratch table (HDMA_SCRATCH) made for the run
+
+    one INSERT ... SELECT on conn then moves the scratch rows (joined with Borrowers) into the hdma partition, which routes them to their
+    activity_year partition (see ETL/load/partitions.py), so the loans are committed with the rest of the transaction of conn or not at all
+    (the rows have no natural key, a rerun after a partial commit would insert the committed rows twice)
     """
+    batches = max(1, batches)
+    engine = conn.engine
 
-    sql = text(
-        """
-        WITH cleaned_hdma AS (
-            SELECT
-                sh.*,
-                NULLIF(REGEXP_REPLACE(sh.debt_to_income_ratio, '[^0-9\\.]', '', 'g'),'')::NUMERIC(6,2) AS dti_clean,
-                NULLIF(REGEXP_REPLACE(CAST(sh.loan_amount AS TEXT), '[^0-9\\.]', '', 'g'),'')::NUMERIC(12,2) AS loan_amnt_clean
-            FROM valid_accepted_hdma sh
-        ),
-        hdma_with_borrower AS (
-            SELECT
-                ch.*,
-                b.borrower_id
-            FROM cleaned_hdma ch
-            JOIN Borrowers b
-              ON b.income                       = ch.income
-             AND b.debt_to_income_ratio         = ch.dti_clean
-             AND b.applicant_credit_score_type  = ch.applicant_credit_score_type
-             AND b.co_applicant_credit_score_type = ch.co_applicant_credit_score_type
-        ),
-        numbered AS (
-            SELECT
-                hw.*,
-                (
-                    SELECT COALESCE(MAX(al.loan_id), 0)
-                    FROM Accepted_Loans al
-                ) + ROW_NUMBER() OVER (
-                    ORDER BY hw.activity_year, hw.loan_amnt_clean, hw.income
-                ) AS new_loan_id
-            FROM hdma_with_borrower hw
-        )
-        INSERT INTO Accepted_Loans (
+    # loan columns of every valid HDMA row, borrower_id is looked up by fingerprint when the rows are moved
+    select_sql = f"""
+        SELECT
+            nextval('hdma_loan_id_seq') AS loan_id,
+            {fingerprint_sql("sh", HDMA_BORROWER_COLUMNS, "hdma")} AS fingerprint,
+            NULLIF(REGEXP_REPLACE(CAST(sh.loan_amount AS TEXT), '[^0-9\\.]', '', 'g'),'')::NUMERIC(12,2) AS loan_amnt,
+            sh.loan_term                AS term_months,
+            sh.interest_rate            AS int_rate,
+            sh.income                   AS income,
+            sh.debt_to_income_ratio     AS dti,
+            sh.activity_year,
+            sh.action_taken,
+            sh.preapproval,
+            sh.loan_to_value_ratio,
+            sh.total_loan_costs,
+            sh.derived_loan_product_type,
+            sh.loan_purpose
+        FROM valid_accepted_hdma sh
+    """
+
+    move_sql = text(
+        f"""
+        INSERT INTO accepted_loans_hdma (
             loan_id,
+            dataset_source,
             borrower_id,
             loan_amnt,
             funded_amnt,
@@ -132,32 +148,73 @@ def map_accepted_loans_from_hdma(engine: Engine) -> None:
             loan_purpose
         )
         SELECT
-            n.new_loan_id               AS loan_id,
-            n.borrower_id,
-            n.loan_amnt_clean           AS loan_amnt,
+            s.loan_id,
+            'hdma'                      AS dataset_source,
+            b.borrower_id,
+            s.loan_amnt,
             NULL::NUMERIC(12,2)         AS funded_amnt,
-            n.loan_term                 AS term_months,
-            n.interest_rate             AS int_rate,
+            s.term_months,
+            s.int_rate,
             NULL::NUMERIC(12,2)         AS installment,
-            n.income                    AS income,
-            n.dti_clean                 AS dti,
+            s.income,
+            s.dti,
             NULL::VARCHAR(40)           AS loan_status,
             NULL::VARCHAR(50)           AS purpose,
             NULL::VARCHAR(30)           AS application_type,
-            n.activity_year,
-            n.action_taken,
-            n.preapproval,
-            n.loan_to_value_ratio,
-            n.total_loan_costs,
-            n.derived_loan_product_type,
-            n.loan_purpose
-        FROM numbered n;
+            s.activity_year,
+            s.action_taken,
+            s.preapproval,
+            s.loan_to_value_ratio,
+            s.total_loan_costs,
+            s.derived_loan_product_type,
+            s.loan_purpose
+        FROM {HDMA_SCRATCH} s
+        JOIN Borrowers b
+          ON b.fingerprint = s.fingerprint;
         """
     )
 
-    with engine.begin() as conn:
-        conn.execute(sql)
+    # the scratch table is committed on its own connection so the batches can fill it, one left by a failed run is replaced
+    with engine.begin() as scratch_conn:
+        scratch_conn.execute(text(f"DROP TABLE IF EXISTS {HDMA_SCRATCH}"))
+        scratch_conn.execute(text(f"CREATE UNLOGGED TABLE {HDMA_SCRATCH} AS {select_sql} WITH NO DATA"))
+
+    try:
+        fill_hdma_scratch(engine, f"INSERT INTO {HDMA_SCRATCH} {select_sql} WHERE sh.staging_row_id % :batches = :batch", batches)
+        # a failed move rolls back to the savepoint, which releases the locks conn took on the scratch table so it can be dropped below
+        with conn.begin_nested():
+            conn.execute(move_sql)
+            conn.execute(text(f"DROP TABLE {HDMA_SCRATCH}"))
+    except Exception:
+        # nothing reached accepted_loans_hdma, only the scratch rows are thrown away
+        with engine.begin() as scratch_conn:
+            scratch_conn.execute(text(f"DROP TABLE IF EXISTS {HDMA_SCRATCH}"))
+        raise
+
+def fill_hdma_scratch(engine: Engine, sql: str, batches: int) -> None:
+    # runs the batches in parallel, one connection each, a failed batch cancels the others before the error goes up
+    conns = [engine.connect() for _ in range(batches)]
+    try:
+        with ThreadPoolExecutor(max_workers=batches) as pool:
+            futures = [pool.submit(run_batch, conn, sql, {"batches": batches, "batch": batch}) for batch, conn in enumerate(conns)]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                # stops the batches still running, the pool waits for them before the error goes up
+                for future in futures:
+                    future.cancel()
+                for conn in conns:
+                    conn.connection.dbapi_connection.cancel()
+                raise
+    finally:
+        for conn in conns:
+            conn.close()
+
+def run_batch(conn: Connection, sql: str, params: dict) -> None:
+    with conn.begin():
+        conn.execute(text(sql), params)
 
-def map_all_accepted_loans(engine: Engine) -> None:
-    map_accepted_loans_from_kaggle(engine)
-    map_accepted_loans_from_hdma(engine)
+def map_all_accepted_loans(conn: Connection) -> None:
+    map_accepted_loans_from_kaggle(conn)
+    map_accepted_loans_from_hdma(conn)
@@ -1,63 +1,42 @@
 from sqlalchemy import text
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection
 
-def map_borrowers_from_kaggle_accepted(engine: Engine) -> None:
-    sql = text("""
+from ETL.load.mapping.fingerprint import KAGGLE_BORROWER_COLUMNS, HDMA_BORROWER_COLUMNS, fingerprint_sql
+
+def map_borrowers_from_kaggle_accepted(conn: Connection) -> None:
+    # one borrower per fingerprint, ON CONFLICT skips the borrowers already stored (safe to rerun)
+    columns = ",\n            ".join(KAGGLE_BORROWER_COLUMNS)
+    sql = text(f"""
         INSERT INTO Borrowers (
-            annual_inc,
-            dti,
-            delinq_2yrs,
-            fico_range_low,
-            fico_range_high,
-            inq_last_6mths,
-            open_acc,
-            total_acc,
-            revol_bal,
-            revol_util,
-            pub_rec_bankruptcies,
-            home_ownership,
-            verification_status
+            fingerprint,
+            {columns}
         )
         SELECT DISTINCT
-            sa.annual_inc,
-            sa.dti,
-            sa.delinq_2yrs,
-            sa.fico_range_low,
-            sa.fico_range_high,
-            sa.inq_last_6mths,
-            sa.open_acc,
-            sa.total_acc,
-            sa.revol_bal,
-            sa.revol_util,
-            sa.pub_rec_bankruptcies,
-            sa.home_ownership,
-            sa.verification_status
+            {fingerprint_sql("sa", KAGGLE_BORROWER_COLUMNS, "kaggle")},
+            {", ".join(f"sa.{column}" for column in KAGGLE_BORROWER_COLUMNS)}
         FROM valid_accepted_kaggle sa
+        ON CONFLICT (fingerprint) DO NOTHING
     """)
 
-    with engine.begin() as conn:
-        conn.execute(sql)
+    conn.execute(sql)
 
-def map_borrowers_from_hdma_accepted(engine: Engine) -> None:
-    # debt_to_income_ratio staging is TEXT --> strip non-numeric chars and cast to numeric
-    sql = text("""
+def map_borrowers_from_hdma_accepted(conn: Connection) -> None:
+    # debt_to_income_ratio is decoded to NUMERIC during ingestion (see hmda_decoder.py)
+    columns = ",\n            ".join(HDMA_BORROWER_COLUMNS)
+    sql = text(f"""
         INSERT INTO Borrowers (
-            income,
-            debt_to_income_ratio,
-            applicant_credit_score_type,
-            co_applicant_credit_score_type
+            fingerprint,
+            {columns}
         )
         SELECT DISTINCT
-            sh.income,
-            NULLIF(REGEXP_REPLACE(sh.debt_to_income_ratio, '[^0-9\\.]', '', 'g'),'')::NUMERIC,
-            sh.applicant_credit_score_type,
-            sh.co_applicant_credit_score_type
-        FROM valid_accepted_hdma sh;
+            {fingerprint_sql("sh", HDMA_BORROWER_COLUMNS, "hdma")},
+            {", ".join(f"sh.{column}" for column in HDMA_BORROWER_COLUMNS)}
+        FROM valid_accepted_hdma sh
+        ON CONFLICT (fingerprint) DO NOTHING;
     """)
 
-    with engine.begin() as conn:
-        conn.execute(sql)
+    conn.execute(sql)
 
-def map_all_borrowers(engine: Engine) -> None:
-    map_borrowers_from_kaggle_accepted(engine)
-    map_borrowers_from_hdma_accepted(engine)
\ No newline at end of file
+def map_all_borrowers(conn: Connection) -> None:
+    map_borrowers_from_kaggle_accepted(conn)
+    map_borrowers_from_hdma_accepted(conn)
@@ -0,0 +1,51 @@
+from typing import List
+
+from ETL.ingestion.dtype_plan import table_schema
+
+# borrower features of each source, a borrower is one distinct tuple of these columns
+KAGGLE_BORROWER_COLUMNS = [
+    "annual_inc",
+    "dti",
+    "delinq_2yrs",
+    "fico_range_low",
+    "fico_range_high",
+    "inq_last_6mths",
+    "open_acc",
+    "total_acc",
+    "revol_bal",
+    "revol_util",
+    "pub_rec_bankruptcies",
+    "home_ownership",
+    "verification_status",
+]
+HDMA_BORROWER_COLUMNS = [
+    "income",
+    "debt_to_income_ratio",
+    "applicant_credit_score_type",
+    "co_applicant_credit_score_type",
+]
+
+# stands for NULL inside the hashed tuple, so two borrowers with the same missing feature get the same fingerprint
+NULL_TOKEN = "<null>"
+
+def column_sql_type(column: str) -> str:
+    # type of the Borrowers column, values are cast to it first so 10.5 and 10.50 hash the same
+    column_type = table_schema("borrowers")[column]
+    if column_type["precision"] is not None and column_type["scale"] is not None:
+        return f"{column_type['type']}({column_type['precision']}, {column_type['scale']})"
+    return column_type["type"]
+
+def fingerprint_sql(alias: str, columns: List[str], source: str) -> str:
+    """
+    SQL expression of the borrower fingerprint: md5 of the source name and the normalized feature tuple, as a UUID
+
+    Params:
+        alias : table alias the columns are read from
+        columns : KAGGLE_BORROWER_COLUMNS or HDMA_BORROWER_COLUMNS
+        source : 'kaggle' or 'hdma', part of the hash so tuples of different sources never collide
+    """
+    parts = [f"'{source}'"] + [
+        f"COALESCE({alias}.{column}::{column_sql_type(column)}::TEXT, '{NULL_TOKEN}')"
+        for column in columns
+    ]
+    return f"md5(concat_ws('|', {', '.join(parts)}))::UUID"
@@ -1,9 +1,9 @@
 from sqlalchemy import text
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection
 
-def map_rejected_from_kaggle(engine: Engine) -> None:
+def map_rejected_from_kaggle(conn: Connection) -> None:
     """
-    - dataset_source is set to 'kaggle'.
+    - dataset_source is set to 'kaggle', rows go straight into the kaggle partition (yearly partitions by application_date).
     - amount_requested     <- "Amount Requested"
     - application_date     <- "Application Date"::DATE (Postgres cast)
     - loan_title           <- "Loan Title"
@@ -21,7 +21,7 @@ def map_rejected_from_kaggle(engine: Engine) -> None:
                 ) AS dti_str
             FROM valid_rejected_kaggle sr
         )
-        INSERT INTO Rejected (
+        INSERT INTO rejected_kaggle (
             dataset_source,
             amount_requested,
             application_date,
@@ -67,18 +67,17 @@ def map_rejected_from_kaggle(engine: Engine) -> None:
         """
     )
 
-    with engine.begin() as conn:
-        conn.execute(sql)
+    conn.execute(sql)
 
-def map_rejected_from_hdma(engine: Engine) -> None:
+def map_rejected_from_hdma(conn: Connection) -> None:
     """
-    - dataset_source is set to 'hdma'.
-    - dti comes from cleaned debt_to_income_ratio TEXT.
+    - dataset_source is set to 'hdma', rows go straight into the hdma partition (yearly partitions by activity_year).
+    - dti comes from debt_to_income_ratio, already NUMERIC in staging.
     """
 
     sql = text(
         """
-        INSERT INTO Rejected (
+        INSERT INTO rejected_hdma (
             dataset_source,
             amount_requested,
             application_date,
@@ -102,7 +101,7 @@ def map_rejected_from_hdma(engine: Engine) -> None:
             NULL::NUMERIC(12,2)                 AS amount_requested,
             NULL::DATE                          AS application_date,
             NULL::TEXT                          AS loan_title,
-            NULLIF(REGEXP_REPLACE(srh.debt_to_income_ratio, '[^0-9\\.]', '', 'g'),'')::NUMERIC(6,2) AS dti,
+            srh.debt_to_income_ratio          AS dti,
             srh.activity_year,
             srh.action_taken,
             srh.preapproval,
@@ -119,9 +118,8 @@ def map_rejected_from_hdma(engine: Engine) -> None:
         """
     )
 
-    with engine.begin() as conn:
-        conn.execute(sql)
+    conn.execute(sql)
 
-def map_all_rejected_loans(engine: Engine) -> None:
-    map_rejected_from_kaggle(engine)
-    map_rejected_from_hdma(engine)
\ No newline at end of file
+def map_all_rejected_loans(conn: Connection) -> None:
+    map_rejected_from_kaggle(conn)
+    map_rejected_from_hdma(conn)
\ No newline at end of file
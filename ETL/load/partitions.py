@@ -0,0 +1,127 @@
+#partitions of Accepted_Loans and Rejected (database/database.sql): list by dataset_source, then range by year
+#the yearly partitions are created from the years found in the valid_* views right before the mappings run
+#python -m ETL.load.partitions --list | --ensure | --detach <partition> (retires an old extract without a DELETE)
+
+import time
+import argparse
+from typing import Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from ETL.db import get_engine
+
+# source partition -> how its yearly partitions are built
+#   key : primary key of every leaf partition
+#   bounds : "year" for activity_year partitions, "date" for application_date ones (first day of each year)
+#   view / year_sql : valid_* view the partition is loaded from and the year of each of its rows
+YEARLY_PARTITIONS = {
+    "accepted_loans_hdma": {"key": "loan_id", "bounds": "year", "view": "valid_accepted_hdma", "year_sql": "activity_year"},
+    "rejected_kaggle": {"key": "application_id", "bounds": "date", "view": "valid_rejected_kaggle", "year_sql": 'EXTRACT(YEAR FROM "Application Date"::DATE)'},
+    "rejected_hdma": {"key": "application_id", "bounds": "year", "view": "valid_rejected_hdma", "year_sql": "activity_year"},
+}
+
+#helpers -----------
+def partition_name(parent: str, year: int) -> str:
+    return f"{parent}_{year}"
+
+def partition_bounds(bounds: str, year: int) -> str:
+    if bounds == "date":
+        return f"FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+    return f"FROM ({year}) TO ({year + 1})"
+
+def source_years(conn, parent: str) -> List[int]:
+    spec = YEARLY_PARTITIONS[parent]
+    rows = conn.execute(text(f"SELECT DISTINCT ({spec['year_sql']})::INTEGER FROM {spec['view']} WHERE ({spec['year_sql']}) IS NOT NULL"))
+    return sorted(row[0] for row in rows)
+
+def existing_partitions(conn, parent: str) -> List[str]:
+    rows = conn.execute(
+        text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = CAST(:parent AS regclass)"),
+        {"parent": parent},
+    )
+    return [row[0] for row in rows]
+
+# partitions -----------
+def create_partition(conn, parent: str, year: int) -> str:
+    # yearly partition of a source partition (a YEARLY_PARTITIONS key), with the primary key every leaf needs
+    spec = YEARLY_PARTITIONS[parent]
+    name = partition_name(parent, year)
+    conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF {parent} (PRIMARY KEY ({spec['key']})) "
+        f"FOR VALUES {partition_bounds(spec['bounds'], year)}"
+    ))
+    return name
+
+def ensure_partitions(engine: Engine) -> List[str]:
+    """
+    Creates the yearly partition of every year in the valid_* views that does not have one yet, so the rows of a new extract
+    land in their own partition instead of the DEFAULT one (a partition can not be added for a year the DEFAULT partition already holds)
+
+    Returns:
+        names of the partitions created
+    """
+    created = []
+    with engine.begin() as conn:
+        for parent in YEARLY_PARTITIONS:
+            existing = set(existing_partitions(conn, parent))
+            for year in source_years(conn, parent):
+                if partition_name(parent, year) not in existing:
+                    created.append(create_partition(conn, parent, year))
+    if created:
+        print(f"[partitions] created {', '.join(created)}")
+    return created
+
+def list_partitions(engine: Engine) -> List[Dict]:
+    # every partition of the core tables with its bounds and row estimate (reltuples, None until the partition is analyzed)
+    parents = ", ".join(f"'{name}'" for name in ["accepted_loans", "rejected", *YEARLY_PARTITIONS])
+    sql = text(
+        f"""
+        SELECT parent.relname AS parent, child.relname AS partition,
+               pg_get_expr(child.relpartbound, child.oid) AS bounds, NULLIF(child.reltuples, -1)::BIGINT AS rows
+        FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname IN ({parents})
+        ORDER BY parent.relname, child.relname
+        """
+    )
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.execute(sql).mappings()]
+
+def detach_partition(engine: Engine, name: str) -> str:
+    """
+    Retires a partition (ex: rejected_kaggle_2007): it is detached from its parent and renamed, queries on the core tables stop seeing
+    its rows right away and the table is kept until it is archived or dropped by hand
+
+    Returns:
+        new name of the detached table
+    """
+    retired = f"{name}_retired_{time.strftime('%Y%m%d')}"
+    with engine.begin() as conn:
+        parent = conn.execute(
+            text("SELECT i.inhparent::regclass::TEXT FROM pg_inherits i WHERE i.inhrelid = CAST(:name AS regclass)"),
+            {"name": name},
+        ).scalar()
+        if parent is None:
+            raise ValueError(f"{name} is not a partition")
+        conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {name}"))
+        conn.execute(text(f"ALTER TABLE {name} RENAME TO {retired}"))
+    print(f"[partitions] detached {name} from {parent} as {retired}")
+    return retired
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partitions of Accepted_Loans and Rejected")
+    parser.add_argument("--ensure", action="store_true", help="create the yearly partitions of the years in the valid_* views")
+    parser.add_argument("--detach", metavar="PARTITION", help="detach a partition (retire an old extract)")
+    parser.add_argument("--list", action="store_true", help="list the partitions (default)")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    if args.ensure:
+        ensure_partitions(engine)
+    if args.detach:
+        detach_partition(engine, args.detach)
+    if args.list or not (args.ensure or args.detach):
+        for partition in list_partitions(engine):
+            print(f"{partition['parent']:<20} {partition['partition']:<32} {'-' if partition['rows'] is None else partition['rows']:>10} {partition['bounds']}")
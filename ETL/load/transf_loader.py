@@ -1,28 +1,61 @@
 #python -m ETL.load.transf_loader
 
-from sqlalchemy import create_engine
+from ETL.db import get_engine
 from sqlalchemy.engine import Engine
+from typing import Dict
 
 from ETL.load.mapping.borrowers_map import map_all_borrowers
 from ETL.load.mapping.accepted_loans_map import map_all_accepted_loans
 from ETL.load.mapping.rejected_map import map_all_rejected_loans
+from ETL.load.bulk_mode import bulk_load, table_loaded
+from ETL.load.partitions import ensure_partitions
 
-def run_transf_loader(engine: Engine | None = None) -> None:
+def run_transf_loader(engine: Engine | None = None, bulk: bool = False) -> None:
+    # bulk: secondary indexes are dropped while mapping and rebuilt in parallel (plus ANALYZE) at the end, see bulk_mode.py
     if engine is None:
-        engine = create_engine("postgresql+psycopg2:///credit_risk")
+        engine = get_engine()
 
-    print("=== Mapping into Borrowers ===")
-    map_all_borrowers(engine)
+    if bulk:
+        with bulk_load(engine) as state:
+            map_core_tables(engine, state)
+    else:
+        map_core_tables(engine)
 
-    print("=== Mapping into Accepted_Loans ===")
-    map_all_accepted_loans(engine)
+    print("=== transf_loader SUCCESS!! ===")
 
-    print("=== Mapping into Rejected ===")
-    map_all_rejected_loans(engine)
+def map_core_tables(engine: Engine, bulk_state: Dict | None = None) -> None:
+    # every year in the valid views gets its partition before the loans are mapped
+    ensure_partitions(engine)
 
-    print("=== transf_loader SUCCESS!! ===")
+    if bulk_state is not None:
+        # bulk mode commits each table, its indexes are rebuilt from other connections once it is loaded (see bulk_mode.py)
+        with engine.begin() as conn:
+            print("=== Mapping into Borrowers ===")
+            map_all_borrowers(conn)
+
+        # the loan mappings join on Borrowers, so its indexes and statistics are needed before they run
+        table_loaded(bulk_state, "borrowers")
+
+        with engine.begin() as conn:
+            print("=== Mapping into Accepted_Loans ===")
+            map_all_accepted_loans(conn)
+        with engine.begin() as conn:
+            print("=== Mapping into Rejected ===")
+            map_all_rejected_loans(conn)
+        return
+
+    # one transaction: a failed mapping rolls back the ones before it, so a rerun (or the next incremental load, whose
+    # watermarks did not move) does not insert the loans and rejected rows without a natural key a second time
+    with engine.begin() as conn:
+        print("=== Mapping into Borrowers ===")
+        map_all_borrowers(conn)
+
+        print("=== Mapping into Accepted_Loans ===")
+        map_all_accepted_loans(conn)
 
+        print("=== Mapping into Rejected ===")
+        map_all_rejected_loans(conn)
 
 if __name__ == "__main__":
-    engine = create_engine("postgresql+psycopg2:///credit_risk")
+    engine = get_engine()
     run_transf_loader(engine)
@@ -0,0 +1,228 @@
+#feature store of the ML training view: loan_features keeps every version of the features of a loan, feature_snapshots the versions
+#a refresh compares the view with the current rows in the database and only appends the loans that are new or changed
+#(database/feature_store.sql), the rows of an older snapshot are never rewritten so a model can always be traced to its training rows
+#python -m ETL.ml.feature_store --refresh [--note "..."] | --list | --lookup <loan_id> [<loan_id> ...] [--snapshot N]
+
+import time
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text, bindparam
+from sqlalchemy.engine import Engine
+
+from ETL.db import get_engine
+from ETL.ml.ml_training_acc import VIEW_NM, create_accepted_loans_training_view
+from ETL.ml.features import cache_dir, relation_columns, relation_version, version_key, select_sql, write_parquet, touch_cached
+
+FEATURE_STORE_SQL = Path(__file__).resolve().parents[2] / "database" / "feature_store.sql"
+
+# loan_features columns that are not features of the view
+VERSION_COLUMNS = ["valid_from", "valid_to", "row_hash"]
+
+#store -----------
+def feature_columns(conn) -> List[str]:
+    # columns of the view, in order, as they are stored in loan_features
+    return [name for name, _ in relation_columns(conn, VIEW_NM)]
+
+def ensure_feature_store(engine: Engine) -> None:
+    """
+    Creates the training view and the feature store tables when they are missing, then checks loan_features still has
+    every column of the view with the same type (a changed view needs its columns added to database/feature_store.sql first)
+    """
+    with engine.connect() as conn:
+        has_view = conn.execute(text("SELECT to_regclass(:name)"), {"name": VIEW_NM}).scalar() is not None
+    if not has_view:
+        create_accepted_loans_training_view(engine)
+
+    with engine.begin() as conn:
+        with open(FEATURE_STORE_SQL, "r") as f:
+            conn.execute(text(f.read()))
+        stored = dict(relation_columns(conn, "loan_features"))
+        for name, sql_type in relation_columns(conn, VIEW_NM):
+            if stored.get(name) != sql_type:
+                raise ValueError(f"{VIEW_NM}.{name} ({sql_type}) does not match loan_features ({stored.get(name)}), update database/feature_store.sql")
+
+def latest_snapshot(engine: Engine) -> Optional[int]:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT max(snapshot_id) FROM feature_snapshots")).scalar()
+
+def list_snapshots(engine: Engine) -> List[Dict]:
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.execute(text("SELECT * FROM feature_snapshots ORDER BY snapshot_id")).mappings()]
+
+#refresh -----------
+def refresh_snapshot(engine: Optional[Engine] = None, note: Optional[str] = None) -> int:
+    """
+    Builds a new snapshot from the view: loans that are new or whose features changed get a new row, loans that changed or
+    left the view have their current row closed. Nothing is written when the view has the same rows as the latest snapshot
+
+    Params:
+        note (None as default) : free text kept with the snapshot (ex: the extract it was built from)
+
+    Returns:
+        id of the new snapshot, or of the latest one when nothing changed
+    """
+    engine = engine or get_engine()
+    ensure_feature_store(engine)
+    start = time.perf_counter()
+
+    with engine.begin() as conn:
+        # one refresh at a time, readers of the snapshots are not blocked
+        conn.execute(text("LOCK TABLE feature_snapshots IN SHARE ROW EXCLUSIVE MODE"))
+        latest = conn.execute(text("SELECT snapshot_id, source_key FROM feature_snapshots ORDER BY snapshot_id DESC LIMIT 1")).mappings().first()
+        source_key = version_key(relation_version(conn, VIEW_NM))
+        if latest is not None and latest["source_key"] == source_key:
+            print(f"[feature_store] {VIEW_NM} did not change since snapshot {latest['snapshot_id']}")
+            return latest["snapshot_id"]
+
+        # the features are computed once here, readers get the stored rows
+        conn.execute(text(f"CREATE TEMP TABLE feature_rows ON COMMIT DROP AS SELECT v.*, md5(ROW(v.*)::TEXT)::UUID AS row_hash FROM {VIEW_NM} v"))
+        conn.execute(text("ALTER TABLE feature_rows ADD PRIMARY KEY (loan_id)"))
+        conn.execute(text("ANALYZE feature_rows"))
+
+        loans = conn.execute(text("SELECT count(*) FROM feature_rows")).scalar()
+        appended = conn.execute(text(
+            """
+            SELECT count(*) FROM feature_rows r
+            WHERE NOT EXISTS (SELECT 1 FROM loan_features f WHERE f.loan_id = r.loan_id AND f.valid_to IS NULL AND f.row_hash = r.row_hash)
+            """
+        )).scalar()
+        retired = conn.execute(text(
+            """
+            SELECT count(*) FROM loan_features f
+            WHERE f.valid_to IS NULL
+              AND NOT EXISTS (SELECT 1 FROM feature_rows r WHERE r.loan_id = f.loan_id AND r.row_hash = f.row_hash)
+            """
+        )).scalar()
+        if latest is not None and appended == 0 and retired == 0:
+            print(f"[feature_store] {VIEW_NM} has the same rows as snapshot {latest['snapshot_id']}")
+            return latest["snapshot_id"]
+
+        snapshot_id = conn.execute(
+            text(
+                """
+                INSERT INTO feature_snapshots (source_key, loans, appended, retired, note)
+                VALUES (:source_key, :loans, :appended, :retired, :note)
+                RETURNING snapshot_id
+                """
+            ),
+            {"source_key": source_key, "loans": loans, "appended": appended, "retired": retired, "note": note},
+        ).scalar()
+
+        # closed first, so the changed loans have no current row left when their new version is appended
+        conn.execute(
+            text(
+                """
+                UPDATE loan_features f SET valid_to = :snapshot_id
+                WHERE f.valid_to IS NULL
+                  AND NOT EXISTS (SELECT 1 FROM feature_rows r WHERE r.loan_id = f.loan_id AND r.row_hash = f.row_hash)
+                """
+            ),
+            {"snapshot_id": snapshot_id},
+        )
+        columns = ", ".join(feature_columns(conn) + ["row_hash"])
+        conn.execute(
+            text(
+                f"""
+                INSERT INTO loan_features ({columns}, valid_from)
+                SELECT {columns}, :snapshot_id FROM feature_rows r
+                WHERE NOT EXISTS (SELECT 1 FROM loan_features f WHERE f.loan_id = r.loan_id AND f.valid_to IS NULL)
+                """
+            ),
+            {"snapshot_id": snapshot_id},
+        )
+
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE loan_features"))
+    print(f"[feature_store] snapshot {snapshot_id}: {loans} loans, {appended} appended, {retired} retired ({time.perf_counter() - start:.2f}s)")
+    return snapshot_id
+
+#read -----------
+def snapshot_sql(snapshot_id: int, columns: List[str]) -> str:
+    # rows of one snapshot (snapshot_id is an int, checked by the callers)
+    return select_sql(f"loan_features WHERE valid_from <= {int(snapshot_id)} AND (valid_to IS NULL OR valid_to > {int(snapshot_id)})", columns)
+
+def snapshot_table(
+    snapshot_id: Optional[int] = None,
+    engine: Optional[Engine] = None,
+    columns: Optional[List[str]] = None,
+    directory: Optional[Path] = None,
+) -> pa.Table:
+    """
+    Rows of a snapshot as an Arrow table, exported once to the parquet feature cache (a snapshot never changes)
+
+    Params:
+        snapshot_id (None as default) : snapshot to read, the latest one when None
+        columns (None as default) : columns to return, all the columns of the view when None
+        directory (None as default) : cache folder, see ETL/ml/features.py
+    """
+    engine = engine or get_engine()
+    directory = cache_dir(directory)
+    with engine.connect() as conn:
+        if snapshot_id is None:
+            snapshot_id = conn.execute(text("SELECT max(snapshot_id) FROM feature_snapshots")).scalar()
+        created_at = conn.execute(text("SELECT created_at::TEXT FROM feature_snapshots WHERE snapshot_id = :id"), {"id": snapshot_id}).scalar()
+        if created_at is None:
+            raise ValueError(f"no feature snapshot {snapshot_id}, run python -m ETL.ml.feature_store --refresh first")
+
+        # the creation time is part of the name so a rebuilt store never reuses the files of an older one
+        key = hashlib.sha256(f"{snapshot_id}|{created_at}".encode()).hexdigest()[:16]
+        path = directory / f"feature_snapshot_{snapshot_id}-{key}.parquet"
+        if not path.exists():
+            start = time.perf_counter()
+            stored = [(name, sql_type) for name, sql_type in relation_columns(conn, "loan_features") if name not in VERSION_COLUMNS]
+            rows = write_parquet(conn, snapshot_sql(snapshot_id, [name for name, _ in stored]), stored, path)
+            print(f"[feature_store] exported {rows} rows of snapshot {snapshot_id} to {path.name} in {time.perf_counter() - start:.2f}s")
+    touch_cached(directory, path)
+    return pq.read_table(path, columns=columns)
+
+def load_snapshot(snapshot_id: Optional[int] = None, engine: Optional[Engine] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    return snapshot_table(snapshot_id, engine, columns).to_pandas()
+
+def lookup_features(loan_ids: List[int], snapshot_id: Optional[int] = None, engine: Optional[Engine] = None) -> pd.DataFrame:
+    """
+    Features of a few loans for scoring, read through the loan_id indexes
+
+    Params:
+        loan_ids : loans to look up (loans missing from the snapshot are not returned)
+        snapshot_id (None as default) : snapshot to read, the current rows when None
+    """
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        columns = ", ".join(feature_columns(conn))
+        if snapshot_id is None:
+            sql = f"SELECT {columns} FROM loan_features WHERE loan_id IN :loan_ids AND valid_to IS NULL"
+        else:
+            sql = (
+                f"SELECT {columns} FROM loan_features "
+                f"WHERE loan_id IN :loan_ids AND valid_from <= :snapshot_id AND (valid_to IS NULL OR valid_to > :snapshot_id)"
+            )
+        query = text(sql).bindparams(bindparam("loan_ids", expanding=True))
+        return pd.read_sql(query, conn, params={"loan_ids": [int(loan_id) for loan_id in loan_ids], "snapshot_id": snapshot_id})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Feature store snapshots of the ML training view")
+    parser.add_argument("--refresh", action="store_true", help="append the new and changed loans as a new snapshot")
+    parser.add_argument("--note", help="note kept with the new snapshot")
+    parser.add_argument("--list", action="store_true", help="list the snapshots (default)")
+    parser.add_argument("--lookup", nargs="+", type=int, metavar="LOAN_ID", help="print the features of these loans")
+    parser.add_argument("--snapshot", type=int, help="snapshot used by --lookup, the current rows when not given")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    if args.refresh:
+        refresh_snapshot(engine, args.note)
+    if args.lookup:
+        print(lookup_features(args.lookup, args.snapshot, engine).to_string(index=False))
+    if args.list or not (args.refresh or args.lookup):
+        ensure_feature_store(engine)
+        for snapshot in list_snapshots(engine):
+            print(
+                f"{snapshot['snapshot_id']:>4} {snapshot['created_at']:%Y-%m-%d %H:%M} {snapshot['loans']:>10} loans "
+                f"+{snapshot['appended']} -{snapshot['retired']} {snapshot['note'] or ''}"
+            )
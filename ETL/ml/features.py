@@ -0,0 +1,286 @@
+#feature extraction: a view (or table) is streamed with COPY ... TO STDOUT and parsed block by block into typed Arrow columns,
+#the result is cached as parquet so the next reads skip the database
+#python -m ETL.ml.features [--relation accepted_loans_ml_training] [--refresh]
+#
+#the cache key is the definition of the relation plus the version of every table it reads:
+# - table oid / relfilenode (a full ETL run drops and recreates the core tables, TRUNCATE gets a new relfilenode)
+# - count(*) and max(created_at) of the table, read in the same snapshot as the rows, so rows added or removed always change the key
+# - rows inserted / updated / deleted (pg_stat_all_tables) and the etl_load_state watermarks (incremental loads)
+#the statistics counters are sent asynchronously and can be reset, so updates made outside the ETL are only picked up once they are counted,
+#refresh=True rebuilds the cache
+
+import os
+import time
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from ETL.db import get_engine, record_time
+from ETL.ingestion.cache_manager import touch_artifacts
+from ETL.ml.ml_training_acc import VIEW_NM
+
+# folder the feature files are cached in (CRA_FEATURE_CACHE environment variable), under the 'training data' folder by default
+FEATURE_CACHE = os.environ.get("CRA_FEATURE_CACHE", "")
+CACHE_DIR = "feature_cache"
+
+# 'training data' folder of the repository, the ETL is run from the repository root (python -m ETL.run_etl)
+TRAINING_DATA = Path(__file__).resolve().parents[2] / "training_data"
+
+# bytes of COPY output parsed per Arrow block, each block becomes a parquet row group
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# columns of the training view, as the notebook splits them
+ID_COLUMNS = ["loan_id", "borrower_id"]
+TARGET = "is_default"
+NUMERIC_FEATURES = ["loan_amnt", "installment", "dti", "income", "term_months"]
+CATEGORICAL_FEATURES = ["purpose"]
+
+# postgres type (format_type without its modifiers) -> arrow type, NUMERIC is read as float64 (features, not money)
+ARROW_TYPES = {
+    "smallint": pa.int16(),
+    "integer": pa.int32(),
+    "bigint": pa.int64(),
+    "numeric": pa.float64(),
+    "real": pa.float32(),
+    "double precision": pa.float64(),
+    "boolean": pa.bool_(),
+    "date": pa.date32(),
+    "timestamp without time zone": pa.timestamp("us"),
+    "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+}
+
+#helpers -----------
+def cache_dir(path: Optional[Path] = None) -> Path:
+    # same 'training data' folder as the ingestion, so cache_manager.py counts the feature files in its budget
+    # resolved from the repository root, not the working directory, so the notebooks/ folder shares the cache of the ETL
+    if path is None:
+        path = Path(FEATURE_CACHE) if FEATURE_CACHE else TRAINING_DATA / CACHE_DIR
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def arrow_type(sql_type: str) -> pa.DataType:
+    # text, varchar, uuid and anything without a mapping stay strings
+    return ARROW_TYPES.get(sql_type.split("(")[0], pa.string())
+
+def relation_columns(conn, relation: str) -> List[Tuple[str, str]]:
+    # (column, postgres type) of a view or table, in column order
+    rows = conn.execute(
+        text(
+            """
+            SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+            FROM pg_attribute a
+            WHERE a.attrelid = CAST(:relation AS regclass) AND a.attnum > 0 AND NOT a.attisdropped
+            ORDER BY a.attnum
+            """
+        ),
+        {"relation": relation},
+    )
+    return [(row[0], row[1]) for row in rows]
+
+def source_tables(conn, relation: str) -> List[str]:
+    # tables a relation reads, views are followed down to their tables and partitioned tables down to their partitions
+    kind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = CAST(:relation AS regclass)"), {"relation": relation}).scalar()
+    if kind == "v":
+        rows = conn.execute(
+            text(
+                """
+                SELECT DISTINCT d.refobjid::regclass::TEXT
+                FROM pg_rewrite r
+                JOIN pg_depend d ON d.objid = r.oid AND d.classid = 'pg_rewrite'::regclass AND d.refclassid = 'pg_class'::regclass
+                WHERE r.ev_class = CAST(:relation AS regclass) AND d.refobjid <> r.ev_class
+                """
+            ),
+            {"relation": relation},
+        )
+        return sorted({table for row in rows for table in source_tables(conn, row[0])})
+    if kind == "p":
+        rows = conn.execute(text("SELECT relid::TEXT FROM pg_partition_tree(CAST(:relation AS regclass)) WHERE isleaf"), {"relation": relation})
+        return sorted(row[0] for row in rows)
+    return [relation]
+
+def relation_version(conn, relation: str) -> Dict:
+    """
+    Definition of a relation and the version of the tables it reads
+
+    Returns:
+        dict with the "definition" (view SQL or column list), "tables" (table -> oid, relfilenode, row changes, rows, latest created_at)
+        and "loads" (etl_load_state)
+    """
+    columns = relation_columns(conn, relation)
+    definition = conn.execute(text("SELECT pg_get_viewdef(CAST(:relation AS regclass))"), {"relation": relation}).scalar()
+    tables = {}
+    for table in source_tables(conn, relation):
+        row = conn.execute(
+            text(
+                """
+                SELECT c.oid::BIGINT, c.relfilenode::BIGINT, s.n_tup_ins + s.n_tup_upd + s.n_tup_del
+                FROM pg_class c
+                LEFT JOIN pg_stat_all_tables s ON s.relid = c.oid
+                WHERE c.oid = CAST(:table AS regclass)
+                """
+            ),
+            {"table": table},
+        ).one()
+        # the counters above are asynchronous, the rows themselves are counted too
+        has_created_at = conn.execute(
+            text("SELECT 1 FROM pg_attribute WHERE attrelid = CAST(:table AS regclass) AND attname = 'created_at' AND NOT attisdropped"),
+            {"table": table},
+        ).scalar()
+        latest = "max(created_at)::TEXT" if has_created_at else "NULL"
+        counts = conn.execute(text(f"SELECT count(*), {latest} FROM {table}")).one()
+        tables[table] = list(row) + list(counts)
+
+    loads = []
+    if conn.execute(text("SELECT to_regclass('etl_load_state')")).scalar() is not None:
+        loads = [list(row) for row in conn.execute(text("SELECT source, row_watermark, loaded_at::TEXT FROM etl_load_state ORDER BY source"))]
+    return {"definition": definition or repr(columns), "columns": columns, "tables": tables, "loads": loads}
+
+def version_key(version: Dict) -> str:
+    return hashlib.sha256(repr(sorted(version.items())).encode()).hexdigest()[:16]
+
+def cache_path(directory: Path, relation: str, key: str) -> Path:
+    return directory / f"{relation}-{key}.parquet"
+
+#export -----------
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def select_sql(relation: str, columns: List[str]) -> str:
+    return f"SELECT {', '.join(quote_ident(column) for column in columns)} FROM {relation}"
+
+def copy_to_csv(conn, query: str, out_path: Path) -> None:
+    # COPY output written as it arrives, nothing goes through python row objects
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        start = time.perf_counter()
+        with open(out_path, "wb") as f:
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", f)
+        record_time(time.perf_counter() - start, f"COPY ({query}) TO STDOUT")
+    finally:
+        cursor.close()
+
+def csv_to_parquet(csv_path: Path, columns: List[Tuple[str, str]], out_path: Path, block_size: int = BLOCK_SIZE) -> int:
+    """
+    Parses the COPY csv into typed Arrow record batches, one block at a time, and writes them to out_path
+
+    Returns:
+        number of rows written
+    """
+    schema = pa.schema([(name, arrow_type(sql_type)) for name, sql_type in columns])
+    # COPY csv writes NULL as an empty unquoted field and '' as "", so only unquoted empty fields are nulls
+    convert = pa_csv.ConvertOptions(
+        column_types=schema,
+        null_values=[""],
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=False,
+        true_values=["t"],
+        false_values=["f"],
+    )
+    read = pa_csv.ReadOptions(column_names=schema.names, block_size=block_size)
+    rows = 0
+    with pq.ParquetWriter(out_path, schema) as writer:
+        reader = pa_csv.open_csv(csv_path, read_options=read, convert_options=convert)
+        for batch in reader:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+        if rows == 0:
+            writer.write_table(schema.empty_table())
+    return rows
+
+def write_parquet(conn, query: str, columns: List[Tuple[str, str]], path: Path) -> int:
+    """
+    Rows of query (its columns and postgres types in columns) written to path, the file only appears once it is complete
+
+    Returns:
+        number of rows written
+    """
+    csv_path = path.with_suffix(".csv.tmp")
+    tmp_path = path.with_suffix(".parquet.tmp")
+    try:
+        copy_to_csv(conn, query, csv_path)
+        rows = csv_to_parquet(csv_path, columns, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        csv_path.unlink(missing_ok=True)
+        tmp_path.unlink(missing_ok=True)
+    return rows
+
+def touch_cached(directory: Path, path: Path) -> None:
+    # marks a cached file as used, only when the cache is inside the 'training data' folder cache_manager.py manages
+    if directory.parent.name == "training_data":
+        touch_artifacts(directory.parent, [path], kind="derived")
+
+def export_relation(engine: Engine, relation: str, directory: Path) -> Path:
+    """
+    Streams relation into a parquet file of directory named after its version key, older files of the relation are removed
+
+    Returns:
+        path of the parquet file
+    """
+    start = time.perf_counter()
+    # one snapshot for the version and the rows, so the key always describes the rows written under it
+    with engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        version = relation_version(conn, relation)
+        key = version_key(version)
+        path = cache_path(directory, relation, key)
+        rows = write_parquet(conn, select_sql(relation, [name for name, _ in version["columns"]]), version["columns"], path)
+
+    for old in directory.glob(f"{relation}-*.parquet"):
+        if old != path:
+            old.unlink()
+    print(f"[features] exported {rows} rows of {relation} to {path.name} in {time.perf_counter() - start:.2f}s")
+    return path
+
+#API -----------
+def feature_table(
+    relation: str = VIEW_NM,
+    engine: Optional[Engine] = None,
+    columns: Optional[List[str]] = None,
+    refresh: bool = False,
+    directory: Optional[Path] = None,
+) -> pa.Table:
+    """
+    Rows of a view or table as an Arrow table, read from the parquet cache when the relation did not change since it was written
+
+    Params:
+        relation (accepted_loans_ml_training as default) : view or table to read
+        columns (None as default) : columns to return, all of them when None
+        refresh (False as default) : export again even if the cache is current
+        directory (None as default) : cache folder, CRA_FEATURE_CACHE or training_data/feature_cache when None
+    """
+    engine = engine or get_engine()
+    directory = cache_dir(directory)
+
+    # the version is only a few catalog lookups, the rows are read from the database again only when it changed
+    with engine.connect() as conn:
+        path = cache_path(directory, relation, version_key(relation_version(conn, relation)))
+    if refresh or not path.exists():
+        path = export_relation(engine, relation, directory)
+    touch_cached(directory, path)
+    return pq.read_table(path, columns=columns)
+
+def load_features(relation: str = VIEW_NM, engine: Optional[Engine] = None, columns: Optional[List[str]] = None, refresh: bool = False) -> pd.DataFrame:
+    # feature_table as a DataFrame, replaces pd.read_sql("SELECT * FROM accepted_loans_ml_training", engine) in the notebooks
+    return feature_table(relation, engine, columns, refresh).to_pandas()
+
+def training_matrix(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+    # X (numeric + categorical features) and y (is_default) of the training view
+    return df[NUMERIC_FEATURES + CATEGORICAL_FEATURES], df[TARGET]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a view or table to the parquet feature cache")
+    parser.add_argument("--relation", default=VIEW_NM, help="view or table to export")
+    parser.add_argument("--refresh", action="store_true", help="export again even if the cache is current")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    table = feature_table(args.relation, refresh=args.refresh)
+    print(f"[features] {args.relation}: {table.num_rows} rows, {table.num_columns} columns in {time.perf_counter() - start:.2f}s")
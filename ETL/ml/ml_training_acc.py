@@ -18,14 +18,16 @@ accepted_loans_ml_training -> total=81460, defaults(1)=10095, non_defaults(0)=71
 """
 
 from typing import Optional
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from sqlalchemy.engine import Engine
 
+from ETL.db import get_engine
+
 VIEW_NM = "accepted_loans_ml_training"
 
 def create_accepted_loans_training_view(engine: Optional[Engine] = None) -> None:
     if engine is None:
-        engine = create_engine("postgresql+psycopg2:///credit_risk")
+        engine = get_engine()
 
     ddl = text(
         f"""
@@ -55,8 +57,9 @@ def create_accepted_loans_training_view(engine: Optional[Engine] = None) -> None
             -- cats
             al.purpose
         FROM Accepted_Loans al
-        -- drops
-        WHERE al.loan_status IN (
+        -- drops (only kaggle loans have a loan_status, the source filter prunes the hdma partitions)
+        WHERE al.dataset_source = 'kaggle'
+          AND al.loan_status IN (
             'Charged Off',
             'Default',
             'Late (31-120 days)',
@@ -75,7 +78,7 @@ def create_accepted_loans_training_view(engine: Optional[Engine] = None) -> None
 # row counts for total/pos/nega
 def preview_training_counts(engine: Optional[Engine] = None) -> None:
     if engine is None:
-        engine = create_engine("postgresql+psycopg2:///credit_risk")
+        engine = get_engine()
 
     with engine.connect() as conn:
         total = conn.execute(
@@ -96,6 +99,6 @@ def preview_training_counts(engine: Optional[Engine] = None) -> None:
     )
 
 if __name__ == "__main__":
-    engine = create_engine("postgresql+psycopg2:///credit_risk")
+    engine = get_engine()
     create_accepted_loans_training_view(engine)
     preview_training_counts(engine)
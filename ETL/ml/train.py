@@ -0,0 +1,277 @@
+#training entry point of the default model (the models of notebooks/ml.ipynb, run unattended)
+#python -m ETL.ml.train [--snapshot N] [--candidates logistic_regression gradient_boosting] [--folds 5] [--jobs -1]
+#
+# 1. reads a feature store snapshot (ETL/ml/feature_store.py), a new one is refreshed from the view when --snapshot is not given
+# 2. keeps a stratified test split aside, every candidate is cross-validated on the rest with stratified K folds,
+#    all (candidate, fold) fits run in parallel worker processes
+# 3. the decision threshold of each candidate is swept on its out-of-fold probabilities
+# 4. the best candidate is refit on the whole training split, scored on the test split and saved with its report
+
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, average_precision_score, f1_score, precision_score, recall_score, roc_auc_score
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from ETL.db import get_engine
+from ETL.ml.features import CATEGORICAL_FEATURES, NUMERIC_FEATURES, TARGET
+from ETL.ml.feature_store import load_snapshot, refresh_snapshot
+
+# folder the trained models are saved in, one sub folder per run (CRA_MODEL_DIR environment variable)
+MODEL_DIR = os.environ.get("CRA_MODEL_DIR", "models")
+
+# worker processes of the cross validation, -1 uses every core (CRA_TRAIN_JOBS environment variable)
+TRAIN_JOBS = int(os.environ.get("CRA_TRAIN_JOBS", -1))
+
+CV_FOLDS = 5
+TEST_SIZE = 0.2
+SEED = 42
+
+# cross validated metric the best candidate is picked on
+SELECTION_METRIC = "roc_auc"
+SELECTION_METRICS = ("roc_auc", "average_precision", "f1")
+
+# thresholds swept on the out-of-fold probabilities, the one with the best F1 of the default class is kept
+THRESHOLDS = np.round(np.arange(0.05, 0.951, 0.01), 2)
+
+# incomes above this quantile of the training rows are capped (notebook: 866 outliers above the 99th percentile)
+INCOME_QUANTILE = 0.99
+
+#model -----------
+class QuantileClipper(BaseEstimator, TransformerMixin):
+    # caps each column at the quantile seen during fit, so the cap is learned on the training folds only
+    def __init__(self, quantile: float = INCOME_QUANTILE):
+        self.quantile = quantile
+
+    def fit(self, X, y=None):
+        self.upper_ = np.nanquantile(np.asarray(X, dtype="float64"), self.quantile, axis=0)
+        return self
+
+    def transform(self, X):
+        return np.minimum(np.asarray(X, dtype="float64"), self.upper_)
+
+def preprocessor() -> ColumnTransformer:
+    # scale the numeric features (income capped first), one-hot encode the categorical ones
+    numeric = [column for column in NUMERIC_FEATURES if column != "income"]
+    return ColumnTransformer(
+        transformers=[
+            ("num", StandardScaler(), numeric),
+            ("income", Pipeline([("cap", QuantileClipper()), ("scale", StandardScaler())]), ["income"]),
+            ("cat", OneHotEncoder(handle_unknown="ignore"), CATEGORICAL_FEATURES),
+        ],
+        remainder="drop",
+    )
+
+def candidate_models(seed: int = SEED) -> Dict[str, Pipeline]:
+    """
+    Candidates of the notebook, class weighted since defaults are the minority class
+    (the fits already run one per core, so the models themselves use a single job)
+    """
+    classifiers = {
+        "logistic_regression": LogisticRegression(max_iter=1000, class_weight="balanced"),
+        "random_forest": RandomForestClassifier(
+            n_estimators=300,
+            min_samples_leaf=1,
+            class_weight="balanced_subsample",
+            random_state=seed,
+            n_jobs=1,
+        ),
+        # stops adding trees once the loss on 10% of the training fold did not improve for 20 iterations
+        "gradient_boosting": HistGradientBoostingClassifier(
+            max_depth=6,
+            learning_rate=0.1,
+            max_iter=500,
+            class_weight="balanced",
+            early_stopping=True,
+            validation_fraction=0.1,
+            n_iter_no_change=20,
+            random_state=seed,
+        ),
+    }
+    return {name: Pipeline([("preprocess", preprocessor()), ("clf", clf)]) for name, clf in classifiers.items()}
+
+#cross validation -----------
+def fit_fold(name: str, model: Pipeline, X: pd.DataFrame, y: np.ndarray, train_idx: np.ndarray, test_idx: np.ndarray) -> Dict:
+    # one (candidate, fold) fit, runs in a worker process
+    start = time.perf_counter()
+    model = clone(model).fit(X.iloc[train_idx], y[train_idx])
+    proba = model.predict_proba(X.iloc[test_idx])[:, 1]
+    clf = model.named_steps["clf"]
+    # boosting rounds kept by early stopping
+    iterations = int(clf.n_iter_) if isinstance(clf, HistGradientBoostingClassifier) else None
+    return {
+        "name": name,
+        "test_idx": test_idx,
+        "proba": proba,
+        "seconds": time.perf_counter() - start,
+        "iterations": iterations,
+    }
+
+def sweep_thresholds(y: np.ndarray, proba: np.ndarray, thresholds: np.ndarray = THRESHOLDS) -> Tuple[float, List[Dict]]:
+    """
+    Precision, recall and F1 of the default class at every threshold
+
+    Returns:
+        threshold with the best F1, list of one dict per threshold
+    """
+    rows = []
+    for threshold in thresholds:
+        pred = (proba >= threshold).astype(int)
+        rows.append({
+            "threshold": float(threshold),
+            "precision_1": precision_score(y, pred, zero_division=0),
+            "recall_1": recall_score(y, pred, zero_division=0),
+            "f1_1": f1_score(y, pred, zero_division=0),
+        })
+    best = max(rows, key=lambda row: row["f1_1"])
+    return best["threshold"], rows
+
+def classification_metrics(y: np.ndarray, proba: np.ndarray, threshold: float) -> Dict[str, float]:
+    pred = (proba >= threshold).astype(int)
+    return {
+        "accuracy": accuracy_score(y, pred),
+        "precision_1": precision_score(y, pred, zero_division=0),
+        "recall_1": recall_score(y, pred, zero_division=0),
+        "f1_1": f1_score(y, pred, zero_division=0),
+        "roc_auc": roc_auc_score(y, proba),
+        "average_precision": average_precision_score(y, proba),
+    }
+
+def cross_validate(
+    models: Dict[str, Pipeline], X: pd.DataFrame, y: np.ndarray, folds: int = CV_FOLDS, jobs: int = TRAIN_JOBS, seed: int = SEED
+) -> Dict[str, Dict]:
+    """
+    Fits every candidate on every fold in parallel, then scores each candidate on its out-of-fold probabilities
+
+    Returns:
+        candidate -> dict with the per fold and out-of-fold metrics, the best threshold and its sweep
+    """
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(X, y))
+    tasks = [(name, model, train_idx, test_idx) for name, model in models.items() for train_idx, test_idx in splits]
+    results = Parallel(n_jobs=jobs)(delayed(fit_fold)(name, model, X, y, train_idx, test_idx) for name, model, train_idx, test_idx in tasks)
+
+    scores = {}
+    for name in models:
+        fits = [result for result in results if result["name"] == name]
+        oof = np.empty(len(y), dtype="float64")
+        for result in fits:
+            oof[result["test_idx"]] = result["proba"]
+        threshold, sweep = sweep_thresholds(y, oof)
+        fold_auc = [roc_auc_score(y[result["test_idx"]], result["proba"]) for result in fits]
+        scores[name] = {
+            "threshold": threshold,
+            "oof": classification_metrics(y, oof, threshold),
+            "fold_roc_auc": fold_auc,
+            "roc_auc_std": float(np.std(fold_auc)),
+            "fit_seconds": float(np.sum([result["seconds"] for result in fits])),
+            "iterations": [result["iterations"] for result in fits] if fits[0]["iterations"] is not None else None,
+            "sweep": sweep,
+        }
+        print(
+            f"[train] {name:<20} roc_auc {scores[name]['oof']['roc_auc']:.4f} (+/- {scores[name]['roc_auc_std']:.4f}) "
+            f"f1 {scores[name]['oof']['f1_1']:.4f} at {threshold:.2f} ({scores[name]['fit_seconds']:.1f}s of fits)"
+        )
+    return scores
+
+#run -----------
+def train(
+    snapshot_id: Optional[int] = None,
+    candidates: Optional[List[str]] = None,
+    folds: int = CV_FOLDS,
+    jobs: int = TRAIN_JOBS,
+    metric: str = SELECTION_METRIC,
+    out_dir: Optional[Path] = None,
+    seed: int = SEED,
+) -> Path:
+    """
+    Cross validates the candidates, refits the best one on the training split and saves it with its metrics report
+
+    Params:
+        snapshot_id (None as default) : feature store snapshot to train on, a refreshed snapshot of the view when None
+        candidates (None as default) : names of candidate_models to try, all of them when None
+        metric (roc_auc as default) : out-of-fold metric the best candidate is picked on, one of SELECTION_METRICS
+        out_dir (None as default) : folder of the run, MODEL_DIR/<time of the run> when None
+
+    Returns:
+        folder holding model.joblib and report.json
+    """
+    if metric not in SELECTION_METRICS:
+        raise ValueError(f"unknown selection metric {metric}, expected one of {SELECTION_METRICS}")
+    start = time.perf_counter()
+    engine = get_engine()
+    if snapshot_id is None:
+        snapshot_id = refresh_snapshot(engine, note="ETL.ml.train")
+    df = load_snapshot(snapshot_id, engine)
+    df = df[df[TARGET].notna()]
+    X, y = df[NUMERIC_FEATURES + CATEGORICAL_FEATURES], df[TARGET].to_numpy(dtype="int64")
+    print(f"[train] snapshot {snapshot_id}: {len(df)} loans, {int(y.sum())} defaults")
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=TEST_SIZE, random_state=seed, stratify=y)
+    models = candidate_models(seed)
+    if candidates:
+        unknown = set(candidates) - set(models)
+        if unknown:
+            raise ValueError(f"unknown candidates {sorted(unknown)}, expected some of {list(models)}")
+        models = {name: models[name] for name in candidates}
+
+    scores = cross_validate(models, X_train, y_train, folds, jobs, seed)
+    best = max(scores, key=lambda name: scores[name]["oof"][metric])
+    threshold = scores[best]["threshold"]
+
+    model = clone(models[best]).fit(X_train, y_train)
+    test = classification_metrics(y_test, model.predict_proba(X_test)[:, 1], threshold)
+    print(f"[train] best {best}: test roc_auc {test['roc_auc']:.4f}, f1 {test['f1_1']:.4f}, recall {test['recall_1']:.4f} at {threshold:.2f}")
+
+    out_dir = Path(out_dir or Path(MODEL_DIR) / time.strftime("%Y%m%d_%H%M%S"))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    joblib.dump(
+        {"pipeline": model, "threshold": threshold, "features": NUMERIC_FEATURES + CATEGORICAL_FEATURES, "snapshot_id": snapshot_id},
+        out_dir / "model.joblib",
+    )
+    report = {
+        "snapshot_id": snapshot_id,
+        "rows": {"train": len(y_train), "test": len(y_test), "defaults": int(y.sum())},
+        "folds": folds,
+        "selection_metric": metric,
+        "best": best,
+        "threshold": threshold,
+        "test": test,
+        "candidates": scores,
+        "seconds": time.perf_counter() - start,
+    }
+    with open(out_dir / "report.json", "w") as f:
+        json.dump(report, f, indent=2, default=float)
+    print(f"[train] saved {best} to {out_dir} ({report['seconds']:.1f}s)")
+    return out_dir
+
+def load_model(path: Path) -> Dict:
+    # dict saved by train: pipeline, threshold, features, snapshot_id
+    return joblib.load(Path(path) / "model.joblib")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross validate the candidate models and save the best one")
+    parser.add_argument("--snapshot", type=int, help="feature store snapshot to train on (default: refresh one from the view)")
+    parser.add_argument("--candidates", nargs="+", help="candidates to try (default: all)")
+    parser.add_argument("--folds", type=int, default=CV_FOLDS)
+    parser.add_argument("--jobs", type=int, default=TRAIN_JOBS, help="worker processes, -1 for every core")
+    parser.add_argument("--metric", default=SELECTION_METRIC, choices=SELECTION_METRICS)
+    parser.add_argument("--out", type=Path, help="folder of the run (default: MODEL_DIR/<time>)")
+    args = parser.parse_args()
+
+    # run through the imported module so the saved pipeline refers to ETL.ml.train.QuantileClipper, not __main__
+    from ETL.ml import train as train_module
+    train_module.train(args.snapshot, args.candidates, args.folds, args.jobs, args.metric, args.out)
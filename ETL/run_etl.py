@@ -1,9 +1,13 @@
-from sqlalchemy import create_engine, text
+import os
+import argparse
+from sqlalchemy import text
 from sqlalchemy.engine import Engine
+from ETL.db import get_engine, db_stage
 from ETL.transformation.staging_loader import (
     load_kaggle_staging,
     load_hdma_staging
 )
+from ETL.transformation.parallel_staging import load_staging_parallel
 
 from ETL.transformation.validation_loader import (
     create_valid_accepted_kaggle,
@@ -16,20 +20,40 @@ from ETL.transformation.validation_loader import (
 from ETL.load.transf_loader import (
     run_transf_loader
 )
+from ETL.load.bulk_mode import set_staging_unlogged
+from ETL.transformation.incremental_loader import run_incremental, record_watermarks
 
 from ETL.ingestion.data_ingestion_kaggle import (
     initialize_data_path,
     delete_large_files
 )
 
-def create_databases() -> None:
+# clean the four ingestion branches in parallel worker processes (opt in with CRA_PARALLEL_STAGING=1, they run one after another by default)
+PARALLEL_STAGING = os.environ.get("CRA_PARALLEL_STAGING", "0") == "1"
+
+# bulk load: UNLOGGED staging tables and secondary indexes built after the core tables are filled (set CRA_BULK_LOAD=1, see ETL/load/bulk_mode.py)
+BULK_LOAD = os.environ.get("CRA_BULK_LOAD", "0") == "1"
+
+# incremental load: only the rows appended to the sources since the last run, core tables are kept (--incremental or CRA_INCREMENTAL=1,
+# see ETL/transformation/incremental_loader.py)
+INCREMENTAL = os.environ.get("CRA_INCREMENTAL", "0") == "1"
+
+# full runs stage a seeded sample of each source (set CRA_SAMPLE=0 or pass --all-rows to stage every row), only a run that
+# staged every row records the watermarks later --incremental runs start from
+SAMPLE = os.environ.get("CRA_SAMPLE", "1") != "0"
+
+def create_databases(bulk: bool = BULK_LOAD) -> None:
+    # bulk skips indexing.sql, run_transf_loader builds the indexes once the data is in
     sql_files = [
+        "database/database.sql",
+        "database/staging.sql"
+    ] if bulk else [
         "database/database.sql",
         "database/indexing.sql",
         "database/staging.sql"
     ]
 
-    engine = create_engine("postgresql+psycopg2:///credit_risk")
+    engine = get_engine()
     
     with engine.begin() as conn:
         for path in sql_files:
@@ -38,54 +62,93 @@ def create_databases() -> None:
                 sql = f.read()
             conn.execute(text(sql))
 
+    if bulk:
+        set_staging_unlogged(engine)
+
     print("=== Completed database creation ===")
 
 if __name__ == "__main__":
-    engine = create_engine("postgresql+psycopg2:///credit_risk")
-    try:
-        create_databases()
-    except Exception as e:
-        print(f"Could not create database: {e}")
-
-    try:
-        print("=== Loading Kaggle staging tables ===")
-        load_kaggle_staging(sample=True, seed=42, engine=engine)
-
-        print("=== Loading HDMA staging tables ===")
-        load_hdma_staging(sample=True, seed=42, engine=engine)
-
-        print("=== All staging tables populated ===")
-    except Exception as e:
-        print(f"Error when trying to execute staging_loader.py: {e}")
-
-    try:
-        print("=== Loading VALID Kaggle accepted table ===")
-        create_valid_accepted_kaggle(engine)
-
-        print("=== Loading VALID Kaggle rejected table ===")
-        create_valid_rejected_kaggle(engine)
-
-        print("=== Loading VALID HDMA accepted table ===")
-        create_valid_accepted_hdma(engine)
-
-        print("=== Loading VALID HDMA rejected table ===")
-        create_valid_rejected_hdma(engine)
-
-        print("=== ALL VALID TABLES WERE LOADED ===")
-        confirm_lengths(engine)
-
-    except Exception as e:
-        print(f"Error when trying to execute validation_loader.py: {e}")
-
-    try:
-        run_transf_loader(engine)
-    except Exception as e:
-        print(f"Error when trying to execute transf_loader.py: {e}")
+    parser = argparse.ArgumentParser(description="Run the ETL: full drop and reload, or an incremental load of the new source rows")
+    parser.add_argument("--incremental", action="store_true", default=INCREMENTAL, help="load only the rows appended since the last run, the core tables are kept")
+    parser.add_argument("--all-rows", action="store_true", default=not SAMPLE, help="stage every row of the sources instead of a seeded sample (records the watermarks used by --incremental)")
+    args = parser.parse_args()
+    sample = not args.all_rows
+
+    # every stage prints the statements it ran and the time they spent in the database (see ETL/db.py)
+    engine = get_engine()
+    if args.incremental:
+        try:
+            run_incremental(engine)
+        except Exception as e:
+            print(f"Error when trying to execute incremental_loader.py: {e}")
+            raise SystemExit(1)
+    else:
+        try:
+            with db_stage("create_databases"):
+                create_databases()
+        except Exception as e:
+            print(f"Could not create database: {e}")
+            raise SystemExit(1)
+
+        try:
+            with db_stage("staging"):
+                if PARALLEL_STAGING:
+                    print("=== Loading Kaggle and HDMA staging tables in parallel ===")
+                    load_staging_parallel(sample=sample, seed=42, engine=engine)
+                else:
+                    print("=== Loading Kaggle staging tables ===")
+                    load_kaggle_staging(sample=sample, seed=42, engine=engine)
+
+                    print("=== Loading HDMA staging tables ===")
+                    load_hdma_staging(sample=sample, seed=42, engine=engine)
+
+            print("=== All staging tables populated ===")
+        except Exception as e:
+            print(f"Error when trying to execute staging_loader.py: {e}")
+            raise SystemExit(1)
+
+        try:
+            with db_stage("validation"):
+                print("=== Loading VALID Kaggle accepted table ===")
+                create_valid_accepted_kaggle(engine)
+
+                print("=== Loading VALID Kaggle rejected table ===")
+                create_valid_rejected_kaggle(engine)
+
+                print("=== Loading VALID HDMA accepted table ===")
+                create_valid_accepted_hdma(engine)
+
+                print("=== Loading VALID HDMA rejected table ===")
+                create_valid_rejected_hdma(engine)
+
+                print("=== ALL VALID TABLES WERE LOADED ===")
+                confirm_lengths(engine)
+
+        except Exception as e:
+            print(f"Error when trying to execute validation_loader.py: {e}")
+            raise SystemExit(1)
+
+        try:
+            with db_stage("transf_loader"):
+                run_transf_loader(engine, bulk=BULK_LOAD)
+        except Exception as e:
+            print(f"Error when trying to execute transf_loader.py: {e}")
+            raise SystemExit(1)
+
+        # later --incremental runs only load the rows appended after this point, so the watermarks are only recorded once
+        # every stage succeeded on every row of the sources (a sample leaves rows below the watermark that were never loaded)
+        if sample:
+            print("[incremental_loader] sampled run, no watermarks recorded (run with --all-rows before using --incremental)")
+        else:
+            try:
+                record_watermarks(engine)
+            except Exception as e:
+                print(f"Error when trying to record the source watermarks: {e}")
+                raise SystemExit(1)
 
     try:
         path = initialize_data_path()
         delete_large_files(path)
-        print("=== DELETED all large files (KAGGLE!) ===")
+        print("=== training_data trimmed to its disk budget ===")
     except Exception as e:
         print(f"Error when trying to delete large files: {e}")
-    
\ No newline at end of file
@@ -0,0 +1,68 @@
+#COPY FROM STDIN writer shared by staging_loader.py and load_pipeline.py
+
+import io
+import os
+import time
+import pandas as pd
+from psycopg2 import sql
+from typing import Optional, Dict
+
+from ETL.db import record_time
+
+# how write_df_to_table sends rows: "copy" streams them with COPY FROM STDIN, "insert" uses to_sql multi row INSERTs
+WRITE_METHODS = ("copy", "insert")
+WRITE_METHOD = os.environ.get("CRA_WRITE_METHOD", "copy")
+
+# rows per COPY buffer, each buffer is built in memory and sent before the next one is built
+COPY_CHUNKSIZE = 100_000
+
+INTEGER_TYPES = ("smallint", "integer", "bigint")
+
+def table_column_types(cursor, table_name: str) -> Dict[str, str]:
+    # column -> data type of the table as it exists in the database
+    cursor.execute(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = %s AND table_schema = current_schema()",
+        (table_name,),
+    )
+    return dict(cursor.fetchall())
+
+def copy_ready(df: pd.DataFrame, column_types: Dict[str, str]) -> pd.DataFrame:
+    # float columns going to integer columns are written without decimals (to_sql lets postgres round them, COPY would reject '36.0')
+    converted = {}
+    for column in df.columns:
+        if column_types.get(column) in INTEGER_TYPES and df[column].dtype.kind == "f":
+            converted[column] = df[column].round().astype("Int64")
+    return df.assign(**converted) if converted else df
+
+def copy_df(conn, df: pd.DataFrame, table_name: str, chunksize: int = COPY_CHUNKSIZE) -> None:
+    # streams df into table_name with COPY FROM STDIN, one in memory csv buffer per chunk (no temp files)
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        df = copy_ready(df, table_column_types(cursor, table_name))
+        statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')").format(
+            sql.Identifier(table_name),
+            sql.SQL(", ").join(sql.Identifier(column) for column in df.columns),
+        )
+        for start in range(0, len(df), chunksize):
+            buffer = io.StringIO()
+            df.iloc[start:start + chunksize].to_csv(buffer, index=False, header=False, na_rep="\\N")
+            buffer.seek(0)
+            # raw cursor, so the engine timing hooks do not see it
+            t0 = time.perf_counter()
+            cursor.copy_expert(statement, buffer)
+            record_time(time.perf_counter() - t0, f"COPY {table_name}")
+    finally:
+        cursor.close()
+
+def write_rows(conn, df: pd.DataFrame, table_name: str, if_exists: str = "append", chunksize: int = 5000, method: Optional[str] = None) -> None:
+    # writes df on an open connection (inside the caller's transaction) with the given method, WRITE_METHOD when None
+    method = method or WRITE_METHOD
+    if method not in WRITE_METHODS:
+        raise ValueError(f"unknown write method {method}, expected one of {WRITE_METHODS}")
+
+    if method == "insert":
+        df.to_sql(table_name, conn, if_exists=if_exists, index=False, method="multi", chunksize=chunksize,)
+    else:
+        # an empty to_sql keeps the if_exists behaviour (create / replace / fail) before the rows are copied
+        df.head(0).to_sql(table_name, conn, if_exists=if_exists, index=False)
+        copy_df(conn, df, table_name, max(chunksize, COPY_CHUNKSIZE))
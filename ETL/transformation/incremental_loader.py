@@ -0,0 +1,296 @@
+#incremental load: only the raw rows added to (or changed in) each source file since the last load are cleaned, staged, validated and mapped
+#python -m ETL.transformation.incremental_loader (or python -m ETL.run_etl --incremental), needs one full run of ETL/run_etl.py --all-rows first
+#
+#every source has a row in etl_load_state (database/database.sql) with its content hash, a row watermark and its row groups:
+# - same hash -> nothing to load
+# - new hash and the rows below the watermark are unchanged -> rows [watermark, end) are loaded
+# - new hash and some rows below the watermark changed:
+#   - kaggle_accepted (rows keyed by the Kaggle id) -> the row groups that changed are staged again with the new rows,
+#     the mapping upserts them (ON CONFLICT (loan_id) DO UPDATE, see accepted_loans_map.py)
+#   - the other sources have no key to match a changed row with the one already mapped (append only) -> the file was rewritten,
+#     the source is skipped until the next full run
+#only the row groups whose bytes changed are decoded to find the changed rows (see parquet_cache.row_groups)
+#the core tables are never dropped, existing rows keep their created_at
+
+import json
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow.parquet as pq
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from ETL.db import get_engine, db_stage
+from ETL.ingestion.parquet_cache import cached_parquet, load_manifest, update_manifest, source_hash, parquet_rows, read_parquet_range, row_groups, rows_digest
+from ETL.ingestion.data_ingestion_kaggle import (
+    initialize_data_path,
+    KAGGLE_SOURCES,
+    find_kaggle_csvs,
+    read_kaggle_source,
+    kaggle_accepted_loans_chunks,
+    kaggle_rejected_loans_chunks,
+)
+from ETL.ingestion.data_ingestion_hdma import HDMA_FILES, HDMA_COLUMNS, clean_hdma_accepted, clean_hdma_rejected
+from ETL.ingestion.imputation import stats_path as imputer_stats_path
+from ETL.transformation.staging_loader import staging_frame, write_df_to_table
+from ETL.transformation.validation_loader import update_valid
+from ETL.load.transf_loader import run_transf_loader
+
+STAGING_SQL = Path(__file__).resolve().parents[2] / "database" / "staging.sql"
+
+# source -> staging table its cleaned rows go to
+SOURCE_TABLES = {
+    "kaggle_accepted": "staging_accepted_kaggle",
+    "kaggle_rejected": "staging_rejected_kaggle",
+    "hdma_accepted": "staging_accepted_hdma",
+    "hdma_rejected": "staging_rejected_hdma",
+}
+
+# sources whose rows are matched by key in the core tables, rows that changed below the watermark can be loaded again
+KEYED_SOURCES = {"kaggle_accepted"}
+
+#sources -----------
+def source_file(DATA: Path, source: str) -> Optional[Dict]:
+    """
+    Parquet file the raw rows of a source are read from (the parquet cache for the Kaggle csvs)
+
+    Returns:
+        dict with the file, its content hash and the columns read from it, None if the source is not on disk
+    """
+    kind, name = source.split("_")
+    if kind == "kaggle":
+        dtypes = KAGGLE_SOURCES[name]
+        file = cached_parquet(DATA, source, find_kaggle_csvs(DATA)[name], dtypes)
+        if file is None:
+            return None
+        return {"file": file, "content_hash": load_manifest(DATA)["parquet"][source]["sha256"], "columns": list(dtypes)}
+
+    file = DATA / HDMA_FILES[name]
+    if not file.exists():
+        return None
+    # the hash is kept in the manifest with the file size / mtime, an unchanged file is not read again
+    manifest = update_manifest(DATA, lambda latest: source_hash(DATA, file, latest))
+    names = pq.read_schema(file).names
+    return {
+        "file": file,
+        "content_hash": manifest["sources"][str(file.relative_to(DATA))]["sha256"],
+        "columns": [c for c in HDMA_COLUMNS if c in names],
+    }
+
+def load_state(engine: Engine) -> Dict[str, Dict]:
+    # source -> its etl_load_state row
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT * FROM etl_load_state")).mappings().all()
+    return {row["source"]: dict(row) for row in rows}
+
+def save_state(engine: Engine, DATA: Path, plans: List[Dict]) -> None:
+    # moves the watermark of every loaded source, in one transaction
+    with engine.begin() as conn:
+        for plan in plans:
+            conn.execute(
+                text("""
+                    INSERT INTO etl_load_state (source, file, content_hash, row_watermark, row_groups, rows_staged, loaded_at)
+                    VALUES (:source, :file, :content_hash, :row_watermark, CAST(:row_groups AS JSONB), :rows_staged, now())
+                    ON CONFLICT (source) DO UPDATE SET
+                        file = EXCLUDED.file,
+                        content_hash = EXCLUDED.content_hash,
+                        row_watermark = EXCLUDED.row_watermark,
+                        row_groups = EXCLUDED.row_groups,
+                        rows_staged = EXCLUDED.rows_staged,
+                        loaded_at = EXCLUDED.loaded_at
+                """),
+                {
+                    "source": plan["source"],
+                    "file": str(Path(plan["file"]).relative_to(DATA)),
+                    "content_hash": plan["content_hash"],
+                    "row_watermark": plan["rows"],
+                    "row_groups": json.dumps(plan["row_groups"]),
+                    "rows_staged": plan.get("rows_staged", 0),
+                },
+            )
+
+def record_watermarks(engine: Optional[Engine] = None, DATA: Optional[Path] = None) -> None:
+    """
+    Records every source as fully loaded at its current content, incremental loads start after its last row
+
+    Only called by ETL/run_etl.py at the end of a full run that staged every row (--all-rows) and where every stage succeeded,
+    a sampled run did not load the rows left out of the sample so it records nothing
+    """
+    engine = engine or get_engine()
+    DATA = DATA or initialize_data_path()
+    plans = []
+    for source in SOURCE_TABLES:
+        info = source_file(DATA, source)
+        if info is None:
+            print(f"[incremental_loader] {source} is not on disk, no watermark recorded")
+            continue
+        plans.append({**info, "source": source, "rows": parquet_rows(info["file"]), "row_groups": group_digests(info)})
+    save_state(engine, DATA, plans)
+    print(f"[incremental_loader] recorded watermarks of {', '.join(plan['source'] for plan in plans)}")
+
+#plan -----------
+def group_digests(info: Dict, groups: Optional[List[Dict]] = None, previous: Optional[List[Dict]] = None, digests: Optional[Dict] = None) -> List[Dict]:
+    # row groups of the file (see parquet_cache.row_groups) with the rows_digest of their rows, stored in etl_load_state
+    # only the groups whose bytes are not in previous are decoded, digests: (start_row, stop_row) -> rows_digest already computed
+    known = {(group["start"], group["rows"], group["sha256"]): group["digest"] for group in previous or []}
+    digests = digests or {}
+    groups = groups if groups is not None else row_groups(info["file"], info["columns"])
+    for group in groups:
+        key = (group["start"], group["rows"], group["sha256"])
+        span = (group["start"], group["start"] + group["rows"])
+        if key in known:
+            group["digest"] = known[key]
+        else:
+            group["digest"] = digests[span] if span in digests else rows_digest(info["file"], info["columns"], *span)
+    return groups
+
+def changed_ranges(info: Dict, groups: List[Dict], previous: List[Dict], digests: Dict) -> List[tuple]:
+    # row ranges below the watermark whose rows changed since the last load
+    # a group with the same bytes holds the same rows, the others are decoded and compared with the digest of the rows they had
+    current = {(group["start"], group["rows"], group["sha256"]) for group in groups}
+    changed = []
+    for group in previous:
+        if (group["start"], group["rows"], group["sha256"]) in current:
+            continue
+        span = (group["start"], group["start"] + group["rows"])
+        digests[span] = rows_digest(info["file"], info["columns"], *span)
+        if digests[span] != group["digest"]:
+            changed.append(span)
+    return changed
+
+def plan_source(source: str, info: Dict, previous: Optional[Dict]) -> Dict:
+    """
+    Compares a source file with its etl_load_state row
+
+    Returns:
+        plan dict, status is "load" (the row ranges in "ranges" are new or changed), "unchanged", "rewritten" or "no_watermark"
+        ("failed" is set by stage_delta when the rows could not be cleaned)
+    """
+    rows = parquet_rows(info["file"])
+    plan = {**info, "source": source, "rows": rows, "ranges": []}
+    if previous is None:
+        plan["status"] = "no_watermark"
+        return plan
+    if previous["content_hash"] == info["content_hash"]:
+        plan["status"] = "unchanged"
+        return plan
+
+    # the row groups are hashed from their bytes, only the ones that changed are decoded
+    watermark = previous["row_watermark"]
+    groups, digests = row_groups(info["file"], info["columns"]), {}
+    changed = [] if rows < watermark else changed_ranges(info, groups, previous["row_groups"], digests)
+    if rows < watermark or (changed and source not in KEYED_SOURCES):
+        plan["status"] = "rewritten"
+        return plan
+
+    plan["status"] = "load"
+    plan["changed"] = changed
+    plan["ranges"] = changed + ([(watermark, rows)] if rows > watermark else [])
+    plan["row_groups"] = group_digests(info, groups, previous["row_groups"], digests)
+    return plan
+
+def plan_incremental(engine: Engine, DATA: Path) -> List[Dict]:
+    state = load_state(engine)
+    plans = []
+    for source in SOURCE_TABLES:
+        info = source_file(DATA, source)
+        if info is None:
+            print(f"[incremental_loader] {source}: not on disk, skipped")
+            continue
+        plan = plan_source(source, info, state.get(source))
+        if plan["status"] == "load":
+            for start, stop in plan["changed"]:
+                print(f"[incremental_loader] {source}: rows {start} to {stop} changed")
+            if plan["rows"] > state[source]["row_watermark"]:
+                print(f"[incremental_loader] {source}: rows {state[source]['row_watermark']} to {plan['rows']} are new")
+        elif plan["status"] == "rewritten":
+            print(f"[incremental_loader] {source}: rows below the watermark changed, the file was rewritten -> run a full load (python -m ETL.run_etl --all-rows)")
+        elif plan["status"] == "no_watermark":
+            print(f"[incremental_loader] {source}: no watermark recorded -> run a full load (python -m ETL.run_etl --all-rows) first")
+        else:
+            print(f"[incremental_loader] {source}: unchanged")
+        plans.append(plan)
+    return plans
+
+#load -----------
+def clean_delta(DATA: Path, plan: Dict) -> Iterator[pd.DataFrame]:
+    # cleaned chunks of the delta, cleaned with the imputation statistics of the earlier loads so it is filled the same way as the rows already stored
+    source = plan["source"]
+    if source == "kaggle_accepted":
+        # the changed row groups and the new rows, read from the parquet cache plan_source hashed
+        frames = (chunk for start, stop in plan["ranges"] for chunk in read_parquet_range(plan["file"], plan["columns"], start, stop))
+        return kaggle_accepted_loans_chunks([frames, None], sample_csv=False, stats_path=imputer_stats_path(DATA, source), reuse_stats=True)
+    # the other sources only load appended rows, so their delta is the rows from the watermark on
+    start_row = plan["ranges"][0][0]
+    if source == "kaggle_rejected":
+        frames = read_kaggle_source(DATA, "rejected", find_kaggle_csvs(DATA)["rejected"], start_row=start_row)
+        return kaggle_rejected_loans_chunks([None, frames], sample_csv=False, stats_path=imputer_stats_path(DATA, source), reuse_stats=True)
+    clean = clean_hdma_accepted if source == "hdma_accepted" else clean_hdma_rejected
+    df = clean(DATA, sample=False, reuse_stats=True, start_row=start_row)
+    if df is None:
+        raise RuntimeError(f"{source} returned no dataframe")
+    return iter([df])
+
+def stage_delta(engine: Engine, DATA: Path, plans: List[Dict]) -> None:
+    # staging tables are emptied (the core tables are not touched), then only the new rows of each source are written
+    # TRUNCATE keeps the valid_* views built on them so they are refreshed instead of rebuilt, staging.sql only runs when a table is missing
+    tables = list(SOURCE_TABLES.values())
+    with engine.begin() as conn:
+        if all(conn.execute(text("SELECT to_regclass(:name)"), {"name": table}).scalar() for table in tables):
+            conn.execute(text(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY"))
+        else:
+            with open(STAGING_SQL, "r") as f:
+                conn.execute(text(f.read()))
+
+    for plan in plans:
+        if plan["status"] != "load":
+            continue
+        table = SOURCE_TABLES[plan["source"]]
+        plan["rows_staged"] = 0
+        try:
+            # each cleaned chunk is written as it is produced
+            for chunk in clean_delta(DATA, plan):
+                plan["rows_staged"] += write_df_to_table(engine, staging_frame(chunk, table), table)
+        except Exception as e:
+            # the chunks already staged are removed and the watermark of the source stays where it was
+            plan["status"] = "failed"
+            with engine.begin() as conn:
+                conn.execute(text(f"TRUNCATE {table}"))
+            print(f"[incremental_loader] {plan['source']}: cleaning failed ({e}), its rows will be loaded by the next run")
+            continue
+        print(f"[incremental_loader] sent {plan['rows_staged']} rows to {table}")
+
+def run_incremental(engine: Optional[Engine] = None, DATA: Optional[Path] = None) -> List[Dict]:
+    """
+    Loads the rows appended to the sources since the last load into the core tables
+
+    Returns:
+        list of plan dicts, one per source (see plan_source)
+    """
+    engine = engine or get_engine()
+    DATA = DATA or initialize_data_path()
+
+    plans = plan_incremental(engine, DATA)
+    to_load = [plan for plan in plans if plan["status"] == "load"]
+    if not to_load:
+        print("=== incremental load: nothing new to load ===")
+        return plans
+
+    with db_stage("staging"):
+        stage_delta(engine, DATA, plans)
+
+    with db_stage("validation"):
+        update_valid(engine)
+
+    with db_stage("transf_loader"):
+        run_transf_loader(engine)
+
+    # the watermarks only move once the rows are in the core tables
+    to_load = [plan for plan in to_load if plan["status"] == "load"]
+    save_state(engine, DATA, to_load)
+    print(f"=== incremental load: {sum(plan['rows_staged'] for plan in to_load)} rows staged from {', '.join(plan['source'] for plan in to_load)} ===")
+    return plans
+
+if __name__ == "__main__":
+    run_incremental(get_engine())
@@ -0,0 +1,174 @@
+#producer / consumer loading of the staging tables
+#cleaned frames are split in chunks and put on a bounded queue, N writer threads (one connection each) COPY them into their table
+#so cleaning the next frame overlaps with loading the previous ones
+
+import os
+import time
+import queue
+import threading
+from typing import Dict, Optional
+
+import pandas as pd
+from sqlalchemy.engine import Engine
+
+from ETL.transformation.copy_writer import WRITE_METHOD, WRITE_METHODS, copy_df
+
+# writer threads, each one holds its own connection (CRA_LOAD_WRITERS environment variable)
+LOAD_WRITERS = int(os.environ.get("CRA_LOAD_WRITERS", 4))
+
+# chunks waiting on the queue, producers block when it is full so cleaned chunks never pile up in memory
+QUEUE_SIZE = 8
+
+# rows per chunk put on the queue (one COPY and one transaction per chunk)
+CHUNK_ROWS = 50_000
+
+# extra attempts for a chunk whose COPY fails, on a fresh connection
+RETRIES = 2
+
+def new_pipeline(engine: Engine, writers: int = LOAD_WRITERS, queue_size: int = QUEUE_SIZE, chunk_rows: int = CHUNK_ROWS, retries: int = RETRIES, method: Optional[str] = None) -> Dict:
+    """
+    Starts the writer threads and returns the pipeline state used by submit_frame / close_pipeline
+
+    method is "copy" or "insert" like write_df_to_table (WRITE_METHOD when None)
+    writers must be at least 1, the loaders write without a pipeline when they are given writers = 0
+    """
+    if writers < 1:
+        raise ValueError(f"a load pipeline needs at least one writer, got writers = {writers}")
+    method = method or WRITE_METHOD
+    if method not in WRITE_METHODS:
+        raise ValueError(f"unknown write method {method}, expected one of {WRITE_METHODS}")
+
+    pipeline = {
+        "engine": engine,
+        "method": method,
+        "queue": queue.Queue(maxsize=queue_size),
+        "chunk_rows": chunk_rows,
+        "retries": retries,
+        "lock": threading.Lock(),
+        "tables": set(),
+        "rows": {},
+        "chunks": 0,
+        "write_seconds": 0.0,
+        "failures": [],
+        "start": time.perf_counter(),
+    }
+    pipeline["threads"] = [
+        threading.Thread(target=writer_loop, args=(pipeline,), name=f"staging-writer-{i}", daemon=True)
+        for i in range(writers)
+    ]
+    for thread in pipeline["threads"]:
+        thread.start()
+    return pipeline
+
+def write_chunk(conn, table_name: str, chunk: pd.DataFrame, method: str) -> None:
+    # one transaction per chunk so a failed chunk never rolls back the chunks written before it
+    with conn.begin():
+        if method == "insert":
+            chunk.to_sql(table_name, conn, if_exists="append", index=False, method="multi", chunksize=5000)
+        else:
+            copy_df(conn, chunk, table_name)
+
+def close_quietly(conn) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+def writer_loop(pipeline: Dict) -> None:
+    # body of each writer thread: takes chunks off the queue until it gets None, a chunk that keeps failing is recorded (close_pipeline raises) and skipped
+    engine = pipeline["engine"]
+    conn = None
+    try:
+        while True:
+            item = pipeline["queue"].get()
+            if item is None:
+                pipeline["queue"].task_done()
+                break
+
+            table_name, chunk_id, chunk = item
+            start = time.perf_counter()
+            error = None
+            for attempt in range(pipeline["retries"] + 1):
+                try:
+                    if conn is None:
+                        conn = engine.connect()
+                    write_chunk(conn, table_name, chunk, pipeline["method"])
+                    error = None
+                    break
+                except Exception as e:
+                    # the connection may be broken, the next attempt opens a new one
+                    error = e
+                    if conn is not None:
+                        close_quietly(conn)
+                    conn = None
+
+            with pipeline["lock"]:
+                pipeline["write_seconds"] += time.perf_counter() - start
+                if error is None:
+                    pipeline["rows"][table_name] = pipeline["rows"].get(table_name, 0) + len(chunk)
+                    pipeline["chunks"] += 1
+                else:
+                    print(f"[load_pipeline] chunk {chunk_id} of {table_name} failed after {pipeline['retries'] + 1} attempts: {error}")
+                    pipeline["failures"].append({"table": table_name, "chunk": chunk_id, "rows": len(chunk), "error": str(error)})
+            pipeline["queue"].task_done()
+    finally:
+        if conn is not None:
+            close_quietly(conn)
+
+def submit_frame(pipeline: Dict, df: Optional[pd.DataFrame], table_name: str) -> int:
+    """
+    Splits df in chunks and puts them on the queue (blocks while the queue is full)
+
+    Returns:
+        number of chunks submitted
+    """
+    if df is None or df.empty:
+        print(f"[load_pipeline] for {table_name} is empty")
+        return 0
+
+    if table_name not in pipeline["tables"]:
+        # creates the table if it does not exist yet, same as write_df_to_table with if_exists = "append"
+        with pipeline["engine"].begin() as conn:
+            df.head(0).to_sql(table_name, conn, if_exists="append", index=False)
+        pipeline["tables"].add(table_name)
+
+    chunk_rows = pipeline["chunk_rows"]
+    chunks = 0
+    for chunk_id, start in enumerate(range(0, len(df), chunk_rows)):
+        pipeline["queue"].put((table_name, chunk_id, df.iloc[start:start + chunk_rows]))
+        chunks += 1
+    return chunks
+
+def close_pipeline(pipeline: Dict, raise_on_failure: bool = True) -> Dict:
+    """
+    Waits for every submitted chunk to be written, stops the writer threads and returns the load report
+
+    Raises RuntimeError (after the report is printed) when a chunk could not be written, the staging tables are then incomplete
+    raise_on_failure=False only prints it, used when the load already failed so its own error is the one raised
+
+    Returns:
+        dict with rows per table, chunks written, seconds spent writing (summed over writers), failed chunks (table, chunk, rows, error) and seconds
+    """
+    for _ in pipeline["threads"]:
+        pipeline["queue"].put(None)
+    for thread in pipeline["threads"]:
+        thread.join()
+
+    report = {
+        "rows": dict(pipeline["rows"]),
+        "chunks": pipeline["chunks"],
+        "write_seconds": pipeline["write_seconds"],
+        "failures": list(pipeline["failures"]),
+        "seconds": time.perf_counter() - pipeline["start"],
+    }
+    for table_name, rows in sorted(report["rows"].items()):
+        print(f"[load_pipeline] inserted {rows} rows inside {table_name}")
+    print(f"[load_pipeline] {report['chunks']} chunks written by {len(pipeline['threads'])} writers in {report['seconds']:.2f}s")
+    if report["failures"]:
+        failed_rows = sum(f["rows"] for f in report["failures"])
+        tables = ", ".join(sorted({f["table"] for f in report["failures"]}))
+        message = f"[load_pipeline] {len(report['failures'])} chunks ({failed_rows} rows) of {tables} were not loaded, first error: {report['failures'][0]['error']}"
+        if raise_on_failure:
+            raise RuntimeError(message)
+        print(message)
+    return report
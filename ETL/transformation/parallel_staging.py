@@ -0,0 +1,190 @@
+#populate staging tables with the four ingestion branches cleaned in parallel
+# python -m ETL.transformation.parallel_staging
+
+import os
+import time
+import random
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional, Dict, List, Iterator
+
+import pandas as pd
+import pyarrow as pa
+from ETL.db import get_engine
+from sqlalchemy.engine import Engine
+
+from ETL.ingestion.data_ingestion_kaggle import (
+    initialize_data_path,
+    ensure_kaggle_sources,
+    open_kaggle_source,
+    kaggle_accepted_loans_chunks,
+    kaggle_rejected_loans_chunks,
+)
+from ETL.ingestion.data_ingestion_hdma import clean_hdma_accepted, clean_hdma_rejected
+from ETL.ingestion.imputation import stats_path as imputer_stats_path
+from ETL.ingestion.sampling import pushdown_rows
+from ETL.transformation.staging_loader import staging_frame
+from ETL.transformation.load_pipeline import LOAD_WRITERS, new_pipeline, submit_frame, close_pipeline
+
+#folder inside 'training data' where the workers leave their cleaned frames as Arrow IPC files
+IPC_DIR = "ipc"
+
+#ingestion branch -> staging table it fills
+BRANCHES = {
+    "kaggle_accepted": "staging_accepted_kaggle",
+    "kaggle_rejected": "staging_rejected_kaggle",
+    "hdma_accepted": "staging_accepted_hdma",
+    "hdma_rejected": "staging_rejected_hdma",
+}
+
+#helpers -----------
+def clean_branch_chunks(branch: str, data_path: Path, sample: bool, seed: int, reuse_stats: bool, pushdown: bool) -> Iterator[pd.DataFrame]:
+    # cleaned chunks of a branch, the Kaggle sources are streamed and the HDMA cleaners return one frame
+    if branch.startswith("kaggle"):
+        name = branch.split("_")[1]
+        sample_rows = pushdown_rows() if sample and pushdown else None
+        if sample_rows is not None:
+            reuse_stats = True
+        kaggle_csvs = open_kaggle_source(data_path, name, sample_rows=sample_rows, seed=seed)
+        clean = kaggle_accepted_loans_chunks if name == "accepted" else kaggle_rejected_loans_chunks
+        return clean(kaggle_csvs, sample_csv=sample, seed=seed, stats_path=imputer_stats_path(data_path, branch), reuse_stats=reuse_stats)
+
+    clean = clean_hdma_accepted if branch == "hdma_accepted" else clean_hdma_rejected
+    df = clean(data_path, sample=sample, seed=seed, reuse_stats=reuse_stats, pushdown=pushdown)
+    if df is None:
+        raise RuntimeError(f"{branch} returned no dataframe")
+    return iter([df])
+
+def write_ipc(df: pd.DataFrame, path: Path) -> None:
+    # uncompressed IPC file so the parent can memory map it instead of copying it
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp_path = path.with_suffix(".tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def read_ipc_chunks(path: Path, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    # the table read from the memory map points into the file, only the slice being queued is converted to pandas
+    with pa.memory_map(str(path), "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+        for start in range(0, table.num_rows, chunk_rows):
+            yield table.slice(start, chunk_rows).to_pandas()
+
+def run_branch(branch: str, data_path: Path, sample: bool, seed: int, reuse_stats: bool, pushdown: bool) -> Dict:
+    """
+    Worker entry point: cleans one branch and writes the staging columns of each cleaned chunk to its own Arrow IPC file
+    (the dtypes of the chunks can differ), only the paths and the timings are sent back to the parent process
+    """
+    start = time.perf_counter()
+    out_dir = data_path / IPC_DIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    paths, rows = [], 0
+    try:
+        for i, chunk in enumerate(clean_branch_chunks(branch, data_path, sample, seed, reuse_stats, pushdown)):
+            path = out_dir / f"{branch}-{os.getpid()}-{i}.arrow"
+            # invalid rows are dropped here so they are neither written to the IPC file nor sent to staging
+            write_ipc(staging_frame(chunk, BRANCHES[branch]), path)
+            paths.append(str(path))
+            rows += len(chunk)
+    except BaseException:
+        for path in paths:
+            Path(path).unlink(missing_ok=True)
+        raise
+
+    return {"branch": branch, "paths": paths, "rows": rows, "clean_seconds": time.perf_counter() - start}
+
+def queue_branch(pipeline: Dict, result: Dict) -> Dict:
+    # memory maps the worker's IPC files and puts their rows on the load pipeline one chunk at a time, each file is removed once its chunks are queued
+    start = time.perf_counter()
+    try:
+        for path in result["paths"]:
+            for chunk in read_ipc_chunks(Path(path), pipeline["chunk_rows"]):
+                submit_frame(pipeline, chunk, BRANCHES[result["branch"]])
+            Path(path).unlink(missing_ok=True)
+    finally:
+        for path in result["paths"]:
+            Path(path).unlink(missing_ok=True)
+    result["queue_seconds"] = time.perf_counter() - start
+    return result
+
+def print_report(results: List[Dict], load_report: Dict, wall_seconds: float) -> None:
+    print("[parallel_staging] branch            rows    clean s   queue s   loaded")
+    for r in sorted(results, key=lambda r: r["branch"]):
+        loaded = load_report["rows"].get(BRANCHES[r["branch"]], 0)
+        print(f"[parallel_staging] {r['branch']:<16} {r['rows']:>8} {r['clean_seconds']:>9.2f} {r['queue_seconds']:>9.2f} {loaded:>8}")
+
+    # time the same work would take one step after the other: every clean plus every chunk write
+    total = sum(r["clean_seconds"] + r["queue_seconds"] for r in results) + load_report["write_seconds"]
+    slowest = max((r["clean_seconds"] for r in results), default=0.0)
+    speedup = total / wall_seconds if wall_seconds else 0.0
+    print(f"[parallel_staging] wall {wall_seconds:.2f}s, sequential {total:.2f}s (writes {load_report['write_seconds']:.2f}s), slowest clean {slowest:.2f}s, speedup x{speedup:.2f}")
+
+# load staging -------------
+def load_staging_parallel(sample: bool = True, seed: int = 0, engine: Optional[Engine] = None, reuse_stats: bool = False, pushdown: bool = True, max_workers: Optional[int] = None, writers: int = LOAD_WRITERS,) -> List[Dict]:
+    """
+    Cleans the Kaggle and HDMA accepted/rejected branches in separate worker processes and loads each staging table as soon as its branch is done
+
+    Params:
+        sample, seed, reuse_stats, pushdown : same as load_kaggle_staging / load_hdma_staging
+        engine : database engine, only used in the parent process
+        max_workers (None as default) : worker processes, one per branch (capped by the number of cores) when None
+        writers (LOAD_WRITERS as default) : connections writing the cleaned chunks, at least 1 (see load_pipeline.py)
+
+    Returns:
+        list of per branch reports (rows, clean_seconds, queue_seconds)
+
+    Raises RuntimeError once the other branches are loaded when a branch failed
+    """
+    if engine is None:
+        engine = get_engine()
+
+    # one seed for every branch so the run can be replicated, same as the sequential loaders
+    if sample and seed == 0:
+        seed = random.randint(1, 999)
+        print(f"[parallel_staging] Random seed to replicate the samples: {seed}")
+
+    data_path = initialize_data_path()
+    # download once in the parent so the workers never download the dataset at the same time
+    ensure_kaggle_sources(data_path)
+
+    if max_workers is None:
+        max_workers = min(len(BRANCHES), os.cpu_count() or 1)
+
+    results, failed = [], []
+    wall_start = time.perf_counter()
+    # each branch is queued on the load pipeline as soon as it is cleaned, while the other branches are still running
+    pipeline = new_pipeline(engine, writers)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(run_branch, branch, data_path, sample, seed, reuse_stats, pushdown): branch
+                for branch in BRANCHES
+            }
+            for future in as_completed(futures):
+                branch = futures[future]
+                try:
+                    results.append(queue_branch(pipeline, future.result()))
+                except Exception as e:
+                    # the other branches are still loaded, the run fails once they are done
+                    print(f"[parallel_staging] {branch} failed: {e}")
+                    failed.append(branch)
+    except BaseException:
+        # the writers are stopped without raising, so the error that stopped the load is the one that goes up
+        close_pipeline(pipeline, raise_on_failure=False)
+        raise
+    load_report = close_pipeline(pipeline)
+
+    print_report(results, load_report, time.perf_counter() - wall_start)
+    if failed:
+        raise RuntimeError(f"[parallel_staging] {', '.join(sorted(failed))} failed, their staging tables are incomplete")
+    return results
+
+if __name__ == "__main__":
+    engine = get_engine()
+
+    print("=== Loading staging tables in parallel ===")
+    load_staging_parallel(sample=True, seed=42, engine=engine)
+
+    print("=== All staging tables populated ===")
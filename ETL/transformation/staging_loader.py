@@ -1,87 +1,148 @@
 #populate staging tables
 # python -m ETL.transformation.staging_loader (run ONCE)
 
-from sqlalchemy import create_engine
+from ETL.db import get_engine
 from sqlalchemy.engine import Engine
 import pandas as pd
-from typing import Optional, Dict
+import os
+import random
+from typing import Optional, Dict, Tuple
 
 from ETL.ingestion.data_ingestion_kaggle import (
     initialize_data_path as kaggle_data_path,
     retrieve_training_csv,
-    kaggle_accepted_loans_df,
-    kaggle_rejected_loans_df,
+    kaggle_accepted_loans_chunks,
+    kaggle_rejected_loans_chunks,
 )
 from ETL.ingestion.data_ingestion_hdma import (
     initialize_data_path as hdma_data_path,
     clean_hdma_accepted,
     clean_hdma_rejected,
 )
+from ETL.ingestion.imputation import stats_path as imputer_stats_path
+from ETL.ingestion.sampling import pushdown_rows
+from ETL.transformation.copy_writer import write_rows
+from ETL.transformation.load_pipeline import LOAD_WRITERS, new_pipeline, submit_frame, close_pipeline
+from ETL.transformation.validation_rules import drop_invalid_rows
+
+#columns written to each staging table
+STAGING_COLUMNS = {
+    "staging_accepted_kaggle": ["id","loan_amnt","funded_amnt","term_months","int_rate","installment","annual_inc","dti","delinq_2yrs","fico_range_low","fico_range_high","inq_last_6mths","open_acc","revol_bal","revol_util","total_acc","pub_rec_bankruptcies","home_ownership","loan_status","purpose","application_type","verification_status"],
+    "staging_rejected_kaggle": ["Amount Requested","Application Date","Loan Title","Debt-To-Income Ratio",],
+    "staging_accepted_hdma": ['activity_year', 'action_taken', 'preapproval', 'loan_purpose', 'loan_amount', 'loan_term', 'applicant_credit_score_type',
+        'co_applicant_credit_score_type' , 'loan_to_value_ratio', 'income', 'debt_to_income_ratio',
+        'derived_loan_product_type',],
+    "staging_rejected_hdma": ["activity_year","action_taken","preapproval","loan_purpose","loan_amount","loan_term","loan_to_value_ratio","income","debt_to_income_ratio","derived_loan_product_type","applicant_credit_score_type","co_applicant_credit_score_type","denial_reason_1",],
+}
+
+# drop the rows the valid_* views would reject before they are sent to staging (set CRA_PREFILTER=0 to stage every cleaned row)
+PREFILTER = os.environ.get("CRA_PREFILTER", "1") != "0"
 
 #helpers -----------
+def staging_frame(df: pd.DataFrame, table_name: str, prefilter: bool = PREFILTER) -> pd.DataFrame:
+    # staging columns of a cleaned frame, without the rows that fail the validation rules of the table when prefilter
+    df = df[STAGING_COLUMNS[table_name]]
+    return drop_invalid_rows(df, table_name) if prefilter else df
+
 #ret num of rows
-def write_df_to_table(engine: Engine, df: pd.DataFrame, table_name: str, if_exists: str = "append", chunksize: int = 5000,) -> int:
+def write_df_to_table(engine: Engine, df: pd.DataFrame, table_name: str, if_exists: str = "append", chunksize: int = 5000, method: Optional[str] = None,) -> int:
+    # method: "copy" or "insert", WRITE_METHOD (CRA_WRITE_METHOD environment variable) when None
     if df is None or df.empty:
         print(f"[staging_loader] for {table_name} is empty")
         return 0
 
     with engine.begin() as conn:
-        df.to_sql(table_name, conn, if_exists=if_exists, index=False, method="multi", chunksize=chunksize,)
+        write_rows(conn, df, table_name, if_exists, chunksize, method)
 
     return len(df)
 
+def stage_frame(engine: Engine, pipeline: Optional[Dict], df: pd.DataFrame, table_name: str) -> int:
+    # queues df on the load pipeline when there is one (written while the next frame is cleaned), else writes it right away
+    if pipeline is None:
+        return write_df_to_table(engine, df, table_name, "append", 5000)
+    submit_frame(pipeline, df, table_name)
+    return 0 if df is None else len(df)
+
+def stage_chunks(engine: Engine, pipeline: Optional[Dict], chunks, table_name: str) -> Tuple[int, int]:
+    # stages each cleaned chunk as it is produced, returns (cleaned rows, rows sent to table_name)
+    cleaned, sent = 0, 0
+    for chunk in chunks:
+        cleaned += len(chunk)
+        sent += stage_frame(engine, pipeline, staging_frame(chunk, table_name), table_name)
+    return cleaned, sent
+
 # load staging -------------
-def load_kaggle_staging(sample: bool = True, seed: int = 0, engine: Optional[Engine] = None,) -> None:
+def load_kaggle_staging(sample: bool = True, seed: int = 0, engine: Optional[Engine] = None, reuse_stats: bool = False, pushdown: bool = True, writers: int = LOAD_WRITERS,) -> None:
+    # writers: connections of the load pipeline (see load_pipeline.py), 0 writes each cleaned chunk in its own transaction right away
     if engine is None:
-        engine = create_engine("postgresql+psycopg2:///credit_risk")
-
-    kaggle_csvs = retrieve_training_csv(kaggle_data_path())
-
-    accepted_df = kaggle_accepted_loans_df(kaggle_csvs, sample_csv=sample, seed=seed)
-    rejected_df = kaggle_rejected_loans_df(kaggle_csvs, sample_csv=sample, seed=seed)
-
-    print(f"[staging_loader] Kaggle accepted rows: {len(accepted_df)}")
-    print(f"[staging_loader] Kaggle rejected rows: {len(rejected_df)}")
-
-    accepted_cols = ["id","loan_amnt","funded_amnt","term_months","int_rate","installment","annual_inc","dti","delinq_2yrs","fico_range_low","fico_range_high","inq_last_6mths","open_acc","revol_bal","revol_util","total_acc","pub_rec_bankruptcies","home_ownership","loan_status","purpose","application_type","verification_status"]
-    rejected_cols = ["Amount Requested","Application Date","Loan Title","Debt-To-Income Ratio",]
-
-    accepted_stage = accepted_df[accepted_cols].copy()
-    inserted_accepted = write_df_to_table(engine, accepted_stage, "staging_accepted_kaggle", "append", 5000)
-    print(f"[staging_loader] inserted {inserted_accepted} rows inside staging_accepted_kaggle")
-
-    rejected_stage = rejected_df[rejected_cols].copy()
-    inserted_rejected = write_df_to_table(engine,rejected_stage,table_name="staging_rejected_kaggle",if_exists="append",chunksize=5000,)
-    print(f"[staging_loader] inserted {inserted_rejected} rows inside staging_rejected_kaggle")
-
-def load_hdma_staging(sample: bool = True,seed: int = 0,engine: Optional[Engine] = None,) -> None:
+        engine = get_engine()
+
+    # sample while reading (pushdown) so only the sampled rows get cleaned, full run imputation stats are reused when saved
+    sample_rows = None
+    if sample and pushdown:
+        if seed == 0:
+            seed = random.randint(1, 999)
+            print(f"[staging_loader] Random seed to replicate Kaggle sample: {seed}")
+        sample_rows = pushdown_rows()
+        reuse_stats = True
+
+    data_path = kaggle_data_path()
+    kaggle_csvs = retrieve_training_csv(data_path, sample_rows=sample_rows, seed=seed)
+    pipeline = new_pipeline(engine, writers) if writers else None
+
+    try:
+        # cleaned chunks are loaded as they are produced, the accepted rows while the rejected ones are cleaned
+        accepted_chunks = kaggle_accepted_loans_chunks(kaggle_csvs, sample_csv=sample, seed=seed, stats_path=imputer_stats_path(data_path, "kaggle_accepted"), reuse_stats=reuse_stats)
+        accepted_rows, inserted_accepted = stage_chunks(engine, pipeline, accepted_chunks, "staging_accepted_kaggle")
+        print(f"[staging_loader] Kaggle accepted rows: {accepted_rows}")
+        print(f"[staging_loader] sent {inserted_accepted} rows to staging_accepted_kaggle")
+
+        rejected_chunks = kaggle_rejected_loans_chunks(kaggle_csvs, sample_csv=sample, seed=seed, stats_path=imputer_stats_path(data_path, "kaggle_rejected"), reuse_stats=reuse_stats)
+        rejected_rows, inserted_rejected = stage_chunks(engine, pipeline, rejected_chunks, "staging_rejected_kaggle")
+        print(f"[staging_loader] Kaggle rejected rows: {rejected_rows}")
+        print(f"[staging_loader] sent {inserted_rejected} rows to staging_rejected_kaggle")
+    except BaseException:
+        # the writers are stopped without raising, so the error that stopped the load is the one that goes up
+        if pipeline is not None:
+            close_pipeline(pipeline, raise_on_failure=False)
+        raise
+    if pipeline is not None:
+        close_pipeline(pipeline)
+
+def load_hdma_staging(sample: bool = True,seed: int = 0,engine: Optional[Engine] = None,reuse_stats: bool = False,pushdown: bool = True, writers: int = LOAD_WRITERS,) -> None:
+    # writers: connections of the load pipeline (see load_pipeline.py), 0 writes each cleaned chunk in its own transaction right away
     if engine is None:
-        engine = create_engine("postgresql+psycopg2:///credit_risk")
-
-    accepted_df = clean_hdma_accepted(hdma_data_path(),sample=sample,seed=seed,)
-    rejected_df = clean_hdma_rejected(hdma_data_path(),sample=sample,seed=seed,)
-
-    print(f"[staging_loader] HDMA accepted rows: {len(accepted_df)}")
-    print(f"[staging_loader] HDMA rejected rows: {len(rejected_df)}")
-
-    accepted_cols = ['activity_year', 'action_taken', 'preapproval', 'loan_purpose', 'loan_amount', 'loan_term', 'applicant_credit_score_type',
-        'co_applicant_credit_score_type' , 'loan_to_value_ratio', 'income', 'debt_to_income_ratio',
-        'derived_loan_product_type',]
-    accepted_stage = accepted_df[accepted_cols].copy()
-    inserted_acc = write_df_to_table(engine,accepted_stage,table_name="staging_accepted_hdma",if_exists="append",chunksize=5000,)
-    print(f"[staging_loader] Inserted {inserted_acc} rows inside staging_accepted_hdma")
-
-    rejected_cols = ["activity_year","action_taken","preapproval","loan_purpose","loan_amount","loan_term","loan_to_value_ratio","income","debt_to_income_ratio","derived_loan_product_type","applicant_credit_score_type","co_applicant_credit_score_type","denial_reason_1",]
-    rejected_stage = rejected_df[rejected_cols].copy()
-
-    # print(rejected_stage.dtypes)
-    # print(rejected_stage[['loan_amount',loan_term','loan_to_value_ratio','income','debt_to_income_ratio']].describe())
-
-    inserted_rejec = write_df_to_table(engine,rejected_stage,table_name="staging_rejected_hdma",if_exists="append",chunksize=5000,)
-    print(f"[staging_loader] Inserted {inserted_rejec} rows inside staging_rejected_hdma")
+        engine = get_engine()
+
+    pipeline = new_pipeline(engine, writers) if writers else None
+
+    try:
+        # accepted rows are loaded while the rejected ones are cleaned
+        accepted_df = clean_hdma_accepted(hdma_data_path(),sample=sample,seed=seed,reuse_stats=reuse_stats,pushdown=pushdown,)
+        print(f"[staging_loader] HDMA accepted rows: {len(accepted_df)}")
+        accepted_stage = staging_frame(accepted_df, "staging_accepted_hdma")
+        inserted_acc = stage_frame(engine, pipeline, accepted_stage, "staging_accepted_hdma")
+        print(f"[staging_loader] sent {inserted_acc} rows to staging_accepted_hdma")
+
+        rejected_df = clean_hdma_rejected(hdma_data_path(),sample=sample,seed=seed,reuse_stats=reuse_stats,pushdown=pushdown,)
+        print(f"[staging_loader] HDMA rejected rows: {len(rejected_df)}")
+        rejected_stage = staging_frame(rejected_df, "staging_rejected_hdma")
+
+        # print(rejected_stage.dtypes)
+        # print(rejected_stage[['loan_amount',loan_term','loan_to_value_ratio','income','debt_to_income_ratio']].describe())
+
+        inserted_rejec = stage_frame(engine, pipeline, rejected_stage, "staging_rejected_hdma")
+        print(f"[staging_loader] sent {inserted_rejec} rows to staging_rejected_hdma")
+    except BaseException:
+        # the writers are stopped without raising, so the error that stopped the load is the one that goes up
+        if pipeline is not None:
+            close_pipeline(pipeline, raise_on_failure=False)
+        raise
+    if pipeline is not None:
+        close_pipeline(pipeline)
 
 if __name__ == "__main__":
-    engine = create_engine("postgresql+psycopg2:///credit_risk")
+    engine = get_engine()
 
     print("=== Loading Kaggle staging tables ===")
     load_kaggle_staging(sample=True, seed=42, engine=engine)
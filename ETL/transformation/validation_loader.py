@@ -1,16 +1,68 @@
 #python -m ETL.transformation.validation_loader
-from sqlalchemy import create_engine
+from ETL.db import get_engine
 from sqlalchemy import text
 from sqlalchemy.engine import Engine
 import pandas as pd
-from typing import Optional, Dict
+from typing import Optional, Dict, List
+
+from ETL.transformation.validation_rules import where_sql
+
+# each valid_* relation is a materialized view: staging rows are filtered once per load and every consumer
+# (confirm_lengths, the mappings in ETL/load/mapping) reads the stored result
+VALID_VIEWS = ["valid_accepted_kaggle", "valid_rejected_kaggle", "valid_accepted_hdma", "valid_rejected_hdma"]
+
+# extra indexes per view on the columns the mappings join / filter on, every view also gets a unique index on staging_row_id
+VALID_INDEXES = {
+    "valid_accepted_kaggle": [["annual_inc", "dti", "fico_range_low", "fico_range_high"], ["loan_status"]],
+    "valid_rejected_kaggle": [],
+    "valid_accepted_hdma": [["income", "debt_to_income_ratio", "applicant_credit_score_type", "co_applicant_credit_score_type"]],
+    "valid_rejected_hdma": [["denial_reason_1"]],
+}
+
+RELKIND_DROP = {"v": "VIEW", "m": "MATERIALIZED VIEW", "r": "TABLE"}
+
+#helpers -----------
+def drop_relation(conn, name: str) -> None:
+    # older databases have the valid_* relations as plain views, DROP VIEW fails on a materialized view (and the other way around)
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = :name AND relnamespace = current_schema()::regnamespace"),
+        {"name": name},
+    ).scalar()
+    if relkind in RELKIND_DROP:
+        conn.execute(text(f"DROP {RELKIND_DROP[relkind]} {name}"))
+
+def index_valid(conn, name: str) -> None:
+    # the unique index is what REFRESH ... CONCURRENTLY needs
+    conn.execute(text(f"CREATE UNIQUE INDEX {name}_row_id ON {name} (staging_row_id)"))
+    for i, columns in enumerate(VALID_INDEXES[name]):
+        conn.execute(text(f"CREATE INDEX {name}_key_{i} ON {name} ({', '.join(columns)})"))
+    conn.execute(text(f"ANALYZE {name}"))
+
+def build_valid(engine: Engine, name: str, select_sql: str, source: str) -> None:
+    # the WHERE clause comes from the rules of the source staging table (validation_rules.py)
+    with engine.begin() as conn:
+        drop_relation(conn, name)
+        conn.execute(text(f"CREATE MATERIALIZED VIEW {name} AS {select_sql}    WHERE\n    {where_sql(source)};"))
+        index_valid(conn, name)
+
+def refresh_valid(engine: Engine, names: Optional[List[str]] = None, concurrently: bool = True) -> None:
+    """
+    Re-runs the validation of the given views (every valid_* view when None) against the current staging rows
+
+    concurrently keeps the views readable while they refresh, it needs a populated view so the first refresh of an empty one is a plain one
+    """
+    for name in names or VALID_VIEWS:
+        with engine.begin() as conn:
+            populated = conn.execute(text("SELECT ispopulated FROM pg_matviews WHERE matviewname = :name"), {"name": name}).scalar()
+            mode = "CONCURRENTLY " if concurrently and populated else ""
+            conn.execute(text(f"REFRESH MATERIALIZED VIEW {mode}{name}"))
+            conn.execute(text(f"ANALYZE {name}"))
+        print(f"[validation_loader] refreshed {mode}{name}")
 
 def create_valid_accepted_kaggle(engine: Engine) -> None:
-    sql = text("""
-        DROP VIEW IF EXISTS valid_accepted_kaggle;
-                
-        CREATE OR REPLACE VIEW valid_accepted_kaggle AS
+    select_sql = """
         SELECT
+            staging_row_id,
             id,
             loan_amnt,
             funded_amnt,
@@ -44,65 +96,26 @@ def create_valid_accepted_kaggle(engine: Engine) -> None:
         application_type
 
         FROM staging_accepted_kaggle
-        WHERE
-            id IS NOT NULL
-            AND loan_amnt > 1000
-            AND loan_amnt IS NOT NULL
-            AND term_months IN ('36','60')
-            AND funded_amnt <= loan_amnt
-            AND int_rate BETWEEN 0 AND 30
-            AND installment > 0
-            AND installment < funded_amnt
-            AND dti BETWEEN 0 AND 35
-            AND delinq_2yrs BETWEEN 0 AND 20
-            AND annual_inc BETWEEN 0 AND 3000000
-            AND fico_range_low BETWEEN 300 AND 850 
-            AND fico_range_high BETWEEN 300 AND 850
-            AND fico_range_low <= fico_range_high
-            AND inq_last_6mths BETWEEN 0 AND 20
-            AND open_acc BETWEEN 0 AND 15
-            AND total_acc BETWEEN 0 AND 20
-            AND revol_bal >= 0
-            AND revol_util BETWEEN 0 AND 100
-            AND pub_rec_bankruptcies BETWEEN 0 AND 5
-            AND home_ownership NOT IN ('NONE', 'OTHER')
-            AND loan_status IS NOT NULL
-            AND purpose IS NOT NULL;
-    """)
-    with engine.begin() as conn:
-        conn.execute(sql)
+    """
+    build_valid(engine, "valid_accepted_kaggle", select_sql, "staging_accepted_kaggle")
 
 def create_valid_rejected_kaggle(engine: Engine) -> None:
-    sql = text("""
-    DROP VIEW IF EXISTS valid_rejected_kaggle;           
-
-    CREATE OR REPLACE VIEW valid_rejected_kaggle AS
+    select_sql = """
     SELECT
+        staging_row_id,
         "Amount Requested",
         "Application Date",
         "Loan Title",
         "Debt-To-Income Ratio"
         
     FROM staging_rejected_kaggle
-    WHERE 
-        "Amount Requested" IS NOT NULL
-        AND "Amount Requested" > 0
-        AND "Application Date" IS NOT NULL
-        AND "Loan Title" IS NOT NULL
-        AND "Debt-To-Income Ratio" <> ''
-        AND NULLIF("Debt-To-Income Ratio", '')::NUMERIC BETWEEN 0 AND 35;    
-    
-    """)
-
-    with engine.begin() as conn:
-        conn.execute(sql)
+    """
+    build_valid(engine, "valid_rejected_kaggle", select_sql, "staging_rejected_kaggle")
 
 def create_valid_accepted_hdma(engine: Engine) -> None:
-    sql = text("""
-    DROP VIEW IF EXISTS valid_accepted_hdma;           
-
-    CREATE OR REPLACE VIEW valid_accepted_hdma AS
+    select_sql = """
     SELECT
+        staging_row_id,
         loan_amount,
         loan_term, 
         interest_rate,
@@ -139,42 +152,13 @@ def create_valid_accepted_hdma(engine: Engine) -> None:
         loan_purpose
 
     FROM staging_accepted_hdma
-    WHERE
-        loan_amount IS NOT NULL
-        AND loan_amount > 1000
-        AND loan_term > 0
-        AND income BETWEEN 0 AND 3000000
-        AND debt_to_income_ratio <> ''
-        AND debt_to_income_ratio IS NOT NULL
-        AND applicant_credit_score_type IN ('1','2','3','4','5','6','7','8','9','11','1111')
-        AND co_applicant_credit_score_type IN ('1','2','3','4','5','6','7','8','9','10','11','1111')
-        AND activity_year = 2023
-        AND action_taken = 1
-        AND preapproval IN (1,2)
-        AND loan_to_value_ratio BETWEEN 0 AND 130
-        AND derived_loan_product_type IN (
-            'Conventional:First Lien',
-            'Conventional:Subordinate Lien',
-            'FHA:First Lien',
-            'FHA:Subordinate Lien',
-            'VA:First Lien',
-            'VA:Subordinate Lien',
-            'FSA/RHS:First Lien',
-            'FSA/RHS:Subordinate Lien'
-        )
-        AND loan_purpose <> ''
-        AND loan_purpose IS NOT NULL;
-    """)
-
-    with engine.begin() as conn:
-        conn.execute(sql)
+    """
+    build_valid(engine, "valid_accepted_hdma", select_sql, "staging_accepted_hdma")
 
 def create_valid_rejected_hdma(engine: Engine) -> None:
-    sql = text("""
-    DROP VIEW IF EXISTS valid_rejected_hdma;           
-
-    CREATE OR REPLACE VIEW valid_rejected_hdma AS
+    select_sql = """
     SELECT
+        staging_row_id,
         activity_year,
         action_taken,      
         preapproval,
@@ -220,37 +204,30 @@ def create_valid_rejected_hdma(engine: Engine) -> None:
         END AS denial_reason_1
 
     FROM staging_rejected_hdma
-    WHERE 
-        activity_year = 2023
-        AND action_taken = 3     
-        AND preapproval IN (1,2)
-        AND loan_purpose <> ''
-        AND loan_purpose IS NOT NULL
-        AND loan_amount IS NOT NULL
-        AND loan_amount > 0
-        AND loan_term > 0
-        AND loan_to_value_ratio > 0
-        AND income BETWEEN 0 AND 3000000
-        AND debt_to_income_ratio <> ''
-        AND debt_to_income_ratio IS NOT NULL
-        AND derived_loan_product_type IS NOT NULL
-        AND derived_loan_product_type IN (
-            'Conventional:First Lien',
-            'Conventional:Subordinate Lien',
-            'FHA:First Lien',
-            'FHA:Subordinate Lien',
-            'VA:First Lien',
-            'VA:Subordinate Lien',
-            'FSA/RHS:First Lien',
-            'FSA/RHS:Subordinate Lien'
-        )
-        AND applicant_credit_score_type IN ('1','2','3','4','5','6','7','8','9','1111')
-        AND co_applicant_credit_score_type IN ('1','2','3','4','5','6','7','8','9','10','1111')
-        AND denial_reason_1 IN ('1','2','3','4','5','6','7','8','9','10');
-    """)
+    """
+    build_valid(engine, "valid_rejected_hdma", select_sql, "staging_rejected_hdma")
 
-    with engine.begin() as conn:
-        conn.execute(sql)
+# valid_* view -> function that creates it
+CREATE_VALID = {
+    "valid_accepted_kaggle": create_valid_accepted_kaggle,
+    "valid_rejected_kaggle": create_valid_rejected_kaggle,
+    "valid_accepted_hdma": create_valid_accepted_hdma,
+    "valid_rejected_hdma": create_valid_rejected_hdma,
+}
+
+def update_valid(engine: Engine, names: Optional[List[str]] = None) -> None:
+    """
+    Refreshes the given valid_* views (every one when None) that already exist as materialized views and creates the missing ones
+
+    A refresh keeps the WHERE clause the view was created with, a full run (run_etl.py) recreates them from the current rules
+    """
+    names = names or VALID_VIEWS
+    with engine.connect() as conn:
+        existing = {row[0] for row in conn.execute(text("SELECT matviewname FROM pg_matviews WHERE schemaname = current_schema()"))}
+    refresh_valid(engine, [name for name in names if name in existing])
+    for name in names:
+        if name not in existing:
+            CREATE_VALID[name](engine)
 
 def confirm_lengths(engine: Engine) -> None:
     queries = {
@@ -266,7 +243,7 @@ def confirm_lengths(engine: Engine) -> None:
             print(f"{name} size -> {result}")
 
 if __name__ == "__main__":
-    engine = create_engine("postgresql+psycopg2:///credit_risk")
+    engine = get_engine()
     try:
         print("=== Loading VALID Kaggle accepted table ===")
         create_valid_accepted_kaggle(engine)
@@ -0,0 +1,218 @@
+#validity rules of the staging tables, written once and compiled to
+# - the SQL WHERE clause of the valid_* materialized views (validation_loader.py)
+# - vectorized NumPy masks, so invalid rows are dropped in pandas before they are sent to staging
+#masks follow SQL semantics: a comparison against a NULL / NaN value rejects the row
+
+import operator
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ETL.ingestion.dtype_plan import table_schema, SQL_INT_WIDTHS, SQL_TEXT_TYPES
+from ETL.ingestion.data_ingestion_hdma import HDMA_ACTIVITY_YEAR, HDMA_PRODUCT_TYPES
+
+COMPARISONS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le, "=": operator.eq, "<>": operator.ne}
+
+#rule spec -----------
+def rule(column: str, op: str, value=None, cast: Optional[str] = None) -> Dict:
+    """
+    Params:
+        column : staging column the rule checks
+        op : "not_null", "between" (value = (low, high)), "in" / "not_in" (value = list) or one of COMPARISONS
+        value : constant, or column_ref(name) to compare two columns of the same row
+        cast (None as default) : "numeric" for TEXT columns compared as numbers (NULLIF(column, '')::NUMERIC)
+    """
+    if op not in ("not_null", "between", "in", "not_in") and op not in COMPARISONS:
+        raise ValueError(f"unknown rule operator {op}")
+    return {"column": column, "op": op, "value": value, "cast": cast}
+
+def column_ref(name: str) -> Dict:
+    return {"column_ref": name}
+
+# staging table -> rules a row needs to pass to reach its valid_* view
+VALIDATION_RULES = {
+    "staging_accepted_kaggle": [
+        rule("id", "not_null"),
+        rule("loan_amnt", ">", 1000),
+        rule("loan_amnt", "not_null"),
+        rule("term_months", "in", ["36", "60"]),
+        rule("funded_amnt", "<=", column_ref("loan_amnt")),
+        rule("int_rate", "between", (0, 30)),
+        rule("installment", ">", 0),
+        rule("installment", "<", column_ref("funded_amnt")),
+        rule("dti", "between", (0, 35)),
+        rule("delinq_2yrs", "between", (0, 20)),
+        rule("annual_inc", "between", (0, 3000000)),
+        rule("fico_range_low", "between", (300, 850)),
+        rule("fico_range_high", "between", (300, 850)),
+        rule("fico_range_low", "<=", column_ref("fico_range_high")),
+        rule("inq_last_6mths", "between", (0, 20)),
+        rule("open_acc", "between", (0, 15)),
+        rule("total_acc", "between", (0, 20)),
+        rule("revol_bal", ">=", 0),
+        rule("revol_util", "between", (0, 100)),
+        rule("pub_rec_bankruptcies", "between", (0, 5)),
+        rule("home_ownership", "not_in", ["NONE", "OTHER"]),
+        rule("loan_status", "not_null"),
+        rule("purpose", "not_null"),
+    ],
+    "staging_rejected_kaggle": [
+        rule("Amount Requested", "not_null"),
+        rule("Amount Requested", ">", 0),
+        rule("Application Date", "not_null"),
+        rule("Loan Title", "not_null"),
+        rule("Debt-To-Income Ratio", "<>", ""),
+        rule("Debt-To-Income Ratio", "between", (0, 35), cast="numeric"),
+    ],
+    "staging_accepted_hdma": [
+        rule("loan_amount", "not_null"),
+        rule("loan_amount", ">", 1000),
+        rule("loan_term", ">", 0),
+        rule("income", "between", (0, 3000000)),
+        rule("debt_to_income_ratio", "not_null"),
+        rule("applicant_credit_score_type", "in", ["1", "2", "3", "4", "5", "6", "7", "8", "9", "11", "1111"]),
+        rule("co_applicant_credit_score_type", "in", ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "1111"]),
+        rule("activity_year", "=", HDMA_ACTIVITY_YEAR),
+        rule("action_taken", "=", 1),
+        rule("preapproval", "in", [1, 2]),
+        rule("loan_to_value_ratio", "between", (0, 130)),
+        rule("derived_loan_product_type", "in", HDMA_PRODUCT_TYPES),
+        rule("loan_purpose", "<>", ""),
+        rule("loan_purpose", "not_null"),
+    ],
+    "staging_rejected_hdma": [
+        rule("activity_year", "=", HDMA_ACTIVITY_YEAR),
+        rule("action_taken", "=", 3),
+        rule("preapproval", "in", [1, 2]),
+        rule("loan_purpose", "<>", ""),
+        rule("loan_purpose", "not_null"),
+        rule("loan_amount", "not_null"),
+        rule("loan_amount", ">", 0),
+        rule("loan_term", ">", 0),
+        rule("loan_to_value_ratio", ">", 0),
+        rule("income", "between", (0, 3000000)),
+        rule("debt_to_income_ratio", "not_null"),
+        rule("derived_loan_product_type", "not_null"),
+        rule("derived_loan_product_type", "in", HDMA_PRODUCT_TYPES),
+        rule("applicant_credit_score_type", "in", ["1", "2", "3", "4", "5", "6", "7", "8", "9", "1111"]),
+        rule("co_applicant_credit_score_type", "in", ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "1111"]),
+        rule("denial_reason_1", "in", ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10"]),
+    ],
+}
+
+#SQL -----------
+def sql_literal(value) -> str:
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+def sql_operand(name: str, cast: Optional[str] = None) -> str:
+    column = '"' + name.replace('"', '""') + '"'
+    return f"NULLIF({column}, '')::NUMERIC" if cast == "numeric" else column
+
+def rule_sql(r: Dict) -> str:
+    column = sql_operand(r["column"], r["cast"])
+    op, value = r["op"], r["value"]
+    if op == "not_null":
+        return f"{column} IS NOT NULL"
+    if op == "between":
+        return f"{column} BETWEEN {sql_literal(value[0])} AND {sql_literal(value[1])}"
+    if op in ("in", "not_in"):
+        keyword = "IN" if op == "in" else "NOT IN"
+        return f"{column} {keyword} ({', '.join(sql_literal(v) for v in value)})"
+    if isinstance(value, dict):
+        return f"{column} {op} {sql_operand(value['column_ref'])}"
+    return f"{column} {op} {sql_literal(value)}"
+
+def where_sql(table: str) -> str:
+    # WHERE clause (without the keyword) of the valid_* view built from table
+    return "\n    AND ".join(rule_sql(r) for r in VALIDATION_RULES[table])
+
+#masks -----------
+def numeric_values(series: pd.Series, column_type: Optional[Dict], cast: Optional[str] = None) -> np.ndarray:
+    # float64 values as postgres stores them: NUMERIC(p, s) rounded to s decimals, integer columns rounded to units
+    if cast == "numeric":
+        series = series.astype(object).where(series.astype(object) != "")
+    values = pd.to_numeric(series, errors="coerce").astype("float64").to_numpy(dtype="float64", na_value=np.nan)
+    if column_type is not None and cast is None:
+        if column_type["type"] in SQL_INT_WIDTHS:
+            values = np.round(values)
+        elif column_type["scale"] is not None:
+            values = np.round(values, column_type["scale"])
+    return values
+
+def text_values(series: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    # values as they are written to a TEXT column, plus the not null mask
+    return series.astype(str).to_numpy(dtype=object), series.notna().to_numpy()
+
+def rule_mask(df: pd.DataFrame, r: Dict, schema: Dict) -> np.ndarray:
+    """
+    Boolean array, True for the rows of df that pass the rule
+    """
+    column_type = schema.get(r["column"])
+    is_text = r["cast"] is None and column_type is not None and column_type["type"] in SQL_TEXT_TYPES
+    op, value = r["op"], r["value"]
+    series = df[r["column"]]
+
+    if op == "not_null":
+        if is_text:
+            return series.notna().to_numpy()
+        return ~np.isnan(numeric_values(series, column_type, r["cast"]))
+
+    if is_text:
+        values, present = text_values(series)
+        if op in ("in", "not_in"):
+            found = np.isin(values, [str(v) for v in value])
+            return present & (found if op == "in" else ~found)
+        if isinstance(value, dict):
+            other, other_present = text_values(df[value["column_ref"]])
+            return present & other_present & COMPARISONS[op](values, other)
+        return present & COMPARISONS[op](values, str(value)).astype(bool)
+
+    # numeric comparisons against NaN are False, the same as a NULL in a SQL WHERE
+    values = numeric_values(series, column_type, r["cast"])
+    with np.errstate(invalid="ignore"):
+        if op == "between":
+            return (values >= value[0]) & (values <= value[1])
+        if op in ("in", "not_in"):
+            found = np.isin(values, np.asarray(value, dtype="float64"))
+            return ~np.isnan(values) & (found if op == "in" else ~found)
+        if isinstance(value, dict):
+            other = numeric_values(df[value["column_ref"]], schema.get(value["column_ref"]))
+            mask = COMPARISONS[op](values, other)
+        else:
+            mask = COMPARISONS[op](values, value)
+        if op == "<>":
+            mask &= ~np.isnan(values)
+        return mask
+
+def validate_frame(df: pd.DataFrame, table: str) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Runs every rule of table over df in one pass
+
+    Returns:
+        mask of the rows that pass all rules, dict of rule (as SQL) -> rows it rejected (a row failing several rules counts for each)
+    """
+    schema = table_schema(table)
+    keep = np.ones(len(df), dtype=bool)
+    rejected = {}
+    for r in VALIDATION_RULES[table]:
+        mask = rule_mask(df, r, schema)
+        rejected[rule_sql(r)] = int(len(mask) - np.count_nonzero(mask))
+        keep &= mask
+    return keep, rejected
+
+def drop_invalid_rows(df: pd.DataFrame, table: str, verbose: bool = True) -> pd.DataFrame:
+    """
+    Returns the rows of df that the valid_* view of table would keep
+    """
+    if df is None or df.empty:
+        return df
+    keep, rejected = validate_frame(df, table)
+    if verbose:
+        print(f"[validation_rules] {table}: kept {int(keep.sum())} of {len(df)} rows")
+        for sql, rows in rejected.items():
+            if rows:
+                print(f"[validation_rules]     {rows:>8} rejected by {sql}")
+    return df[keep]
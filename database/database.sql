@@ -12,10 +12,16 @@
 DROP TABLE IF EXISTS Borrowers CASCADE;
 DROP TABLE IF EXISTS Accepted_Loans CASCADE;
 DROP TABLE IF EXISTS Rejected CASCADE;
+DROP SEQUENCE IF EXISTS hdma_loan_id_seq;
+DROP TABLE IF EXISTS etl_load_state;
+
+-- loan ids of the HDMA loans (they have no id of their own), starts far above the Kaggle `id` values so they never collide
+CREATE SEQUENCE hdma_loan_id_seq AS INTEGER START WITH 1000000000 CACHE 100;
 
 -- customers table
 CREATE TABLE Borrowers (
     borrower_id                     BIGSERIAL PRIMARY KEY, -- auto gen
+    fingerprint                     UUID NOT NULL UNIQUE, -- hash of the source + feature tuple, loans are linked on it (ETL/load/mapping/fingerprint.py)
 
     -- kaggle
     annual_inc                      NUMERIC(14, 2),
@@ -41,9 +47,10 @@ CREATE TABLE Borrowers (
     created_at                      TIMESTAMPTZ DEFAULT now() -- records when borrower is entered into system
 );
 
--- accepted table
+-- accepted table, list partitioned by source (ETL/load/partitions.py creates the yearly HDMA partitions)
 CREATE TABLE Accepted_Loans (
-    loan_id                         INTEGER PRIMARY KEY,           -- from kaggle `id`
+    loan_id                         INTEGER NOT NULL,           -- from kaggle `id`, hdma_loan_id_seq for hdma (primary key of each partition)
+    dataset_source                  TEXT NOT NULL, -- 'kaggle' or 'hdma', partition key
 
     borrower_id                     INTEGER NOT NULL REFERENCES borrowers(borrower_id),
 
@@ -70,13 +77,21 @@ CREATE TABLE Accepted_Loans (
     loan_purpose                    TEXT,         -- different from kaggle purpose
 
     created_at                      TIMESTAMPTZ DEFAULT now()
-);
+) PARTITION BY LIST (dataset_source);
+
+-- a partitioned table can only have unique keys that include every partition key, so loan_id is unique per partition
+-- kaggle ids and hdma_loan_id_seq never overlap: the CHECKs keep kaggle ids below the first value of the sequence, so loan_id stays unique across sources
+-- the mappings load each source partition directly
+CREATE TABLE accepted_loans_kaggle PARTITION OF Accepted_Loans (PRIMARY KEY (loan_id), CHECK (loan_id < 1000000000)) FOR VALUES IN ('kaggle');
+CREATE TABLE accepted_loans_hdma PARTITION OF Accepted_Loans (CHECK (loan_id >= 1000000000)) FOR VALUES IN ('hdma') PARTITION BY RANGE (activity_year);
+-- rows without a yearly partition (NULL activity_year), the yearly partitions are added before each load
+CREATE TABLE accepted_loans_hdma_default PARTITION OF accepted_loans_hdma (PRIMARY KEY (loan_id)) DEFAULT;
 
--- rejected table for lendingclub 
+-- rejected table for lendingclub, list partitioned by source then by year (application_date for kaggle, activity_year for hdma)
 CREATE TABLE Rejected ( 
-    application_id                  BIGSERIAL PRIMARY KEY, -- auto gen
+    application_id                  BIGSERIAL, -- auto gen (primary key of each partition)
 
-    dataset_source                  TEXT, -- track which dataset the info is coming from / might delete this field later idk
+    dataset_source                  TEXT NOT NULL, -- 'kaggle' or 'hdma', partition key
 
     -- kaggle
     amount_requested                NUMERIC(12, 2), -- map to "Amount Requested" in kaggle
@@ -99,6 +114,23 @@ CREATE TABLE Rejected (
     denial_reason_1                 TEXT, 
 
     created_at                      TIMESTAMPTZ DEFAULT now()
+) PARTITION BY LIST (dataset_source);
+
+CREATE TABLE rejected_kaggle PARTITION OF Rejected FOR VALUES IN ('kaggle') PARTITION BY RANGE (application_date);
+CREATE TABLE rejected_kaggle_default PARTITION OF rejected_kaggle (PRIMARY KEY (application_id)) DEFAULT;
+CREATE TABLE rejected_hdma PARTITION OF Rejected FOR VALUES IN ('hdma') PARTITION BY RANGE (activity_year);
+CREATE TABLE rejected_hdma_default PARTITION OF rejected_hdma (PRIMARY KEY (application_id)) DEFAULT;
+
+-- one row per source file: what the core tables were loaded from (ETL/transformation/incremental_loader.py)
+-- reset with the core tables, the full run of ETL/run_etl.py records the first watermarks
+CREATE TABLE etl_load_state (
+    source                          TEXT PRIMARY KEY, -- kaggle_accepted, kaggle_rejected, hdma_accepted, hdma_rejected
+    file                            TEXT NOT NULL, -- parquet file the rows were read from, relative to training_data
+    content_hash                    TEXT NOT NULL, -- sha256 of the source file
+    row_watermark                   BIGINT NOT NULL, -- raw rows [0, row_watermark) of the file are loaded
+    row_groups                      JSONB NOT NULL, -- start, rows, sha256 of the bytes and digest of the rows of each parquet row group, finds the rows that changed
+    rows_staged                     BIGINT NOT NULL DEFAULT 0, -- cleaned rows sent to staging by the last load
+    loaded_at                       TIMESTAMPTZ DEFAULT now()
 );
 
 -- ml table?
\ No newline at end of file
@@ -0,0 +1,39 @@
+-- psql -d credit_risk -f database/feature_store.sql (or python -m ETL.ml.feature_store, which creates it when missing)
+
+-- feature store of accepted_loans_ml_training (ETL/ml/feature_store.py)
+-- not dropped by database.sql: a full ETL run reloads Accepted_Loans, the snapshots models were trained on stay readable
+-- the Kaggle loan ids come from the source `id`, so the same loan keeps its loan_id across full runs
+
+-- one row per snapshot, a snapshot is never modified once created
+CREATE TABLE IF NOT EXISTS feature_snapshots (
+    snapshot_id                     SERIAL PRIMARY KEY,
+    source_key                      TEXT NOT NULL, -- version of the view and Accepted_Loans it was built from (ETL/ml/features.py)
+    loans                           INTEGER NOT NULL DEFAULT 0, -- rows in the snapshot
+    appended                        INTEGER NOT NULL DEFAULT 0, -- new or changed loans, written with valid_from = snapshot_id
+    retired                         INTEGER NOT NULL DEFAULT 0, -- changed or removed loans, closed with valid_to = snapshot_id
+    note                            TEXT,
+    created_at                      TIMESTAMPTZ DEFAULT now()
+);
+
+-- one row per version of the features of a loan, snapshot S holds the rows with valid_from <= S < valid_to
+CREATE TABLE IF NOT EXISTS loan_features (
+    loan_id                         INTEGER NOT NULL,
+    valid_from                      INTEGER NOT NULL REFERENCES feature_snapshots (snapshot_id),
+    valid_to                        INTEGER REFERENCES feature_snapshots (snapshot_id), -- NULL while the row is current
+    row_hash                        UUID NOT NULL, -- md5 of the feature row, a loan gets a new version only when it changes
+
+    -- columns of accepted_loans_ml_training (ETL/ml/ml_training_acc.py)
+    borrower_id                     INTEGER,
+    is_default                      INTEGER,
+    loan_amnt                       NUMERIC(12, 2),
+    installment                     NUMERIC(12, 2),
+    dti                             NUMERIC(6, 2),
+    income                          NUMERIC(14, 2),
+    term_months                     SMALLINT,
+    purpose                         VARCHAR(50),
+
+    PRIMARY KEY (loan_id, valid_from) -- point lookup of a loan at any snapshot
+);
+
+-- current version of each loan (scoring and the next refresh)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_loan_features_current ON loan_features (loan_id) WHERE valid_to IS NULL;
@@ -6,6 +6,7 @@ DROP INDEX IF EXISTS idx_accepted_loans_status;
 DROP INDEX IF EXISTS idx_accepted_loans_purpose;
 DROP INDEX IF EXISTS idx_accepted_loans_application_type;
 DROP INDEX IF EXISTS idx_accepted_loans_activity_year;
+DROP INDEX IF EXISTS idx_accepted_loans_created_at;
 
 -- borrowers
 DROP INDEX IF EXISTS idx_borrowers_dti;
@@ -19,6 +20,7 @@ DROP INDEX IF EXISTS idx_rejected_dataset_source;
 DROP INDEX IF EXISTS idx_rejected_dti;
 DROP INDEX IF EXISTS idx_rejected_loan_purpose;
 DROP INDEX IF EXISTS idx_rejected_activity_year;
+DROP INDEX IF EXISTS idx_rejected_created_at;
 
 -- speed up joins to borrower features
 CREATE INDEX idx_accepted_loans_borrower ON Accepted_Loans (borrower_id);
@@ -32,8 +34,9 @@ CREATE INDEX idx_accepted_loans_purpose ON Accepted_Loans (purpose);
 -- frequent slicing by application type
 CREATE INDEX idx_accepted_loans_application_type ON Accepted_Loans (application_type);
 
--- year-based analysis for hdma
-CREATE INDEX idx_accepted_loans_activity_year ON Accepted_Loans (activity_year);
+-- source / activity_year filters are answered by partition pruning (database.sql), no B-tree needed
+-- load order for incremental runs, BRIN stays tiny since created_at grows with the physical order of the rows
+CREATE INDEX idx_accepted_loans_created_at ON Accepted_Loans USING BRIN (created_at);
 
 -- dti
 CREATE INDEX idx_borrowers_dti ON Borrowers (dti);
@@ -50,14 +53,11 @@ CREATE INDEX idx_borrowers_income ON Borrowers (income);
 -- credit score type(s) for HDMA borrowers
 CREATE INDEX idx_borrowers_credit_score_type ON Borrowers (applicant_credit_score_type, co_applicant_credit_score_type);
 
--- for spliting Kaggle vs HDMA rejected loans
-CREATE INDEX idx_rejected_dataset_source ON Rejected (dataset_source);
-
 -- DTI on rejected
 CREATE INDEX idx_rejected_dti ON Rejected (dti);
 
 -- rejected by loan_purpose
 CREATE INDEX idx_rejected_loan_purpose ON Rejected (loan_purpose);
 
--- year filters for rej hdma rows
-CREATE INDEX idx_rejected_activity_year ON Rejected (activity_year);
+-- kaggle vs hdma and year filters are answered by partition pruning
+CREATE INDEX idx_rejected_created_at ON Rejected USING BRIN (created_at);
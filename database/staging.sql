@@ -31,14 +31,16 @@ CREATE TABLE staging_accepted_kaggle (
     verification_status             TEXT,
     loan_status                     TEXT,
     purpose                         TEXT,
-    application_type                TEXT
+    application_type                TEXT,
+    staging_row_id                  BIGINT GENERATED BY DEFAULT AS IDENTITY -- row key of the valid_* materialized views
 );
 
 CREATE TABLE staging_rejected_kaggle (
     "Amount Requested"              NUMERIC(12, 2),
     "Application Date"              TEXT,       
     "Loan Title"                    TEXT,
-    "Debt-To-Income Ratio"          TEXT         
+    "Debt-To-Income Ratio"          TEXT,
+    staging_row_id                  BIGINT GENERATED BY DEFAULT AS IDENTITY
 );
 
 CREATE TABLE staging_accepted_hdma (
@@ -47,7 +49,7 @@ CREATE TABLE staging_accepted_hdma (
     interest_rate                   NUMERIC(5, 2), 
 
     income                          NUMERIC(14, 2),
-    debt_to_income_ratio            TEXT,         
+    debt_to_income_ratio            NUMERIC(6, 2),         
     applicant_credit_score_type     TEXT,
     co_applicant_credit_score_type  TEXT,
 
@@ -57,7 +59,8 @@ CREATE TABLE staging_accepted_hdma (
     loan_to_value_ratio             NUMERIC(5, 2),
     total_loan_costs                NUMERIC(12, 2),
     derived_loan_product_type       TEXT,
-    loan_purpose                    TEXT
+    loan_purpose                    TEXT,
+    staging_row_id                  BIGINT GENERATED BY DEFAULT AS IDENTITY
 );
 
 CREATE TABLE staging_rejected_hdma (
@@ -69,9 +72,10 @@ CREATE TABLE staging_rejected_hdma (
     loan_term                       SMALLINT,
     loan_to_value_ratio             NUMERIC(10,2),
     income                          NUMERIC(14, 2),
-    debt_to_income_ratio            TEXT,        
+    debt_to_income_ratio            NUMERIC(6, 2),        
     derived_loan_product_type       TEXT,
     applicant_credit_score_type     TEXT,
     co_applicant_credit_score_type TEXT,
-    denial_reason_1                 TEXT
+    denial_reason_1                 TEXT,
+    staging_row_id                  BIGINT GENERATED BY DEFAULT AS IDENTITY
 );
\ No newline at end of file